@@ -0,0 +1,225 @@
+import contextlib
+import glob
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger("qa_assistant.artifacts")
+
+# Longest side of generated image thumbnails in pixels
+THUMBNAIL_SIZE = 512
+
+
+class BlobWriter:
+    """
+    Writes a blob to a temporary file chunk by chunk while hashing it.
+    commit() moves it into the store under its digest; discard() drops it.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.size = 0
+        self._hash = hashlib.sha256()
+        self._tmp_path = os.path.join(store.directory, "objects", f"{uuid.uuid4().hex}.tmp")
+        self._file = open(self._tmp_path, "wb")
+
+    def write(self, chunk):
+        self._file.write(chunk)
+        self._hash.update(chunk)
+        self.size += len(chunk)
+
+    def commit(self, file_id=None):
+        """
+        Store the written blob, map file_id to it if given, and return its digest.
+        """
+        self._file.close()
+        digest = self._hash.hexdigest()
+        path = self.store._blob_path(digest)
+        if os.path.exists(path):
+            os.remove(self._tmp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(self._tmp_path, path)
+        self.store._register(digest, self.size, file_id)
+        return digest
+
+    def discard(self):
+        self._file.close()
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self._tmp_path)
+
+
+class ArtifactStore:
+    """
+    A content-addressed store for generated files (code interpreter downloads and images).
+    Blobs are kept on disk under their SHA-256 and indexed in SQLite by digest and by
+    OpenAI file ID, so chat history only needs to hold small references. The least recently
+    used blobs are evicted once their total size exceeds max_bytes; thumbnails are derived
+    from blobs and removed together with them.
+    """
+
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(directory, "objects"), exist_ok=True)
+        os.makedirs(os.path.join(directory, "thumbnails"), exist_ok=True)
+        self.db_path = os.path.join(directory, "index.sqlite3")
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS blobs ("
+                " digest TEXT PRIMARY KEY,"
+                " size INTEGER NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS blobs_accessed_at ON blobs (accessed_at)")
+            conn.execute("CREATE TABLE IF NOT EXISTS files (file_id TEXT PRIMARY KEY, digest TEXT NOT NULL)")
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _blob_path(self, digest):
+        return os.path.join(self.directory, "objects", digest[:2], digest)
+
+    def _thumbnail_path(self, digest, size):
+        return os.path.join(self.directory, "thumbnails", f"{digest}-{size}.png")
+
+    def writer(self):
+        """
+        Return a BlobWriter for storing a blob that arrives in chunks.
+        """
+        return BlobWriter(self)
+
+    def put(self, data, file_id=None):
+        """
+        Store data, map file_id to it if given, and return its digest.
+        """
+        writer = self.writer()
+        try:
+            writer.write(data)
+        except BaseException:
+            writer.discard()
+            raise
+        return writer.commit(file_id)
+
+    def _register(self, digest, size, file_id):
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT INTO blobs (digest, size, created_at, accessed_at) VALUES (?, ?, ?, ?)"
+                " ON CONFLICT(digest) DO UPDATE SET accessed_at = excluded.accessed_at",
+                (digest, size, now, now),
+            )
+            if file_id:
+                conn.execute("INSERT OR REPLACE INTO files (file_id, digest) VALUES (?, ?)", (file_id, digest))
+            evicted = self._evict(conn, keep=digest)
+        self._remove_files(evicted)
+
+    def _evict(self, conn, keep=None):
+        """
+        Drop the least recently used blobs beyond max_bytes from the index and return their digests.
+        """
+        if self.max_bytes is None:
+            return []
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+        evicted = []
+        if total <= self.max_bytes:
+            return evicted
+        for digest, size in conn.execute("SELECT digest, size FROM blobs ORDER BY accessed_at").fetchall():
+            if total <= self.max_bytes:
+                break
+            if digest == keep:
+                continue
+            conn.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+            conn.execute("DELETE FROM files WHERE digest = ?", (digest,))
+            total -= size
+            evicted.append(digest)
+        return evicted
+
+    def _remove_files(self, digests):
+        for digest in digests:
+            for path in [self._blob_path(digest)] + glob.glob(self._thumbnail_path(digest, "*")):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
+        if digests:
+            logger.info(f"Evicted {len(digests)} artifact(s) from {self.directory}")
+
+    def digest_for(self, file_id):
+        """
+        Return the digest stored for an OpenAI file ID, or None if it is not cached.
+        """
+        with self._lock, self._connect() as conn:
+            row = conn.execute("SELECT digest FROM files WHERE file_id = ?", (file_id,)).fetchone()
+        if row is None or not os.path.exists(self._blob_path(row[0])):
+            return None
+        return row[0]
+
+    def path(self, digest):
+        """
+        Return the path of a blob and mark it as recently used, or None if it is not stored.
+        """
+        path = self._blob_path(digest)
+        if not os.path.exists(path):
+            return None
+        with self._lock, self._connect() as conn:
+            conn.execute("UPDATE blobs SET accessed_at = ? WHERE digest = ?", (time.time(), digest))
+        return path
+
+    def read(self, digest):
+        """
+        Return the bytes of a blob, or None if it is not stored.
+        """
+        path = self.path(digest)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def thumbnail(self, digest, size=THUMBNAIL_SIZE):
+        """
+        Return the path of a PNG thumbnail of an image blob, creating it on first use.
+        Returns None if the blob is missing or is not an image.
+        """
+        thumbnail_path = self._thumbnail_path(digest, size)
+        if os.path.exists(thumbnail_path):
+            return thumbnail_path
+        source = self.path(digest)
+        if source is None:
+            return None
+        try:
+            from PIL import Image
+
+            with Image.open(source) as image:
+                if image.mode not in ("RGB", "RGBA", "L", "LA", "P"):
+                    image = image.convert("RGB")
+                image.thumbnail((size, size))
+                tmp_path = f"{thumbnail_path}.{uuid.uuid4().hex}.tmp"
+                image.save(tmp_path, "PNG")
+            os.replace(tmp_path, thumbnail_path)
+            return thumbnail_path
+        except Exception as e:
+            logger.warning(f"Error creating thumbnail for {digest}: {str(e)}")
+            return None
+
+    def stats(self):
+        """
+        Return the number of stored blobs and their total size in bytes.
+        """
+        with self._lock, self._connect() as conn:
+            count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+        return {"blobs": count, "bytes": total, "max_bytes": self.max_bytes}
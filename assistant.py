@@ -1,90 +1,615 @@
+import time
+
+# Startup timing starts before the remaining imports so they are included
+STARTUP_STARTED = time.perf_counter()
+# Imported on first use only, so the first page renders without loading them
+DEFERRED_MODULES = ("openai", "httpx", "pypdf", "PIL", "bs4", "nest_asyncio")
+
 import asyncio
 import base64
+import concurrent.futures
+import contextlib
+import contextvars
+import functools
+import hashlib
 import json
-import traceback
-import nest_asyncio
-import requests
-from bs4 import BeautifulSoup
-from openai import OpenAI
+import os
+import queue
+import sys
+import threading
+import unicodedata
+from urllib.parse import urlsplit
 import streamlit as st
-import time
-# Apply nest_asyncio to allow nested event loops
-nest_asyncio.apply()
-
-openai_api_key = st.secrets["api_keys"]["openai_api_key"]
-proxy_api_key = st.secrets["api_keys"]["proxy_api_key"]
-
-try:
-    client = OpenAI(api_key=openai_api_key)
-    print("OpenAI client initialized successfully.")
-except Exception as e:
-    print("Error initializing OpenAI client:", str(e))
-    traceback.print_exc()
-    client = None
-
-# Global thread initialization (use Streamlit session state to store)
-if 'user_thread' not in st.session_state:
+from artifacts import ArtifactStore
+from cache import CACHE_DIR, PersistentCache
+import crawler
+import extraction
+import ratelimit
+import resilience
+import retrieval
+import metrics
+from metrics import get_logger
+
+logger = get_logger("qa_assistant")
+
+# Longest excerpt of prompts, responses or tool output written to debug logs
+LOG_PREVIEW_CHARS = 500
+
+# Rate limits shared by all sessions of a process; divide the account limits by the number of processes
+OPENAI_REQUESTS_PER_MINUTE = 3000
+OPENAI_TOKENS_PER_MINUTE = 1000000
+OPENAI_MAX_RETRIES = 4  # Retries of rate-limited or failed OpenAI requests
+PROXY_CREDITS_PER_MINUTE = 2000
+PROXY_REQUEST_CREDITS = 10  # Credits charged per residential proxy request
+PROXY_MAX_RETRIES = 2
+
+# The process-wide resources below are often first used off the script thread (on the core
+# loop or in worker threads), where Streamlit cannot show a cache spinner, so none is shown.
+@st.cache_resource(show_spinner=False)
+def get_rate_limiters():
+    """
+    Return the process-wide token buckets for OpenAI requests and tokens and for proxy credits.
+    """
+    return {
+        "openai_requests": ratelimit.TokenBucket("openai_requests", OPENAI_REQUESTS_PER_MINUTE / 60),
+        "openai_tokens": ratelimit.TokenBucket("openai_tokens", OPENAI_TOKENS_PER_MINUTE / 60),
+        "proxy_credits": ratelimit.TokenBucket("proxy_credits", PROXY_CREDITS_PER_MINUTE / 60),
+    }
+
+@st.cache_resource(show_spinner=False)
+def get_scrape_flight():
+    """
+    Return the process-wide coalescer of concurrent identical scrapes.
+    """
+    return ratelimit.SingleFlight("scrape")
+
+@st.cache_resource(show_spinner=False)
+def get_client():
+    """
+    Return the process-wide OpenAI client, created on first use.
+    """
+    import httpx
+    from openai import DefaultHttpxClient, OpenAI
+
+    limiters = get_rate_limiters()
+    transport = ratelimit.SyncRateLimitedTransport(
+        httpx.HTTPTransport(), limiters["openai_requests"], limiters["openai_tokens"], OPENAI_MAX_RETRIES
+    )
+    try:
+        client = OpenAI(
+            api_key=st.secrets["api_keys"]["openai_api_key"],
+            max_retries=0,  # Retried by the transport
+            http_client=DefaultHttpxClient(transport=transport),
+        )
+        logger.info("OpenAI client initialized successfully.")
+        return client
+    except Exception as e:
+        logger.exception(f"Error initializing OpenAI client: {str(e)}")
+        raise
+
+@st.cache_resource(show_spinner=False)
+def get_async_client():
+    """
+    Return the process-wide AsyncOpenAI client, created on first use. Its connection pool
+    belongs to the core loop, so it must only be awaited there (see on_core_loop).
+    """
+    import httpx
+    from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+    limiters = get_rate_limiters()
+    transport = ratelimit.RateLimitedTransport(
+        httpx.AsyncHTTPTransport(), limiters["openai_requests"], limiters["openai_tokens"], OPENAI_MAX_RETRIES
+    )
     try:
-        st.session_state.user_thread = client.beta.threads.create()
-        print(f"Created new user thread with ID: {st.session_state.user_thread.id}")
+        client = AsyncOpenAI(
+            api_key=st.secrets["api_keys"]["openai_api_key"],
+            max_retries=0,  # Retried by the transport
+            http_client=DefaultAsyncHttpxClient(transport=transport),
+        )
+        logger.info("Async OpenAI client initialized successfully.")
+        return client
     except Exception as e:
-        print("Error creating user thread:", str(e))
-        traceback.print_exc()
-        st.session_state.user_thread = None
+        logger.exception(f"Error initializing async OpenAI client: {str(e)}")
+        raise
+
+@st.cache_resource(show_spinner=False)
+def get_core_loop():
+    """
+    Return the process-wide event loop that runs the async request pipeline.
+    It runs in a daemon thread shared by all sessions, together with the pooled
+    async clients bound to it, so concurrent conversations do not need a thread each.
+    """
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="qa-assistant-core", daemon=True).start()
+    logger.info("Core event loop started.")
+    return loop
+
+async def on_core_loop(coro):
+    """
+    Await a coroutine on the core loop from any event loop.
+    The coroutine runs in a copy of the caller's context (current trace, assistant ID).
+    """
+    loop = get_core_loop()
+    if asyncio.get_running_loop() is loop:
+        return await coro
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
+def run_async(coro):
+    """
+    Run a coroutine on the core loop and block until it finishes, for synchronous callers.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, get_core_loop()).result()
+
+def get_thread_context():
+    """
+    Return the thread context of the current session, creating its thread on first use.
+    """
+    if st.session_state.get('thread_context') is None:
+        try:
+            thread = run_async(get_async_client().beta.threads.create())
+            st.session_state.thread_context = new_thread_context(thread.id)
+            logger.info(f"Created new user thread with ID: {thread.id}")
+        except Exception as e:
+            logger.exception(f"Error creating user thread: {str(e)}")
+            st.session_state.thread_context = None
+    return st.session_state.thread_context
 
 # Proxy setup
 PROXY_URL = 'https://proxy.scrapeops.io/v1/'
-API_KEY = proxy_api_key
 
-def scrape_content(url):
+def get_proxy_api_key():
+    return st.secrets["api_keys"]["proxy_api_key"]
+
+# Pooled HTTP client settings for the scraping proxy
+SCRAPE_TIMEOUT = 30  # seconds
+SCRAPE_MAX_CONNECTIONS = 50
+SCRAPE_MAX_BYTES = 2 * 1024 * 1024  # Pages are only read up to this size
+
+@st.cache_resource(show_spinner=False)
+def get_http_client():
+    """
+    Return the process-wide async HTTP client used for scraping, created on first use.
+    Like the async OpenAI client it is bound to the core loop.
+    """
+    import httpx
+
+    return httpx.AsyncClient(
+        timeout=SCRAPE_TIMEOUT,
+        follow_redirects=True,
+        limits=httpx.Limits(max_connections=SCRAPE_MAX_CONNECTIONS, max_keepalive_connections=SCRAPE_MAX_CONNECTIONS),
+    )
+
+# Run settings
+STREAM_RUNS = True  # Stream runs token-by-token; falls back to polling if the stream cannot start
+RUN_TIMEOUT = 300  # 5 minutes timeout
+RUN_POLL_INTERVAL = 1  # Seconds between status checks of polled runs
+TOOL_CALL_CONCURRENCY = 5  # Maximum number of tool calls executed in parallel for one run
+TOOL_CALL_TIMEOUT = 60  # Per-call deadline in seconds
+
+# Context budget of each run (None leaves the API default)
+RUN_TRUNCATION_STRATEGY = {"type": "last_messages", "last_messages": 20}
+RUN_MAX_PROMPT_TOKENS = 50000
+RUN_MAX_COMPLETION_TOKENS = 4000
+# Appended to answers of runs that stopped at a token cap; such answers are not cached
+INCOMPLETE_ANSWER_NOTICE = "\n\n_(This answer was cut off because it reached the length limit.)_"
+
+# Scrape cache settings (shared on disk by all worker processes)
+SCRAPE_CACHE_TTL = 3600  # seconds
+SCRAPE_STALE_TTL = 7 * 24 * 3600  # Older copies are kept this long as a fallback while a site is unreachable
+SCRAPE_CACHE_MAX_ENTRIES = 500
+scrape_cache = PersistentCache(
+    os.path.join(CACHE_DIR, "scrape_cache.sqlite3"),
+    ttl=SCRAPE_STALE_TTL,
+    max_entries=SCRAPE_CACHE_MAX_ENTRIES,
+)
+
+# Scrape routes: "residential" and "datacenter" go through the proxy, "direct" fetches the page itself.
+# When the primary route is slower than usual the hedge routes are tried as well, first answer wins.
+SCRAPE_PRIMARY_ROUTE = "residential"
+SCRAPE_HEDGE_ROUTES = ["datacenter"]
+SCRAPE_HEDGE_PERCENTILE = 0.9  # Hedge once the primary route is slower than this share of recent scrapes
+SCRAPE_HEDGE_MIN_SAMPLES = 20  # Until there are enough samples, hedge after SCRAPE_HEDGE_DEFAULT_DELAY
+SCRAPE_HEDGE_DEFAULT_DELAY = 5  # seconds
+SCRAPE_HEDGE_MIN_DELAY = 0.5  # seconds
+
+# Circuit breakers per route and per host open after this many consecutive failures
+SCRAPE_BREAKER_FAILURES = 5
+SCRAPE_BREAKER_RESET = 60  # Seconds before an open breaker lets a trial request through
+
+@st.cache_resource(show_spinner=False)
+def get_scrape_breakers():
+    """
+    Return the process-wide circuit breakers of the scrape routes and hosts.
+    """
+    return resilience.CircuitBreakers(SCRAPE_BREAKER_FAILURES, SCRAPE_BREAKER_RESET)
+
+@st.cache_resource(show_spinner=False)
+def get_scrape_latency():
+    """
+    Return the tracker of recent primary route latencies used to time hedged scrapes.
+    """
+    return resilience.LatencyTracker()
+
+# Scrape output: by default only the passages of a page that best match the user's question
+SCRAPE_FULL_PAGE = False  # Always return whole pages
+SCRAPE_MAX_CHARS = 6000  # Text budget per scraped page (roughly 1500 tokens)
+SCRAPE_PASSAGE_CHARS = 600  # Size of the passages the page text is split into
+SCRAPE_TOP_K = 8  # Most passages returned per page
+SCRAPE_MAX_LINKS = 25  # Most links returned per page
+
+# Uploaded files are registered by the SHA-256 of their bytes so reruns reuse the OpenAI file ID
+UPLOAD_CONCURRENCY = 4
+upload_registry = PersistentCache(
+    os.path.join(CACHE_DIR, "upload_registry.sqlite3"),
+    ttl=None,
+    max_entries=None,
+)
+
+# Assistants are registered by a fingerprint of their configuration so they can be reused
+ASSISTANT_NAME = "Q&A AI assistant"
+ASSISTANT_MODEL = "gpt-4o-mini"
+assistant_registry = PersistentCache(
+    os.path.join(CACHE_DIR, "assistant_registry.sqlite3"),
+    ttl=None,
+    max_entries=None,
+)
+
+# Long conversations are compacted into a summary on a fresh thread (None disables a trigger).
+# A thread is also always compacted before RUN_TRUNCATION_STRATEGY would drop messages from
+# it, so runs see the summary and every turn after it.
+COMPACT_AFTER_TURNS = None
+COMPACT_AFTER_PROMPT_TOKENS = 25000  # Prompt tokens used by the last run of the thread
+COMPACT_KEEP_TURNS = 4  # Most recent turns copied verbatim to the new thread
+SUMMARY_MODEL = ASSISTANT_MODEL
+SUMMARY_MAX_TOKENS = 800
+SUMMARY_INPUT_CHARS = 60000  # Longest transcript sent for summarization
+SUMMARY_INSTRUCTIONS = (
+    "Summarize the following conversation between a user and a company information assistant. "
+    "Keep the facts, figures, names, links and open questions that later answers may need. "
+    "Write the summary in the language of the conversation."
+)
+
+# Answers to the first question of a conversation are cached per assistant, language and normalized prompt
+ANSWER_CACHE_TTL = 24 * 3600  # seconds
+ANSWER_CACHE_MAX_ENTRIES = 2000
+ANSWER_CACHE_NEAR_DUPLICATES = False  # Also serve answers for prompts that are nearly identical
+ANSWER_CACHE_SIMILARITY = 0.85  # Minimum Jaccard similarity of prompt terms for a near-duplicate hit
+# Negations are kept as prompt terms for near-duplicate matching, they flip the question
+ANSWER_CACHE_NEGATIONS = {"not", "no", "never", "nicht", "kein", "keine", "keinen", "keinem", "keiner", "nie", "niemals"}
+answer_cache = PersistentCache(
+    os.path.join(CACHE_DIR, "answer_cache.sqlite3"),
+    ttl=ANSWER_CACHE_TTL,
+    max_entries=ANSWER_CACHE_MAX_ENTRIES,
+)
+
+# Generated files are kept on disk by content hash; chat history only holds references
+ARTIFACT_DIR = os.path.join(CACHE_DIR, "artifacts")
+ARTIFACT_STORE_MAX_BYTES = 512 * 1024 * 1024
+ARTIFACT_DOWNLOAD_CONCURRENCY = 4  # Parallel downloads per answer
+ARTIFACT_CHUNK_SIZE = 64 * 1024  # Downloads are streamed to disk in chunks of this size
+artifact_store = ArtifactStore(ARTIFACT_DIR, max_bytes=ARTIFACT_STORE_MAX_BYTES)
+
+# Local BM25 index over the documents of each assistant
+DOCUMENT_INDEX_DIR = os.path.join(CACHE_DIR, "document_index")
+DOCUMENT_SEARCH_TOP_K = 5
+
+# Assistant serving the current request, used by tools that need per-assistant state
+current_assistant_id = contextvars.ContextVar("current_assistant_id", default=None)
+# Question of the current request, used by tools to pick relevant content
+current_question = contextvars.ContextVar("current_question", default=None)
+
+async def read_capped(response):
+    """
+    Read a streamed response body, stopping (and dropping the connection) at SCRAPE_MAX_BYTES.
+    """
+    chunks = []
+    size = 0
+    async for chunk in response.aiter_bytes():
+        chunks.append(chunk)
+        size += len(chunk)
+        if size >= SCRAPE_MAX_BYTES:
+            break
+    return b"".join(chunks)
+
+async def proxy_request(url, residential=True):
     """
-    Fetches HTML from the target URL using the proxy service, extracts text content,
-    and deduplicates href links.
+    Fetch a page through the proxy service and return its status code and body, reading at
+    most SCRAPE_MAX_BYTES. Requests are paced by the shared proxy credit budget; rate-limited
+    and failed attempts are retried with backoff (honoring Retry-After).
     """
     params = {
-        'api_key': API_KEY,
+        'api_key': get_proxy_api_key(),
         'url': url,
         'render_js': 'false',
-        'residential': 'true',
+        'residential': 'true' if residential else 'false',
     }
-    
-    try:
-        with st.spinner(f"Scraping content from {url}..."):
-            # Make the request to the proxy service
-            response = requests.get(PROXY_URL, params=params, timeout=30)
-            response.encoding = 'utf-8'  # Enforce UTF-8 encoding
-            
-            # Check if the request was successful
+    for attempt in range(PROXY_MAX_RETRIES + 1):
+        await get_rate_limiters()["proxy_credits"].acquire(PROXY_REQUEST_CREDITS)
+        body = b""
+        with metrics.span("proxy_request", url=url, residential=residential, attempt=attempt) as span:
+            async with get_http_client().stream("GET", PROXY_URL, params=params) as response:
+                span["status_code"] = response.status_code
+                if response.status_code == 200:
+                    body = await read_capped(response)
+        delay = None
+        if attempt < PROXY_MAX_RETRIES and ratelimit.should_retry(response):
+            delay = ratelimit.retry_delay(attempt, ratelimit.parse_retry_after(response.headers))
+        if delay is None:
+            return response.status_code, body
+        logger.warning(f"Proxy returned {response.status_code} for {url}, retrying in {delay:.1f}s")
+        metrics.RETRIES_TOTAL.inc(target="proxy")
+        await asyncio.sleep(delay)
+
+async def direct_request(url):
+    """
+    Fetch a page without the proxy and return its status code and body (at most SCRAPE_MAX_BYTES).
+    """
+    body = b""
+    with metrics.span("direct_request", url=url) as span:
+        async with get_http_client().stream("GET", url) as response:
+            span["status_code"] = response.status_code
             if response.status_code == 200:
-                soup = BeautifulSoup(response.text, 'html.parser')
-                
-                # Extract and clean the text content
-                content = soup.get_text(separator="\n", strip=True)
-                
-                # Extract and deduplicate href links using set comprehension
-                links = sorted({a.get('href') for a in soup.find_all('a', href=True) if a.get('href')})
-                
-                st.success(f"Successfully scraped content from {url}")
-                return {
-                    'content': content,
-                    'links': links  # Return the sorted list of links
-                }
-            else:
-                st.error(f"Failed to fetch the page: {url}, status code: {response.status_code}")
-                return None
-    except requests.exceptions.Timeout:
-        st.error(f"Request timed out while trying to scrape {url}.")
+                body = await read_capped(response)
+    return response.status_code, body
+
+def is_scrape_failure(status_code):
+    """
+    Whether a status code means the route or site failed rather than answered (e.g. 404).
+    """
+    return status_code in ratelimit.RETRY_STATUS_CODES or status_code >= 500
+
+async def fetch_route(url, route):
+    """
+    Fetch a page over one scrape route, failing fast while the route's circuit breaker is open.
+    Only transport failures (the proxy or connection) count against the route: any HTTP
+    response means the route works, its status belongs to the target site and counts against
+    the site's host breaker (see fetch_page).
+    """
+    import httpx
+
+    breaker = get_scrape_breakers().get(f"route:{route}")
+    if not breaker.allow():
+        raise resilience.CircuitOpenError(f"Scrape route {route} is unavailable")
+    started = time.perf_counter()
+    # Slow attempts that time out or lose the hedge race are sampled too (as a lower bound),
+    # otherwise the hedge delay would drift down; only fast errors are left out
+    sample = route == SCRAPE_PRIMARY_ROUTE
+    try:
+        if route == "direct":
+            status_code, body = await direct_request(url)
+        else:
+            status_code, body = await proxy_request(url, residential=route == "residential")
+    except Exception as e:
+        breaker.record_failure()
+        sample = sample and isinstance(e, httpx.TimeoutException)
+        raise
+    else:
+        breaker.record_success()
+        return status_code, body
+    finally:
+        if sample:
+            get_scrape_latency().observe(time.perf_counter() - started)
+
+def hedge_delay():
+    """
+    Seconds to wait for the primary route before hedging: a high percentile of its recent latency.
+    """
+    latency = get_scrape_latency()
+    if len(latency) < SCRAPE_HEDGE_MIN_SAMPLES:
+        return SCRAPE_HEDGE_DEFAULT_DELAY
+    return max(SCRAPE_HEDGE_MIN_DELAY, latency.percentile(SCRAPE_HEDGE_PERCENTILE))
+
+async def stale_page(cache_key):
+    """
+    Return the last scraped copy of a page, marked as stale, or None if there is none.
+    """
+    page = await asyncio.to_thread(scrape_cache.get, cache_key)
+    if page is None:
         return None
-    except requests.exceptions.TooManyRedirects:
-        st.error(f"Too many redirects while trying to scrape {url}.")
+    logger.info(f"Serving stale copy of {cache_key}")
+    return dict(page, stale=True)
+
+async def fetch_page(url):
+    """
+    Fetches HTML from the target URL and extracts its text content and links in one
+    streaming pass (see extraction.PageExtractor). At most SCRAPE_MAX_BYTES of the page are
+    read. Results are served from the shared scrape cache when fresh.
+
+    The page is requested over SCRAPE_PRIMARY_ROUTE, hedged with SCRAPE_HEDGE_ROUTES when
+    that is slow or fails. While the host's circuit breaker is open, or if every route
+    fails, the last cached copy is returned instead.
+    """
+    import httpx
+
+    cache_key = extraction.normalize_url(url)
+    host = urlsplit(cache_key).hostname
+    if not host or urlsplit(cache_key).scheme not in ("http", "https"):
+        logger.error(f"Not scraping {url}: not an http(s) URL with a host.")
         return None
-    except requests.exceptions.RequestException as e:
-        st.error(f"An error occurred while scraping {url}: {e}")
+    if not urlsplit(url).netloc:
+        url = cache_key  # e.g. "example.com/page" without a scheme
+    cached = await asyncio.to_thread(scrape_cache.get, cache_key, SCRAPE_CACHE_TTL)
+    if cached is not None:
+        logger.info(f"Scrape cache hit for {cache_key}")
+        return cached
+
+    host_breaker = get_scrape_breakers().get(f"host:{host}")
+    if not host_breaker.allow():
+        logger.warning(f"Circuit breaker for {url} is open, not scraping it.")
+        return await stale_page(cache_key)
+
+    try:
+        logger.info(f"Scraping content from {url}...")
+        routes = [SCRAPE_PRIMARY_ROUTE] + [route for route in SCRAPE_HEDGE_ROUTES if route != SCRAPE_PRIMARY_ROUTE]
+        route, (status_code, body) = await resilience.hedged(
+            [(route, functools.partial(fetch_route, url, route)) for route in routes],
+            hedge_delay(),
+            accept=lambda result: not is_scrape_failure(result[0]),
+        )
+        if is_scrape_failure(status_code):
+            host_breaker.record_failure()
+        else:
+            host_breaker.record_success()
+
+        # Check if the request was successful
+        if status_code == 200:
+            if len(body) >= SCRAPE_MAX_BYTES:
+                logger.warning(f"Page {url} exceeds {SCRAPE_MAX_BYTES} bytes, extracting only the beginning.")
+            # Parsing is CPU-bound, keep it off the event loop
+            with metrics.span("html_parse", url=url, html_bytes=min(len(body), SCRAPE_MAX_BYTES)):
+                result = await asyncio.to_thread(extraction.extract_page, body, url, SCRAPE_MAX_BYTES)
+
+            logger.info(f"Successfully scraped content from {url} via {route}")
+            await asyncio.to_thread(scrape_cache.set, cache_key, result)
+            return result
+        else:
+            logger.error(f"Failed to fetch the page: {url}, status code: {status_code}")
+            return await stale_page(cache_key) if is_scrape_failure(status_code) else None
+    except resilience.CircuitOpenError as e:
+        logger.warning(f"Not scraping {url}: {e}")
+        return await stale_page(cache_key)
+    except httpx.TimeoutException:
+        logger.error(f"Request timed out while trying to scrape {url}.")
+        host_breaker.record_failure()
+        return await stale_page(cache_key)
+    except httpx.TooManyRedirects:
+        logger.error(f"Too many redirects while trying to scrape {url}.")
         return None
+    except httpx.HTTPError as e:
+        logger.error(f"An error occurred while scraping {url}: {e}")
+        host_breaker.record_failure()
+        return await stale_page(cache_key)
     except Exception as ex:
-        st.error(f"Unexpected error while scraping {url}: {ex}")
-        traceback.print_exc()
+        logger.exception(f"Unexpected error while scraping {url}: {ex}")
+        return None
+
+def select_passages(page, question, max_chars=SCRAPE_MAX_CHARS, top_k=SCRAPE_TOP_K, max_links=SCRAPE_MAX_LINKS):
+    """
+    Reduce a scraped page to the passages and links that best match the question (BM25),
+    within max_chars of text. Passages keep their order on the page; without a question
+    the leading passages are kept.
+    """
+    content, links = page['content'], page['links']
+    if len(content) <= max_chars and len(links) <= max_links:
+        return page
+
+    # The extracted text has one line per element, pack lines into passages
+    passages = [
+        chunk.replace("\n\n", "\n")
+        for chunk in retrieval.chunk_text(content.replace("\n", "\n\n"), SCRAPE_PASSAGE_CHARS)
+    ]
+    scores = retrieval.score_passages(question, passages) if question else [0.0] * len(passages)
+    selected = []
+    used = 0
+    for i in sorted(range(len(passages)), key=lambda i: (-scores[i], i)):
+        if len(selected) >= top_k:
+            break
+        if used + len(passages[i]) > max_chars:
+            continue
+        selected.append(i)
+        used += len(passages[i])
+    selected.sort()
+
+    parts = []
+    for position, i in enumerate(selected):
+        if position and i != selected[position - 1] + 1:
+            parts.append("[...]")
+        parts.append(passages[i])
+
+    links = [link for link in links if not link.startswith(("#", "javascript:", "mailto:", "tel:"))]
+    link_scores = retrieval.score_passages(question, links) if question else [0.0] * len(links)
+    ranked_links = sorted(range(len(links)), key=lambda i: (-link_scores[i], i))[:max_links]
+    return dict(
+        page,
+        content="\n".join(parts),
+        links=[links[i] for i in sorted(ranked_links)],
+        note=(
+            f"Showing {len(selected)} of {len(passages)} passages and {len(ranked_links)} of {len(links)} links "
+            "most relevant to the question. Call scrape_content with full_page=true for the whole page."
+        ),
+    )
+
+async def scrape_content(url, full_page=False):
+    """
+    Scrapes a page and returns the passages and links most relevant to the current
+    question, or the whole page when full_page (or SCRAPE_FULL_PAGE) is set.
+    """
+    # Sessions asking for the same page at the same time share one fetch
+    page = await get_scrape_flight().do(extraction.normalize_url(url), lambda: fetch_page(url))
+    if page is None or full_page or SCRAPE_FULL_PAGE:
+        return page
+    with metrics.span("passage_select", url=url):
+        return await asyncio.to_thread(select_passages, page, current_question.get())
+
+def document_index_path(assistant_id):
+    """
+    Return the directory of the local document index for an assistant.
+    """
+    return os.path.join(DOCUMENT_INDEX_DIR, assistant_id)
+
+def build_document_index(assistant_id, documents):
+    """
+    Build the local BM25 index over the (name, data) documents of an assistant.
+    The index is only rebuilt when the set of files changed.
+    """
+    path = document_index_path(assistant_id)
+    manifest_path = os.path.join(path, "manifest.json")
+    digests = sorted(hashlib.sha256(data).hexdigest() for _, data in documents)
+    try:
+        if os.path.exists(manifest_path):
+            with open(manifest_path, encoding="utf-8") as f:
+                if json.load(f) == digests:
+                    logger.info(f"Local document index for {assistant_id} is up to date.")
+                    return
+        texts = []
+        for name, data in documents:
+            text = retrieval.extract_text(name, data)
+            if text:
+                texts.append((name, text))
+        retrieval.build_index(path, texts)
+        with open(manifest_path, "w", encoding="utf-8") as f:
+            json.dump(digests, f)
+    except Exception as e:
+        logger.exception(f"Error building local document index for {assistant_id}: {str(e)}")
+
+def search_documents(query, top_k=DOCUMENT_SEARCH_TOP_K):
+    """
+    Searches the local index of the uploaded documents and returns the best matching passages.
+    """
+    assistant_id = current_assistant_id.get()
+    if not assistant_id:
+        return None
+    hits = retrieval.search(document_index_path(assistant_id), query, top_k=int(top_k))
+    if not hits:
         return None
+    return {'passages': hits}
+
+def search_website(query, top_k=DOCUMENT_SEARCH_TOP_K):
+    """
+    Searches the local index of the organisation's website kept by crawler.py and returns
+    the best matching passages with their page URLs.
+    """
+    hits = crawler.search(query, top_k=int(top_k))
+    if not hits:
+        return None
+    return {'passages': [{'url': hit['source'], 'score': hit['score'], 'text': hit['text']} for hit in hits]}
+
+def open_local_indexes(assistant_ids=None):
+    """
+    Open the website index and the document indexes of assistant_ids (all assistants with
+    a local index if None), so the first search does not pay for loading them.
+    """
+    if assistant_ids is None:
+        try:
+            assistant_ids = os.listdir(DOCUMENT_INDEX_DIR)
+        except FileNotFoundError:
+            assistant_ids = []
+    paths = [crawler.CRAWL_INDEX_DIR] + [document_index_path(assistant_id) for assistant_id in assistant_ids]
+    for path in paths:
+        try:
+            retrieval.open_index(path)
+        except Exception as e:
+            logger.exception(f"Error opening local index {path}: {str(e)}")
 
 # Define function specifications for content scraping
 tools = [
@@ -92,19 +617,65 @@ tools = [
         "type": "function",
         "function": {
             "name": "scrape_content",
-            "description": "Use this function to scrape text content from any URL.",
+            "description": "Use this function to scrape text content from any URL. Long pages are reduced to the passages most relevant to the user's question.",
             "parameters": {
                 "type": "object",
                 "properties": {
                     "url": {
                         "type": "string",
                         "description": "The URL to scrape content from."
+                    },
+                    "full_page": {
+                        "type": "boolean",
+                        "description": "Return the whole page instead of the most relevant passages (default false)."
                     }
                 },
                 "required": ["url"]
             }
         }
     },
+    {
+        "type": "function",
+        "function": {
+            "name": "search_documents",
+            "description": "Use this function to quickly look up passages in the uploaded documents with a keyword search.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "query": {
+                        "type": "string",
+                        "description": "Keywords or question to search the documents for."
+                    },
+                    "top_k": {
+                        "type": "integer",
+                        "description": "Number of passages to return (default 5)."
+                    }
+                },
+                "required": ["query"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "search_website",
+            "description": "Use this function to look up passages of the TREUHAND|SUISSE Zurich website in a regularly refreshed local copy. It is much faster than scrape_content; scrape a page only if the passages are not enough or for other websites.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "query": {
+                        "type": "string",
+                        "description": "Keywords or question to search the website for."
+                    },
+                    "top_k": {
+                        "type": "integer",
+                        "description": "Number of passages to return (default 5)."
+                    }
+                },
+                "required": ["query"]
+            }
+        }
+    },
     # The following tool definitions are placeholders, adapt as needed
     {"type": "code_interpreter"},
     {"type": "file_search"}
@@ -113,6 +684,8 @@ tools = [
 # Mapping function names to actual Python callables
 available_functions = {
     "scrape_content": scrape_content,
+    "search_documents": search_documents,
+    "search_website": search_website,
 }
 
 # English instructions
@@ -173,234 +746,1059 @@ Verfassen Sie Ihre Antworten stets auf Grundlage der hochgeladenen Informationen
 WICHTIG: Bitte sprechen Sie NUR auf Deutsch.
 """
 
+def upload_documents(documents, session_registry=None):
+    """
+    Upload (name, data) documents to OpenAI and return their file IDs in order.
+    Files already uploaded (same SHA-256) are looked up in session_registry (digest -> file ID,
+    updated in place) and the persistent upload registry instead of being sent again. Files
+    found in the persistent registry are checked with OpenAI first and sent again if they
+    were deleted there; new files are sent concurrently.
+    """
+    session_registry = session_registry if session_registry is not None else {}
+
+    digests = []
+    pending = {}
+    for name, data in documents:
+        digest = hashlib.sha256(data).hexdigest()
+        digests.append(digest)
+        if digest in session_registry or digest in pending:
+            continue
+        pending[digest] = (name, data, upload_registry.get(digest))
+
+    def upload(digest, name, data, file_id):
+        from openai import NotFoundError
+
+        if file_id:
+            try:
+                get_client().files.retrieve(file_id)
+                logger.info(f"Reusing uploaded file '{name}' -> file ID: {file_id}")
+                return file_id
+            except NotFoundError:
+                logger.warning(f"Registered file ID {file_id} of '{name}' no longer exists, uploading it again")
+                upload_registry.delete(digest)
+        file_info = get_client().files.create(file=(name, data), purpose='assistants')
+        logger.info(f"Uploaded file '{name}' -> assigned file ID: {file_info.id}")
+        upload_registry.set(digest, file_info.id)
+        return file_info.id
+
+    if pending:
+        logger.info(f"Uploading or verifying {len(pending)} file(s)...")
+        with concurrent.futures.ThreadPoolExecutor(max_workers=UPLOAD_CONCURRENCY) as executor:
+            futures = {
+                executor.submit(upload, digest, name, data, file_id): (digest, name)
+                for digest, (name, data, file_id) in pending.items()
+            }
+            for future in concurrent.futures.as_completed(futures):
+                digest, name = futures[future]
+                try:
+                    session_registry[digest] = future.result()
+                except Exception as e:
+                    logger.exception(f"Error uploading file '{name}': {str(e)}")
+
+    return [session_registry[digest] for digest in dict.fromkeys(digests) if digest in session_registry]
+
+def upload_files(uploaded_files):
+    """
+    Upload the given Streamlit files to OpenAI and return their file IDs in order.
+    File IDs are remembered in the session state so reruns do not hash the registry again.
+    """
+    if 'uploaded_file_ids' not in st.session_state:
+        st.session_state.uploaded_file_ids = {}
+    documents = [(uploaded_file.name, uploaded_file.getvalue()) for uploaded_file in uploaded_files]
+    with st.spinner("Uploading files..."):
+        return upload_documents(documents, st.session_state.uploaded_file_ids)
+
+def get_vector_stores_api():
+    """
+    Return the vector store API of the client (moved out of client.beta in newer SDKs).
+    """
+    client = get_client()
+    return getattr(client, "vector_stores", None) or client.beta.vector_stores
+
+def assistant_fingerprint(instructions, model=ASSISTANT_MODEL, assistant_tools=None):
+    """
+    Fingerprint the assistant configuration (instructions, model and tools).
+    """
+    payload = json.dumps({
+        "name": ASSISTANT_NAME,
+        "instructions": instructions,
+        "model": model,
+        "tools": tools if assistant_tools is None else assistant_tools,
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def invalidate_answer_cache(assistant_id):
+    """
+    Drop all cached answers of an assistant, e.g. after its documents changed.
+    Returns how many answers were removed.
+    """
+    removed = answer_cache.delete_prefix(f"{assistant_id}|")
+    logger.info(f"Invalidated {removed} cached answer(s) for assistant {assistant_id}")
+    return removed
+
+def update_vector_store_files(vector_store_id, old_file_ids, new_file_ids):
+    """
+    Incrementally bring a vector store in line with new_file_ids by adding and removing files.
+    New files are ingested before old ones are removed, so runs searching the store during
+    the update always find a complete document set.
+    """
+    vector_stores = get_vector_stores_api()
+    added = [file_id for file_id in new_file_ids if file_id not in set(old_file_ids)]
+    removed = [file_id for file_id in old_file_ids if file_id not in set(new_file_ids)]
+    if added:
+        logger.info(f"Adding {len(added)} file(s) to vector store {vector_store_id}")
+        batch = vector_stores.file_batches.create_and_poll(vector_store_id=vector_store_id, file_ids=added)
+        if batch.status != "completed":
+            raise RuntimeError(f"Adding files to vector store {vector_store_id} ended with status {batch.status}")
+    for file_id in removed:
+        logger.info(f"Removing file {file_id} from vector store {vector_store_id}")
+        vector_stores.files.delete(file_id=file_id, vector_store_id=vector_store_id)
+
 def create_assistant(file_ids, instructions):
     """
     Creates a new AI assistant with the specified instructions and returns its ID.
+    If an assistant with the same instructions, model and tools was created before, it is
+    reused and its vector store is updated incrementally to match file_ids. The registry
+    entry is replaced only once the store holds the new file set, and the answers cached
+    for the old documents are invalidated.
     """
     try:
-        print(f"Creating assistant with the following instructions:\n{instructions}")
-        assistant = client.beta.assistants.create(
-            name="Q&A AI assistant",
+        fingerprint = assistant_fingerprint(instructions)
+        entry = assistant_registry.get(fingerprint)
+        if entry:
+            try:
+                get_client().beta.assistants.retrieve(entry["assistant_id"])
+            except Exception as e:
+                logger.warning(f"Registered assistant {entry['assistant_id']} is no longer available: {str(e)}")
+                entry = None
+
+        if entry:
+            if sorted(entry["file_ids"]) != sorted(file_ids):
+                update_vector_store_files(entry["vector_store_id"], entry["file_ids"], file_ids)
+                assistant_registry.set(fingerprint, dict(entry, file_ids=list(file_ids)))
+                invalidate_answer_cache(entry["assistant_id"])
+            logger.info(f"Reusing assistant with ID: {entry['assistant_id']}")
+            return entry["assistant_id"]
+
+        logger.info("Creating assistant")
+        logger.debug(f"Assistant instructions:\n{instructions}")
+        vector_store = get_vector_stores_api().create(
+            name=f"{ASSISTANT_NAME} documents",
+            file_ids=file_ids,
+        )
+        logger.info(f"Vector store created with ID: {vector_store.id}")
+        assistant = get_client().beta.assistants.create(
+            name=ASSISTANT_NAME,
             instructions=instructions,
-            model="gpt-4o-mini",
+            model=ASSISTANT_MODEL,
             tools=tools,
             tool_resources={
                 'file_search': {
-                    'vector_stores': [{
-                        'file_ids': file_ids
-                    }]
+                    'vector_store_ids': [vector_store.id]
                 }
             }
         )
-        print(f"Assistant created with ID: {assistant.id}")
+        logger.info(f"Assistant created with ID: {assistant.id}")
+        assistant_registry.set(fingerprint, {
+            "assistant_id": assistant.id,
+            "vector_store_id": vector_store.id,
+            "file_ids": list(file_ids),
+        })
         return assistant.id
     except Exception as e:
-        print("Error creating assistant:", str(e))
-        traceback.print_exc()
+        logger.exception(f"Error creating assistant: {str(e)}")
         return None
 
-def safe_tool_call(func, tool_name, **kwargs):
+async def safe_tool_call(func, tool_name, **kwargs):
     """
     Safely execute a tool call and handle exceptions.
+    Coroutine functions are awaited, plain functions run in a worker thread.
     """
     try:
-        print(f"Calling tool '{tool_name}' with arguments: {kwargs}")
-        result = func(**kwargs)
+        logger.info(f"Calling tool '{tool_name}' with arguments: {kwargs}")
+        with metrics.span("tool_call", labels={"tool": tool_name}, arguments=kwargs):
+            if asyncio.iscoroutinefunction(func):
+                result = await func(**kwargs)
+            else:
+                result = await asyncio.to_thread(func, **kwargs)
         if result is not None:
-            print(f"Tool '{tool_name}' returned: {result}")
+            output_size = len(json.dumps(result))
+            logger.info(
+                f"Tool '{tool_name}' returned {output_size} characters",
+                extra={"fields": {"tool": tool_name, "output_chars": output_size}},
+            )
+            logger.debug(f"Tool '{tool_name}' returned: {str(result)[:LOG_PREVIEW_CHARS]}")
+            metrics.TOOL_CALLS_TOTAL.inc(tool=tool_name, outcome="ok")
             return result
         else:
-            print(f"Tool '{tool_name}' returned no content.")
+            logger.info(f"Tool '{tool_name}' returned no content.")
+            metrics.TOOL_CALLS_TOTAL.inc(tool=tool_name, outcome="empty")
             return f"No content returned from {tool_name}"
     except Exception as e:
-        st.error(f"Error in {tool_name}: {str(e)}")
-        print(f"Error in tool '{tool_name}': {str(e)}")
-        traceback.print_exc()
+        logger.exception(f"Error in tool '{tool_name}': {str(e)}")
+        metrics.TOOL_CALLS_TOTAL.inc(tool=tool_name, outcome="error")
         return f"Error occurred in {tool_name}: {str(e)}"
 
-def handle_tool_outputs(run):
+async def execute_tool_calls(tool_calls, emit=None):
     """
-    Function to handle tool outputs (scrape_content, code_interpreter, etc.).
+    Execute the function tool calls requested by a run and return the tool outputs.
+    At most TOOL_CALL_CONCURRENCY calls run at a time, each with a TOOL_CALL_TIMEOUT deadline;
+    outputs keep the order of tool_calls.
     """
-    tool_outputs = []
+    prepared_calls = []
+    for call in tool_calls:
+        function_name = call.function.name
+        function = available_functions.get(function_name)
+
+        if not function:
+            raise ValueError(f"Function {function_name} not found in available_functions.")
+
+        arguments = json.loads(call.function.arguments)
+        prepared_calls.append((call, function, function_name, arguments))
+
+    if emit is not None:
+        emit({"type": "tool_calls", "tools": [function_name for _, _, function_name, _ in prepared_calls]})
+
+    semaphore = asyncio.Semaphore(TOOL_CALL_CONCURRENCY)
+
+    async def run_call(function, function_name, arguments):
+        async with semaphore:
+            try:
+                return await asyncio.wait_for(
+                    safe_tool_call(function, function_name, **arguments), TOOL_CALL_TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                logger.warning(f"Tool '{function_name}' timed out after {TOOL_CALL_TIMEOUT} seconds.")
+                metrics.TOOL_CALLS_TOTAL.inc(tool=function_name, outcome="timeout")
+                return f"Error occurred in {function_name}: timed out after {TOOL_CALL_TIMEOUT} seconds"
+
+    outputs = await asyncio.gather(*(
+        run_call(function, function_name, arguments) for _, function, function_name, arguments in prepared_calls
+    ))
+    return [
+        {"tool_call_id": call.id, "output": json.dumps(output)}
+        for (call, _, _, _), output in zip(prepared_calls, outputs)
+    ]
+
+async def fetch_artifact(file_id):
+    """
+    Return the content digest of an OpenAI file, downloading it into the artifact store
+    unless it is already there.
+    """
+    digest = await asyncio.to_thread(artifact_store.digest_for, file_id)
+    if digest is not None:
+        return digest
+    # Stream the body to disk instead of buffering it in memory; file I/O stays off the core loop
+    with metrics.span("artifact_download", file_id=file_id) as span:
+        writer = await asyncio.to_thread(artifact_store.writer)
+        try:
+            async with get_async_client().files.with_streaming_response.content(file_id) as response:
+                async for chunk in response.iter_bytes(ARTIFACT_CHUNK_SIZE):
+                    await asyncio.to_thread(writer.write, chunk)
+        except BaseException:
+            await asyncio.shield(asyncio.to_thread(writer.discard))
+            raise
+        span["bytes"] = writer.size
+        return await asyncio.to_thread(writer.commit, file_id)
+
+async def fetch_artifacts(artifacts, on_fetched=None):
+    """
+    Fetch the files of artifact references into the artifact store concurrently, at most
+    ARTIFACT_DOWNLOAD_CONCURRENCY at a time, and make the thumbnails of images. Returns
+    {file_id: digest}, with None for files that could not be fetched. on_fetched(file_id, digest)
+    is called as each one finishes.
+    """
+    semaphore = asyncio.Semaphore(ARTIFACT_DOWNLOAD_CONCURRENCY)
+    images = {artifact["file_id"] for artifact in artifacts if artifact["kind"] == "image"}
+
+    async def fetch(file_id):
+        digest = None
+        try:
+            async with semaphore:
+                digest = await fetch_artifact(file_id)
+                if file_id in images:
+                    await asyncio.to_thread(artifact_store.thumbnail, digest)
+        except Exception as e:
+            logger.error(f"Error fetching artifact {file_id}: {str(e)}")
+        finally:
+            if on_fetched is not None:
+                on_fetched(file_id, digest)
+        return digest
+
+    file_ids = list(dict.fromkeys(artifact["file_id"] for artifact in artifacts))
+    digests = await asyncio.gather(*(fetch(file_id) for file_id in file_ids))
+    return dict(zip(file_ids, digests))
+
+def load_artifact(artifact):
+    """
+    Return the bytes of an artifact reference, downloading it again if it was evicted.
+    """
+    digest = artifact_store.digest_for(artifact["file_id"])
+    data = artifact_store.read(digest) if digest else None
+    if data is None:
+        data = artifact_store.read(run_async(fetch_artifact(artifact["file_id"])))
+    return data
+
+def artifact_thumbnail(artifact):
+    """
+    Return the path of a thumbnail of an image artifact (or of the image itself if no
+    thumbnail can be made).
+    """
+    digest = artifact_store.digest_for(artifact["file_id"]) or run_async(fetch_artifact(artifact["file_id"]))
+    return artifact_store.thumbnail(digest) or artifact_store.path(digest)
+
+async def process_assistant_message(message, run_info=None):
+    """
+    Collect the text and the references to downloadable files and images from a completed
+    assistant message. The files themselves are not downloaded here (see fetch_artifacts),
+    so the text can be shown right away.
+    If run_info is given, the references are also recorded under run_info["artifacts"].
+    """
+    artifacts = run_info.setdefault("artifacts", []) if run_info is not None else []
+    formatted_response_text = ""
+    download_links = []
+    images = []
+
+    for content in message.content:
+        if content.type == "text":
+            formatted_response_text += content.text.value
+            # Process annotations
+            if hasattr(content.text, 'annotations'):
+                for annotation in content.text.annotations:
+                    if annotation.type == "file_path":
+                        try:
+                            file_id = annotation.file_path.file_id
+                            file_name = annotation.text.split('/')[-1]
+                            artifact = {"kind": "download", "name": file_name, "file_id": file_id}
+                            download_links.append(artifact)
+                            artifacts.append(artifact)
+                        except Exception as fe:
+                            logger.error(f"Error processing file annotation: {str(fe)}")
+
+        elif content.type == "image_file":
+            try:
+                file_id = content.image_file.file_id
+                artifact = {"kind": "image", "name": f"{file_id}.png", "file_id": file_id}
+                images.append(artifact)
+                artifacts.append(artifact)
+                formatted_response_text += f"[Image generated: {file_id}.png]\n"
+            except Exception as ie:
+                logger.error(f"Error processing image: {str(ie)}")
+
+    if run_info is not None:
+        run_info["answered"] = True
+    return formatted_response_text, download_links, images
+
+class StreamedRun:
+    """
+    State of a streamed run: the latest run object, the text rendered so far and the
+    completed messages. run stays None until the API has created the run.
+    """
+    def __init__(self):
+        self.run = None
+        self.rendered_text = ""
+        self.completed_messages = []
+        self.status_timer = metrics.RunStatusTimer()
+
+async def stream_run(thread_id, assistant_id, streamed, emit):
+    """
+    Run the assistant on the thread with the streaming event API. Text deltas are emitted
+    as they arrive and requires_action events are answered inline by streaming the tool
+    outputs back, until the run stops.
+    """
+    client = get_async_client()
+    logger.info(f"Streaming run with assistant_id={assistant_id}...")
+    stream_manager = client.beta.threads.runs.stream(
+        thread_id=thread_id,
+        assistant_id=assistant_id,
+        timeout=RUN_TIMEOUT,
+        **run_options(),
+    )
+    submitting = False
     try:
-        print("Handling required tool calls...")
-        for call in run.required_action.submit_tool_outputs.tool_calls:
-            function_name = call.function.name
-            function = available_functions.get(function_name)
-            
-            if not function:
-                raise ValueError(f"Function {function_name} not found in available_functions.")
-            
-            arguments = json.loads(call.function.arguments)
-            
-            with st.spinner(f"Executing a detailed search..."):
-                output = safe_tool_call(function, function_name, **arguments)
-
-            tool_outputs.append({
-                "tool_call_id": call.id,
-                "output": json.dumps(output)
-            })
+        while stream_manager is not None:
+            async with contextlib.AsyncExitStack() as stack:
+                # The submission phase ends once the continued run starts streaming back
+                with metrics.span("tool_output_submit") if submitting else contextlib.nullcontext():
+                    stream = await stack.enter_async_context(stream_manager)
+                stream_manager = None
 
-        print("Submitting tool outputs back to the thread...")
-        # Submit the tool outputs
-        submitted_result = client.beta.threads.runs.submit_tool_outputs(
-            thread_id=st.session_state.user_thread.id,
-            run_id=run.id,
-            tool_outputs=tool_outputs
+                async for event in stream:
+                    # Keep track of the latest run object (run step events carry a RunStep instead)
+                    if event.event.startswith("thread.run.") and not event.event.startswith("thread.run.step."):
+                        streamed.run = event.data
+                        streamed.status_timer.observe(event.data.status)
+                        logger.debug(f"Streamed run event: {event.event}")
+
+                    if event.event == "thread.message.created" and streamed.rendered_text:
+                        streamed.rendered_text += "\n\n"
+                    elif event.event == "thread.message.delta":
+                        for block in event.data.delta.content or []:
+                            if block.type == "text" and block.text and block.text.value:
+                                streamed.rendered_text += block.text.value
+                                emit({"type": "text", "text": streamed.rendered_text})
+                    elif event.event in ("thread.message.completed", "thread.message.incomplete"):
+                        streamed.completed_messages.append(event.data)
+                    elif event.event == "thread.run.requires_action":
+                        logger.info("Run requires action (tool calls). Handling tool outputs inline...")
+                        tool_outputs = await execute_tool_calls(
+                            event.data.required_action.submit_tool_outputs.tool_calls, emit
+                        )
+                        logger.info("Submitting tool outputs back to the thread (streaming)...")
+                        stream_manager = client.beta.threads.runs.submit_tool_outputs_stream(
+                            thread_id=thread_id,
+                            run_id=event.data.id,
+                            tool_outputs=tool_outputs,
+                        )
+                        submitting = True
+    finally:
+        streamed.status_timer.close()
+    logger.info(f"Streamed run finished with status: {streamed.run.status if streamed.run else None}")
+    return streamed.run
+
+async def process_streamed_run(run, messages, run_info=None):
+    """
+    Turn the outcome of a streamed run into the (text, downloads, images) response tuple.
+    """
+    if run.status == "failed":
+        error_message = f"Run failed with error: {run.last_error.code} - {run.last_error.message}"
+        logger.error(error_message)
+        return error_message, [], []
+
+    if run.status == "incomplete":
+        mark_incomplete_run(run, run_info)
+    elif run.status != "completed":
+        error_message = f"Run ended with unexpected status: {run.status}"
+        if getattr(run, 'last_error', None):
+            error_message += f" (Error: {run.last_error.code} - {run.last_error.message})"
+        logger.error(error_message)
+        return error_message, [], []
+
+    assistant_messages = [message for message in messages if message.role == "assistant"]
+    if not assistant_messages:
+        error_message = "No messages found in thread after completion"
+        logger.error(error_message)
+        return error_message, [], []
+
+    formatted_response_text = ""
+    download_links = []
+    images = []
+    for message in assistant_messages:
+        text, message_downloads, message_images = await process_assistant_message(message, run_info)
+        if formatted_response_text and text:
+            formatted_response_text += "\n\n"
+        formatted_response_text += text
+        download_links.extend(message_downloads)
+        images.extend(message_images)
+    if run.status == "incomplete":
+        formatted_response_text += INCOMPLETE_ANSWER_NOTICE
+    return formatted_response_text, download_links, images
+
+async def poll_run(thread_id, assistant_id, run_info, emit):
+    """
+    Create a run and poll it until it finishes, answering tool calls in between.
+    """
+    client = get_async_client()
+    logger.info(f"Creating run with assistant_id={assistant_id}...")
+    run = await client.beta.threads.runs.create(
+        thread_id=thread_id,
+        assistant_id=assistant_id,
+        **run_options(),
+    )
+    run_info["run_id"] = run.id
+    logger.info(f"Run created. Initial status: {run.status}")
+    status_timer = metrics.RunStatusTimer()
+    status_timer.observe(run.status)
+
+    # Add timeout mechanism
+    start_time = time.time()
+    timeout = RUN_TIMEOUT
+
+    # Poll the run status with timeout and error handling
+    while run.status in ["queued", "in_progress"]:
+        if time.time() - start_time > timeout:
+            await cancel_run(thread_id, run.id)
+            raise TimeoutError("Run timed out after 5 minutes")
+
+        logger.debug(f"Current run status: {run.status}. Waiting {RUN_POLL_INTERVAL} second(s)...")
+        await asyncio.sleep(RUN_POLL_INTERVAL)
+
+        try:
+            run = await client.beta.threads.runs.retrieve(
+                thread_id=thread_id,
+                run_id=run.id
+            )
+            logger.debug(f"Run status after retrieve: {run.status}")
+            status_timer.observe(run.status)
+
+            # Check for failed status
+            if run.status == "failed":
+                record_run_usage(run, run_info)
+                error_message = f"Run failed with error: {run.last_error.code} - {run.last_error.message}"
+                logger.error(error_message)
+                return error_message, [], []
+
+            if run.status == "requires_action":
+                logger.info("Run requires action (tool calls). Handling tool outputs...")
+                tool_outputs = await execute_tool_calls(run.required_action.submit_tool_outputs.tool_calls, emit)
+                logger.info("Submitting tool outputs back to the thread...")
+                with metrics.span("tool_output_submit"):
+                    run = await client.beta.threads.runs.submit_tool_outputs(
+                        thread_id=thread_id,
+                        run_id=run.id,
+                        tool_outputs=tool_outputs
+                    )
+                logger.info(f"Tool outputs submitted. Run status: {run.status}")
+                status_timer.observe(run.status)
+
+        except Exception as e:
+            error_message = f"Error retrieving run status: {str(e)}"
+            logger.error(error_message)
+            return error_message, [], []
+
+    # After run completes, check final status
+    status_timer.close()
+    record_run_usage(run, run_info)
+    if run.status == "incomplete":
+        mark_incomplete_run(run, run_info)
+    elif run.status != "completed":
+        error_message = f"Run ended with unexpected status: {run.status}"
+        if getattr(run, 'last_error', None):
+            error_message += f" (Error: {run.last_error.code} - {run.last_error.message})"
+        logger.error(error_message)
+        return error_message, [], []
+
+    # Retrieve the messages
+    try:
+        messages = await client.beta.threads.messages.list(
+            thread_id=thread_id,
+            limit=1
         )
-        print("Tool outputs submitted. Run status:", submitted_result.status)
-        return submitted_result
+        if not messages.data:
+            error_message = "No messages found in thread after completion"
+            logger.error(error_message)
+            return error_message, [], []
+
+        last_message = messages.data[0]
+
+        # Process assistant response
+        if last_message.role == "assistant":
+            text, download_links, images = await process_assistant_message(last_message, run_info)
+            if run.status == "incomplete":
+                text += INCOMPLETE_ANSWER_NOTICE
+            return text, download_links, images
+        else:
+            error_message = f"Unexpected message role: {last_message.role}"
+            logger.error(error_message)
+            return error_message, [], []
 
     except Exception as e:
-        st.error(f"Error in handle_tool_outputs: {str(e)}")
-        print("Error in handle_tool_outputs:", str(e))
-        traceback.print_exc()
-        return None
+        error_message = f"Error retrieving messages: {str(e)}"
+        logger.error(error_message)
+        return error_message, [], []
 
-async def get_agent_response(assistant_id, user_message):
+async def cancel_run(thread_id, run_id):
     """
-    Send the user's message to the assistant and await a response with improved error handling.
+    Cancel a run that may still be active, so the thread accepts new messages again
+    instead of staying locked until the run expires.
     """
     try:
-        with st.spinner("Processing your request..."):
-            print(f"Sending user message to the thread: {user_message}")
-            if not st.session_state.user_thread:
-                raise ValueError("No user thread found. Please ensure thread creation was successful.")
-            
-            # Create a new user message in the thread
-            client.beta.threads.messages.create(
-                thread_id=st.session_state.user_thread.id,
-                role="user",
-                content=user_message,
+        await get_async_client().beta.threads.runs.cancel(thread_id=thread_id, run_id=run_id)
+        logger.info(f"Cancelled run {run_id} on thread {thread_id}")
+    except Exception as e:
+        logger.warning(f"Could not cancel run {run_id}: {str(e)}")
+
+def run_options():
+    """
+    Return the truncation strategy and token caps passed when creating runs.
+    """
+    options = {
+        "truncation_strategy": RUN_TRUNCATION_STRATEGY,
+        "max_prompt_tokens": RUN_MAX_PROMPT_TOKENS,
+        "max_completion_tokens": RUN_MAX_COMPLETION_TOKENS,
+    }
+    return {key: value for key, value in options.items() if value is not None}
+
+def mark_incomplete_run(run, run_info):
+    """
+    Record under run_info["incomplete"] why a run stopped at a token cap. Its partial answer
+    is returned with INCOMPLETE_ANSWER_NOTICE but never cached.
+    """
+    reason = getattr(getattr(run, 'incomplete_details', None), 'reason', None)
+    logger.warning(f"Run ended incomplete ({reason}), returning the partial answer.")
+    if run_info is not None:
+        run_info["incomplete"] = reason or "unknown"
+
+def record_run_usage(run, run_info):
+    """
+    Store the token usage of a finished run under run_info["usage"], in the metrics
+    and in the current trace.
+    """
+    usage = getattr(run, 'usage', None)
+    if usage is None:
+        return
+    run_info["usage"] = {
+        "prompt_tokens": usage.prompt_tokens,
+        "completion_tokens": usage.completion_tokens,
+        "total_tokens": usage.total_tokens,
+    }
+    metrics.TOKENS_TOTAL.inc(usage.prompt_tokens, kind="prompt")
+    metrics.TOKENS_TOTAL.inc(usage.completion_tokens, kind="completion")
+    # Runs are only charged once their usage is known
+    get_rate_limiters()["openai_tokens"].debit(usage.total_tokens)
+    trace = metrics.current_trace.get()
+    if trace is not None:
+        trace.attributes.update(run_info["usage"])
+    logger.info(
+        f"Run used {usage.total_tokens} tokens ({usage.prompt_tokens} prompt, {usage.completion_tokens} completion)",
+        extra={"fields": run_info["usage"]},
+    )
+
+def new_thread_context(thread_id):
+    """
+    Return the context of a conversation on a new thread: its thread ID, the turns since the
+    thread was started or compacted and the token totals of the conversation. Contexts are plain dicts so session
+    stores can keep them as JSON. thread_id may be None, the thread is then created by the first run.
+    """
+    return {
+        "thread_id": thread_id,
+        "turns": 0,
+        "last_prompt_tokens": 0,
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "total_tokens": 0,
+        "compactions": 0,
+        "carried_messages": 0,
+    }
+
+def truncation_window():
+    """
+    Return how many thread messages a run sees, or None if the thread is not truncated by count.
+    """
+    if RUN_TRUNCATION_STRATEGY and RUN_TRUNCATION_STRATEGY.get("type") == "last_messages":
+        return RUN_TRUNCATION_STRATEGY["last_messages"]
+    return None
+
+def needs_compaction(context):
+    """
+    Return True when the thread of a conversation is over its turn or prompt token budget,
+    or when the next user message would push the summary or the oldest turn out of the
+    truncation window.
+    """
+    window = truncation_window()
+    # Messages carried over by the last compaction, two per turn since and the next question
+    if window is not None and context.get("carried_messages", 0) + 2 * context["turns"] + 1 > window:
+        return True
+    if COMPACT_AFTER_TURNS is not None and context["turns"] >= COMPACT_AFTER_TURNS:
+        return True
+    return COMPACT_AFTER_PROMPT_TOKENS is not None and context["last_prompt_tokens"] >= COMPACT_AFTER_PROMPT_TOKENS
+
+def is_first_turn(context):
+    """
+    Return True if the conversation has no earlier turns. Only the answers of first turns
+    are served from or stored in the answer cache, later ones may depend on the conversation.
+    """
+    return context is None or not (context["turns"] or context["compactions"] or context.get("pending_messages"))
+
+def record_cached_turn(context, user_message, response):
+    """
+    Add a turn answered from the answer cache to the conversation. The exchange is only
+    posted to the thread before the next run (see sync_thread), so cache hits stay fast and
+    follow-up questions still see it.
+    """
+    context.setdefault("pending_messages", []).extend([
+        {"role": "user", "content": user_message},
+        {"role": "assistant", "content": response},
+    ])
+    context["turns"] += 1
+
+async def sync_thread(context):
+    """
+    Create the thread of a conversation that has none yet and post the exchanges answered
+    from the answer cache since the last run.
+    """
+    client = get_async_client()
+    pending = [message for message in context.get("pending_messages") or [] if message["content"]]
+    if context["thread_id"] is None:
+        thread = await client.beta.threads.create(messages=pending)
+        context["thread_id"] = thread.id
+        logger.info(f"Created thread {thread.id} with {len(pending)} cached message(s)")
+    else:
+        for message in pending:
+            await client.beta.threads.messages.create(thread_id=context["thread_id"], **message)
+    context["pending_messages"] = []
+
+async def compact_thread(context):
+    """
+    Move a conversation to a fresh thread that starts with a summary of its older turns,
+    followed by the COMPACT_KEEP_TURNS most recent turns verbatim. Updates context in place.
+    """
+    client = get_async_client()
+    with metrics.span("thread_compaction", turns=context["turns"]):
+        messages = []
+        async for message in client.beta.threads.messages.list(thread_id=context["thread_id"], order="asc"):
+            text = "".join(content.text.value for content in message.content if content.type == "text")
+            if text:
+                messages.append((message.role, text))
+
+        keep_turns = COMPACT_KEEP_TURNS
+        window = truncation_window()
+        if window is not None:
+            # Leave room in the truncation window for the summary and at least one more turn
+            keep_turns = max(0, min(keep_turns, (window - 4) // 2))
+        recent = messages[-2 * keep_turns:] if keep_turns else []
+        older = messages[:len(messages) - len(recent)]
+        thread_messages = []
+        if older:
+            transcript = "\n\n".join(f"{role}: {text}" for role, text in older)
+            completion = await client.chat.completions.create(
+                model=SUMMARY_MODEL,
+                max_tokens=SUMMARY_MAX_TOKENS,
+                messages=[
+                    {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+                    {"role": "user", "content": transcript[-SUMMARY_INPUT_CHARS:]},
+                ],
             )
-            print("User message created in the thread.")
+            summary = completion.choices[0].message.content
+            if completion.usage is not None:
+                get_rate_limiters()["openai_tokens"].debit(completion.usage.total_tokens)
+            thread_messages.append({"role": "assistant", "content": f"Summary of the earlier conversation:\n{summary}"})
+        thread_messages.extend({"role": role, "content": text} for role, text in recent)
+        thread = await client.beta.threads.create(messages=thread_messages)
 
-            # Create a new run with the specified assistant ID
-            print(f"Creating run with assistant_id={assistant_id}...")
-            run = client.beta.threads.runs.create(
-                thread_id=st.session_state.user_thread.id,
-                assistant_id=assistant_id,
+    logger.info(f"Compacted thread {context['thread_id']} ({len(older)} messages summarized) into {thread.id}")
+    context.update(
+        thread_id=thread.id,
+        turns=0,
+        last_prompt_tokens=0,
+        compactions=context["compactions"] + 1,
+        carried_messages=len(thread_messages),
+    )
+
+async def run_agent(context, assistant_id, user_message, run_info=None, emit=None):
+    """
+    The request pipeline shared by every front end: run one turn of the conversation whose
+    thread context is given and return the (text, downloads, images) response tuple.
+    Threads over budget are compacted first, and the run's token usage is added to the
+    context (updated in place). Must run on the core loop; other callers go through call_agent.
+    Downloads and images are artifact references ({kind, name, file_id}) whose content is
+    kept in artifact_store.
+    emit(event) receives progress events: {"type": "text", "text": <answer so far>} and
+    {"type": "tool_calls", "tools": [...]}.
+    If run_info is a dict it is filled with details about the run (answered, incomplete, artifacts, usage).
+    """
+    run_info = run_info if run_info is not None else {}
+    if context["thread_id"] is None or context.get("pending_messages"):
+        await sync_thread(context)
+    if needs_compaction(context):
+        try:
+            await compact_thread(context)
+        except Exception as e:
+            logger.exception(f"Error compacting thread {context['thread_id']}, keeping it: {str(e)}")
+    result = await run_agent_on_thread(context["thread_id"], assistant_id, user_message, run_info, emit)
+    context["turns"] += 1
+    usage = run_info.get("usage")
+    if usage:
+        context["last_prompt_tokens"] = usage["prompt_tokens"]
+        for key in ("prompt_tokens", "completion_tokens", "total_tokens"):
+            context[key] += usage[key]
+    return result
+
+async def run_agent_on_thread(thread_id, assistant_id, user_message, run_info, emit=None):
+    """
+    Post the user's message to the thread and run the assistant on it.
+    When STREAM_RUNS is enabled the run is streamed, otherwise (or if the stream cannot be
+    started) it is polled until it finishes.
+    """
+    emit = emit if emit is not None else (lambda event: None)
+    current_assistant_id.set(assistant_id)
+    current_question.set(user_message)
+    streamed = None
+    try:
+        logger.debug(f"Sending user message to the thread: {user_message}")
+        # Create a new user message in the thread
+        with metrics.span("message_create"):
+            await get_async_client().beta.threads.messages.create(
+                thread_id=thread_id,
+                role="user",
+                content=user_message,
             )
-            print(f"Run created. Initial status: {run.status}")
-
-            # Add timeout mechanism
-            start_time = time.time()
-            timeout = 300  # 5 minutes timeout
-            
-            # Poll the run status with timeout and error handling
-            while run.status in ["queued", "in_progress"]:
-                if time.time() - start_time > timeout:
-                    raise TimeoutError("Run timed out after 5 minutes")
-                
-                print(f"Current run status: {run.status}. Waiting 1 second...")
-                await asyncio.sleep(1)
-                
-                try:
-                    run = client.beta.threads.runs.retrieve(
-                        thread_id=st.session_state.user_thread.id,
-                        run_id=run.id
-                    )
-                    print(f"Run status after retrieve: {run.status}")
-
-                    # Check for failed status
-                    if run.status == "failed":
-                        error_message = f"Run failed with error: {run.last_error.code} - {run.last_error.message}"
-                        print(error_message)
-                        return error_message, [], []
-
-                    if run.status == "requires_action":
-                        print("Run requires action (tool calls). Handling tool outputs...")
-                        run = handle_tool_outputs(run)
-                        if not run:
-                            error_message = "Tool handling failed"
-                            print(error_message)
-                            return error_message, [], []
-                            
-                except Exception as e:
-                    error_message = f"Error retrieving run status: {str(e)}"
-                    print(error_message)
-                    return error_message, [], []
-
-            # After run completes, check final status
-            if run.status != "completed":
-                error_message = f"Run ended with unexpected status: {run.status}"
-                if hasattr(run, 'last_error'):
-                    error_message += f" (Error: {run.last_error.code} - {run.last_error.message})"
-                print(error_message)
-                return error_message, [], []
+        logger.info("User message created in the thread.")
 
-            # Retrieve the messages
+        if STREAM_RUNS:
+            streamed = StreamedRun()
             try:
-                messages = client.beta.threads.messages.list(
-                    thread_id=st.session_state.user_thread.id,
-                    limit=1
-                )
-                if not messages.data:
-                    error_message = "No messages found in thread after completion"
-                    print(error_message)
-                    return error_message, [], []
-                
-                last_message = messages.data[0]
-                
-                # Process assistant response
-                if last_message.role == "assistant":
-                    formatted_response_text = ""
-                    download_links = []
-                    images = []
-                    
-                    for content in last_message.content:
-                        if content.type == "text":
-                            formatted_response_text += content.text.value
-                            # Process annotations
-                            if hasattr(content.text, 'annotations'):
-                                for annotation in content.text.annotations:
-                                    if annotation.type == "file_path":
-                                        try:
-                                            file_id = annotation.file_path.file_id
-                                            file_name = annotation.text.split('/')[-1]
-                                            file_content = client.files.content(file_id).read()
-                                            download_links.append((file_name, file_content))
-                                        except Exception as fe:
-                                            print(f"Error processing file annotation: {str(fe)}")
-                                            
-                        elif content.type == "image_file":
-                            try:
-                                file_id = content.image_file.file_id
-                                image_data = client.files.content(file_id).read()
-                                images.append((f"{file_id}.png", image_data))
-                                formatted_response_text += f"[Image generated: {file_id}.png]\n"
-                            except Exception as ie:
-                                print(f"Error processing image: {str(ie)}")
-                                
-                    return formatted_response_text, download_links, images
-                else:
-                    error_message = f"Unexpected message role: {last_message.role}"
-                    print(error_message)
-                    return error_message, [], []
-                    
+                run = await stream_run(thread_id, assistant_id, streamed, emit)
+                if run is not None:
+                    record_run_usage(run, run_info)
             except Exception as e:
-                error_message = f"Error retrieving messages: {str(e)}"
-                print(error_message)
-                return error_message, [], []
+                # Only fall back when no run was started, otherwise we would answer twice
+                if streamed.run is not None:
+                    raise
+                logger.exception(f"Streaming failed, falling back to polling: {str(e)}")
+            else:
+                if run is None:
+                    raise ValueError("Stream ended without returning a run.")
+                return await process_streamed_run(run, streamed.completed_messages, run_info)
+
+        return await poll_run(thread_id, assistant_id, run_info, emit)
 
+    except asyncio.CancelledError:
+        # The caller went away (e.g. a client disconnected): stop the run on the API as well
+        run = streamed.run if streamed is not None else None
+        run_id = run.id if run is not None else run_info.get("run_id")
+        if run_id is not None:
+            await asyncio.shield(cancel_run(thread_id, run_id))
+        raise
     except Exception as e:
         error_message = f"Error in get_agent_response: {str(e)}"
-        print(error_message)
-        traceback.print_exc()
+        logger.exception(error_message)
         return error_message, [], []
 
+async def call_agent(context, assistant_id, user_message, run_info=None, on_event=None):
+    """
+    Run run_agent on the core loop from any event loop. on_event(event) is called on the
+    caller's loop, so front ends can render progress from their own thread.
+    """
+    if on_event is None:
+        return await on_core_loop(run_agent(context, assistant_id, user_message, run_info))
+
+    caller_loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+
+    def emit(event):
+        caller_loop.call_soon_threadsafe(events.put_nowait, event)
+
+    result = asyncio.ensure_future(on_core_loop(run_agent(context, assistant_id, user_message, run_info, emit)))
+    try:
+        while not result.done():
+            next_event = asyncio.ensure_future(events.get())
+            await asyncio.wait({next_event, result}, return_when=asyncio.FIRST_COMPLETED)
+            if next_event.done():
+                on_event(next_event.result())
+            else:
+                next_event.cancel()
+        # Events emitted just before the run finished
+        while not events.empty():
+            on_event(events.get_nowait())
+        return result.result()
+    finally:
+        result.cancel()
+
+async def get_agent_response(assistant_id, user_message, message_placeholder=None, run_info=None):
+    """
+    Send the user's message to the assistant on the session thread and await a response.
+    Progress is rendered into message_placeholder while the run is executed by run_agent.
+    If run_info is a dict it is filled with details about the run (answered, incomplete, artifacts, usage).
+    The request is traced and its phases are exported as metrics.
+    """
+    run_info = run_info if run_info is not None else {}
+    rendered_text = ""
+
+    def render(event):
+        nonlocal rendered_text
+        if message_placeholder is None:
+            return
+        if event["type"] == "text":
+            rendered_text = event["text"]
+            message_placeholder.markdown(rendered_text + "▌")
+        elif event["type"] == "tool_calls":
+            status = "_Executing a detailed search..._"
+            message_placeholder.markdown(f"{rendered_text}\n\n{status}" if rendered_text else status)
+
+    with metrics.request_trace("agent_response", assistant_id=assistant_id) as trace:
+        with st.spinner("Processing your request..."):
+            context = get_thread_context()
+            if not context:
+                error_message = (
+                    "Error in get_agent_response: No user thread found. "
+                    "Please ensure thread creation was successful."
+                )
+                logger.error(error_message)
+                result = (error_message, [], [])
+            else:
+                result = await call_agent(context, assistant_id, user_message, run_info, on_event=render)
+        trace.attributes["outcome"] = "answered" if run_info.get("answered") else "error"
+        run_info["request_id"] = trace.request_id
+        return result
+
+def normalize_prompt(prompt):
+    """
+    Normalize a prompt for answer cache lookups: Unicode-normalize, casefold,
+    collapse whitespace and strip surrounding punctuation.
+    """
+    prompt = unicodedata.normalize("NFKC", prompt).casefold()
+    prompt = " ".join(prompt.split())
+    return prompt.strip(" ?!.,;:")
+
+def answer_cache_key(assistant_id, language, prompt):
+    return f"{assistant_id}|{language}|{normalize_prompt(prompt)}"
+
+def prompt_terms(prompt):
+    return set(retrieval.tokenize(prompt, stopwords=retrieval.STOPWORDS - ANSWER_CACHE_NEGATIONS))
+
+def find_near_duplicate_answer(assistant_id, language, prompt):
+    """
+    Return the cached answer whose prompt terms are most similar to prompt, if any
+    reaches ANSWER_CACHE_SIMILARITY.
+    """
+    terms = prompt_terms(prompt)
+    if not terms:
+        return None
+    best_entry, best_similarity = None, 0.0
+    for _, entry in answer_cache.items(f"{assistant_id}|{language}|"):
+        cached_terms = prompt_terms(entry["prompt"])
+        if not cached_terms:
+            continue
+        similarity = len(terms & cached_terms) / len(terms | cached_terms)
+        if similarity > best_similarity:
+            best_entry, best_similarity = entry, similarity
+    if best_similarity >= ANSWER_CACHE_SIMILARITY:
+        logger.info(f"Near-duplicate answer cache hit (similarity {best_similarity:.2f}) for: {best_entry['prompt']}")
+        return best_entry
+    return None
+
+def split_artifacts(artifacts):
+    """
+    Split artifact references into (downloads, images) lists.
+    """
+    download_links = [artifact for artifact in artifacts if artifact["kind"] != "image"]
+    images = [artifact for artifact in artifacts if artifact["kind"] == "image"]
+    return download_links, images
+
+def lookup_cached_answer(assistant_id, language, user_message):
+    """
+    Return the cached answer entry ({prompt, response, artifacts}) for a question, or None.
+    """
+    with metrics.span("answer_cache_lookup"):
+        entry = answer_cache.get(answer_cache_key(assistant_id, language, user_message))
+        if entry is None and ANSWER_CACHE_NEAR_DUPLICATES:
+            entry = find_near_duplicate_answer(assistant_id, language, user_message)
+    return entry
+
+def cache_answer(assistant_id, language, user_message, response, artifacts):
+    """
+    Store a successful answer and its artifact references in the answer cache.
+    """
+    answer_cache.set(answer_cache_key(assistant_id, language, user_message), {
+        "prompt": user_message,
+        "response": response,
+        "artifacts": artifacts,
+    })
+
+async def get_cached_agent_response(assistant_id, language, user_message, message_placeholder=None):
+    """
+    Answer the first turn of a conversation from the answer cache when possible, otherwise
+    call get_agent_response and cache a successful first answer. Cache hits do not touch
+    the OpenAI thread.
+    """
+    with metrics.request_trace("chat", assistant_id=assistant_id, language=language) as trace:
+        first_turn = is_first_turn(st.session_state.get('thread_context'))
+        entry = lookup_cached_answer(assistant_id, language, user_message) if first_turn else None
+        if entry is not None:
+            logger.info(f"Answer cache hit for: {user_message}")
+            trace.attributes["outcome"] = "cache_hit"
+            if st.session_state.get('thread_context') is None:
+                st.session_state.thread_context = new_thread_context(None)
+            record_cached_turn(st.session_state.thread_context, user_message, entry["response"])
+            download_links, images = split_artifacts(entry["artifacts"])
+            return entry["response"], download_links, images
+
+        run_info = {}
+        response, download_links, images = await get_agent_response(
+            assistant_id, user_message, message_placeholder, run_info
+        )
+        if first_turn and run_info.get("answered") and not run_info.get("incomplete"):
+            cache_answer(assistant_id, language, user_message, response, run_info.get("artifacts", []))
+        return response, download_links, images
+
+def record_startup_time():
+    """
+    Log the time from the start of the script run to the rendered page, with the deferred
+    modules that were nevertheless loaded by then. The first value of each session is kept
+    in st.session_state.startup_time.
+    """
+    elapsed = time.perf_counter() - STARTUP_STARTED
+    if 'startup_time' not in st.session_state:
+        st.session_state.startup_time = elapsed
+        loaded = [name for name in DEFERRED_MODULES if name in sys.modules]
+        logger.info(
+            f"Startup took {elapsed * 1000:.1f} ms (first paint of the session), "
+            f"deferred modules loaded: {', '.join(loaded) or 'none'}.",
+            extra={"fields": {"startup_ms": round(elapsed * 1000, 1), "deferred_modules_loaded": loaded}},
+        )
+    else:
+        logger.info(f"Rerun rendered in {elapsed * 1000:.1f} ms.")
+    return elapsed
+
+def render_artifacts(artifacts, key):
+    """
+    Render artifact references: image thumbnails, download buttons that read the file from
+    the artifact store only when clicked, and HTML previews on request.
+    """
+    for artifact in artifacts:
+        name = artifact["name"]
+        widget_key = f"{key}-{artifact['file_id']}"
+        try:
+            if artifact["kind"] == "image":
+                st.image(artifact_thumbnail(artifact))
+            st.download_button(
+                label=f"Download {name}",
+                data=functools.partial(load_artifact, artifact),
+                file_name=name,
+                mime="image/png" if artifact["kind"] == "image" else "application/octet-stream",
+                key=widget_key,
+            )
+            if name.endswith('.html') and st.toggle(f"Preview {name}", key=f"{widget_key}-preview"):
+                st.components.v1.html(load_artifact(artifact).decode(), height=300, scrolling=True)
+        except Exception as e:
+            logger.error(f"Error rendering artifact {artifact['file_id']}: {str(e)}")
+            st.warning(f"{name} is no longer available.")
+
+def render_fetched_artifacts(artifacts, key):
+    """
+    Render the artifacts of a new answer, each as soon as its download has finished.
+    Downloads run concurrently on the core loop while this thread fills in the page.
+    """
+    slots = {}
+    for artifact in artifacts:
+        slot = st.empty()
+        slot.caption(f"Loading {artifact['name']}...")
+        slots.setdefault(artifact["file_id"], []).append((artifact, slot))
+
+    fetched = queue.Queue()
+    future = asyncio.run_coroutine_threadsafe(
+        fetch_artifacts(artifacts, on_fetched=lambda file_id, digest: fetched.put(file_id)),
+        get_core_loop(),
+    )
+    for _ in range(len(slots)):
+        for artifact, slot in slots[fetched.get()]:
+            with slot.container():
+                render_artifacts([artifact], key)
+    future.result()
+
+def render_token_usage():
+    """
+    Show the token totals of the session in the sidebar.
+    """
+    context = st.session_state.get('thread_context')
+    if context and context["total_tokens"]:
+        st.sidebar.caption(
+            f"Tokens used in this session: {context['total_tokens']:,} "
+            f"(prompt {context['prompt_tokens']:,}, completion {context['completion_tokens']:,})"
+        )
+
 def main():
     """
     Main entry point for the Streamlit app.
     """
     st.title("Q&A AI assistant")
-    print("Streamlit app started.")
+    logger.info("Streamlit app started.")
 
     # Choose language
     st.sidebar.title("Language Selection")
     language_choice = st.sidebar.radio("Please choose a language:", ["English", "German"])
-    print(f"Language choice: {language_choice}")
+    logger.debug(f"Language choice: {language_choice}")
 
     # Sidebar for assistant selection
     st.sidebar.title("Assistant Configuration")
@@ -420,21 +1818,17 @@ def main():
         )
         file_ids = []
         if uploaded_files:
-            for uploaded_file in uploaded_files:
-                try:
-                    file_info = client.files.create(file=uploaded_file, purpose='assistants')
-                    print(f"Uploaded file '{uploaded_file.name}' -> assigned file ID: {file_info.id}")
-                    file_ids.append(file_info.id)
-                except Exception as e:
-                    print(f"Error uploading file '{uploaded_file.name}':", str(e))
-                    traceback.print_exc()
+            file_ids = upload_files(uploaded_files)
 
         if file_ids:
             if st.sidebar.button("Create New Assistant"):
                 new_assistant_id = create_assistant(file_ids, current_instructions)
                 if new_assistant_id:
+                    build_document_index(
+                        new_assistant_id, [(f.name, f.getvalue()) for f in uploaded_files]
+                    )
                     st.session_state.assistant_id = new_assistant_id
-                    st.sidebar.success(f"New assistant created with ID: {st.session_state.assistant_id}")
+                    st.sidebar.success(f"Assistant ready with ID: {st.session_state.assistant_id}")
                 else:
                     st.sidebar.error("Failed to create a new assistant. Check logs for details.")
         else:
@@ -446,38 +1840,27 @@ def main():
             st.session_state.assistant_id = assistant_id
             st.sidebar.success(f"Using assistant with ID: {assistant_id}")
 
+    # Cached answers are dropped automatically when the documents change, and on demand
+    # here, e.g. after the organisation's website changed
+    if st.session_state.get("assistant_id") and st.sidebar.button("Clear cached answers"):
+        removed = invalidate_answer_cache(st.session_state.assistant_id)
+        st.sidebar.info(f"Removed {removed} cached answer(s).")
+
     # Chat interface initialization
     if 'messages' not in st.session_state:
         st.session_state.messages = []
 
     # Display previous conversation
-    for message in st.session_state.messages:
+    for index, message in enumerate(st.session_state.messages):
         with st.chat_message(message["role"]):
             st.markdown(message["content"])
-            # Display download buttons if any
-            if "downloads" in message:
-                for file_name, file_content in message["downloads"]:
-                    st.download_button(
-                        label=f"Download {file_name}",
-                        data=file_content,
-                        file_name=file_name,
-                        mime="application/octet-stream"
-                    )
-                    if file_name.endswith('.html'):
-                        st.components.v1.html(file_content.decode(), height=300, scrolling=True)
-            # Display images if any
-            if "images" in message:
-                for image_name, image_data in message["images"]:
-                    st.image(image_data)
-                    st.download_button(
-                        label=f"Download {image_name}",
-                        data=image_data,
-                        file_name=image_name,
-                        mime="image/png"
-                    )
+            render_artifacts(message.get("artifacts", []), key=f"message-{index}")
 
     # Chat input
     prompt = st.chat_input("You:")
+    record_startup_time()
+    # Opened once the page is rendered, so the first question does not wait for them
+    open_local_indexes([st.session_state.assistant_id] if st.session_state.get("assistant_id") else [])
     if prompt:
         # Save user's message
         st.session_state.messages.append({"role": "user", "content": prompt})
@@ -490,54 +1873,36 @@ def main():
             with st.chat_message("assistant"):
                 message_placeholder = st.empty()
                 # Run the asynchronous function
-                print(f"Sending prompt to the assistant: {prompt}")
+                logger.debug(f"Sending prompt to the assistant: {prompt}")
+                # The run itself executes on the core loop; progress is rendered from this thread
                 response, download_links, images = asyncio.run(
-                    get_agent_response(st.session_state.assistant_id, prompt)
+                    get_cached_agent_response(st.session_state.assistant_id, language_choice, prompt, message_placeholder)
                 )
-                print("Received response from assistant.")
-                print(f"Assistant response text:\n{response}")
+                logger.info("Received response from assistant.")
+                logger.debug(f"Assistant response text:\n{response[:LOG_PREVIEW_CHARS]}")
 
                 # Display the assistant's response
                 message_placeholder.markdown(response)
 
-                # Display any downloadable files
-                for file_name, file_content in download_links:
-                    st.download_button(
-                        label=f"Download {file_name}",
-                        data=file_content,
-                        file_name=file_name,
-                        mime="application/octet-stream"
-                    )
-                    if file_name.endswith('.html'):
-                        st.components.v1.html(file_content.decode(), height=300, scrolling=True)
-
-                # Display images
-                for image_name, image_data in images:
-                    st.image(image_data)
-                    st.download_button(
-                        label=f"Download {image_name}",
-                        data=image_data,
-                        file_name=image_name,
-                        mime="image/png"
-                    )
+                render_fetched_artifacts(download_links + images, key=f"message-{len(st.session_state.messages)}")
 
-            # Append the assistant's message to session state
+            # Append the assistant's message to session state (artifacts by reference only)
             st.session_state.messages.append({
                 "role": "assistant",
                 "content": response,
-                "downloads": download_links,
-                "images": images
+                "artifacts": download_links + images,
             })
         else:
             # We do not have a valid assistant ID
             no_assistant_warning = "Please create a new assistant or enter an existing assistant ID before chatting."
             st.warning(no_assistant_warning)
-            print(no_assistant_warning)
+            logger.warning(no_assistant_warning)
+
+    render_token_usage()
 
 if __name__ == "__main__":
-    print("Running the Streamlit app...")
+    logger.info("Running the Streamlit app...")
     try:
         main()
     except Exception as e:
-        print("Unhandled exception in main():", str(e))
-        traceback.print_exc()
+        logger.exception(f"Unhandled exception in main(): {str(e)}")
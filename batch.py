@@ -0,0 +1,229 @@
+"""
+Batch question answering on the assistant pipeline, e.g. to pre-warm the answer cache with
+the most frequent member questions, or to measure answers, latency and throughput on a
+whole question set after documents or instructions changed.
+
+    python batch.py questions.jsonl answers.jsonl --concurrency 8
+
+Each input line is a JSON object with "question", "assistant_id" (or --assistant-id) and
+optionally "language" (default English) and "id" (default: the line number). Every
+question runs on a new thread of its own. One JSON line per question is appended to the
+output as soon as it finishes, with the answer, artifact references, timings and token usage.
+
+Rerunning with the same output file resumes the batch: questions that were answered are
+skipped, failed ones are run again (the last line of an id wins).
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import assistant
+import metrics
+from metrics import get_logger, percentile
+
+logger = get_logger("qa_assistant.batch")
+
+DEFAULT_LANGUAGE = "English"
+DEFAULT_CONCURRENCY = 4
+
+
+def read_questions(path, default_assistant_id=None, default_language=DEFAULT_LANGUAGE):
+    """
+    Parse the input JSONL into question dicts with id, question, language and assistant_id.
+    Invalid lines are logged and skipped.
+    """
+    questions = []
+    seen = set()
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError as e:
+                logger.error(f"Skipping line {line_number} of {path}: invalid JSON ({e})")
+                continue
+            if not isinstance(item, dict):
+                item = {}
+            question = item.get("question")
+            assistant_id = item.get("assistant_id") or default_assistant_id
+            if not isinstance(question, str) or not question.strip() or not assistant_id:
+                logger.error(f"Skipping line {line_number} of {path}: question and assistant_id are required")
+                continue
+            question_id = str(item.get("id") or f"line-{line_number}")
+            if question_id in seen:
+                logger.warning(f"Duplicate id {question_id} on line {line_number} of {path}")
+            seen.add(question_id)
+            questions.append({
+                "id": question_id,
+                "question": question,
+                "language": item.get("language") or default_language,
+                "assistant_id": assistant_id,
+            })
+    return questions
+
+
+def read_answered(path):
+    """
+    Return the ids already answered in an existing output file.
+    """
+    answered = set()
+    if not os.path.exists(path):
+        return answered
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # A line cut off by an interruption
+            if record.get("answered"):
+                answered.add(record["id"])
+            else:
+                answered.discard(record.get("id"))
+    return answered
+
+
+async def answer_question(item, use_cache=False, warm_cache=True, fetch_artifacts=False):
+    """
+    Answer one question on a new thread (or from the answer cache with use_cache) and
+    return its output record.
+    """
+    record = dict(item)
+    run_info = {}
+    started = time.perf_counter()
+    first_text = None
+
+    def on_event(event):
+        nonlocal first_text
+        if event["type"] == "text" and first_text is None:
+            first_text = time.perf_counter() - started
+
+    with metrics.request_trace("batch_question", assistant_id=item["assistant_id"], language=item["language"]) as trace:
+        try:
+            entry = None
+            if use_cache:
+                entry = await asyncio.to_thread(
+                    assistant.lookup_cached_answer, item["assistant_id"], item["language"], item["question"]
+                )
+            if entry is not None:
+                response, artifacts, answered, cached = entry["response"], entry["artifacts"], True, True
+            else:
+                thread = await assistant.on_core_loop(assistant.get_async_client().beta.threads.create())
+                context = assistant.new_thread_context(thread.id)
+                response, _, _ = await assistant.call_agent(
+                    context, item["assistant_id"], item["question"], run_info, on_event
+                )
+                artifacts = run_info.get("artifacts", [])
+                answered, cached = bool(run_info.get("answered")), False
+                record["thread_id"] = context["thread_id"]
+                if answered and warm_cache and not run_info.get("incomplete"):
+                    await asyncio.to_thread(
+                        assistant.cache_answer,
+                        item["assistant_id"], item["language"], item["question"], response, artifacts,
+                    )
+        except Exception as e:
+            logger.exception(f"Error answering {item['id']}: {str(e)}")
+            response, artifacts, answered, cached = str(e), [], False, False
+        trace.attributes["outcome"] = ("cache_hit" if cached else "answered") if answered else "error"
+
+    timings = {"latency": time.perf_counter() - started, "first_text": first_text}
+    if artifacts and fetch_artifacts:
+        fetch_started = time.perf_counter()
+        digests = await assistant.on_core_loop(assistant.fetch_artifacts(artifacts))
+        artifacts = [dict(artifact, digest=digests.get(artifact["file_id"])) for artifact in artifacts]
+        timings["artifacts"] = time.perf_counter() - fetch_started
+
+    record.update(
+        answered=answered,
+        incomplete=bool(run_info.get("incomplete")),
+        cached=cached,
+        response=response if answered else None,
+        error=None if answered else response,
+        artifacts=artifacts,
+        usage=run_info.get("usage"),
+        timings=timings,
+        request_id=trace.request_id,
+    )
+    return record
+
+
+async def run_batch(questions, output_path, concurrency=DEFAULT_CONCURRENCY, **options):
+    """
+    Answer questions with at most concurrency runs at a time, appending each record to
+    output_path as it finishes. Returns the records.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    records = []
+
+    with open(output_path, "a+", encoding="utf-8") as output:
+        # Terminate a line cut off by an interruption
+        if output.tell():
+            output.seek(output.tell() - 1)
+            if output.read(1) != "\n":
+                output.write("\n")
+
+        async def run(item):
+            async with semaphore:
+                record = await answer_question(item, **options)
+            output.write(json.dumps(record, ensure_ascii=False) + "\n")
+            output.flush()
+            records.append(record)
+            logger.info(f"{item['id']}: {'answered' if record['answered'] else 'failed'} "
+                        f"in {record['timings']['latency']:.1f}s ({len(records)}/{len(questions)})")
+
+        await asyncio.gather(*(run(item) for item in questions))
+    return records
+
+
+def print_summary(records, skipped, wall_time):
+    answered = [r for r in records if r["answered"]]
+    latencies = [r["timings"]["latency"] for r in records if r["answered"] and not r["cached"]]
+    tokens = sum((r["usage"] or {}).get("total_tokens", 0) for r in records)
+    print(f"questions={len(records)} answered={len(answered)} failed={len(records) - len(answered)} "
+          f"cached={sum(r['cached'] for r in records)} skipped={skipped}")
+    print(f"wall={wall_time:.1f}s throughput={len(records) / wall_time if wall_time else 0.0:.2f} questions/s "
+          f"latency p50={percentile(latencies, 0.5):.1f}s p95={percentile(latencies, 0.95):.1f}s "
+          f"max={max(latencies, default=0.0):.1f}s tokens={tokens}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="JSONL file of questions.")
+    parser.add_argument("output", help="JSONL file the answers are appended to.")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="Questions answered at a time.")
+    parser.add_argument("--assistant-id", help="Assistant for lines without assistant_id.")
+    parser.add_argument("--language", default=DEFAULT_LANGUAGE, help="Language for lines without language.")
+    parser.add_argument("--use-cache", action="store_true",
+                        help="Serve answers from the answer cache when possible (default: always run).")
+    parser.add_argument("--no-warm", action="store_true", help="Do not store new answers in the answer cache.")
+    parser.add_argument("--fetch-artifacts", action="store_true",
+                        help="Download generated files into the artifact store and record their digests.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    questions = read_questions(args.input, args.assistant_id, args.language)
+    answered = read_answered(args.output)
+    pending = [item for item in questions if item["id"] not in answered]
+    if answered:
+        logger.info(f"Resuming: {len(questions) - len(pending)} of {len(questions)} questions already answered")
+
+    started = time.perf_counter()
+    records = asyncio.run(run_batch(
+        pending,
+        args.output,
+        concurrency=args.concurrency,
+        use_cache=args.use_cache,
+        warm_cache=not args.no_warm,
+        fetch_artifacts=args.fetch_artifacts,
+    ))
+    print_summary(records, len(questions) - len(pending), time.perf_counter() - started)
+    return 0 if all(record["answered"] for record in records) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
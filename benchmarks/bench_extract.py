@@ -0,0 +1,104 @@
+"""
+Micro-benchmark of HTML extraction: the streaming extractor used by scrape_content
+(extraction.extract_page) against the previous BeautifulSoup path, on the recorded pages.
+Reports time per page, throughput, peak Python allocations and output size.
+BeautifulSoup is only needed for the comparison (pip install -r benchmarks/requirements.txt).
+
+Usage (from the repository root):
+    python -m benchmarks.bench_extract --page-repeat 50 --iterations 20
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import extraction  # noqa: E402
+from benchmarks import fake_proxy  # noqa: E402
+
+
+def extract_page_soup(html, base_url=None, max_bytes=None):
+    """
+    The extraction scrape_content used before: a full BeautifulSoup tree walked once for
+    the text and once for the links.
+    """
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html.decode("utf-8", errors="replace"), 'html.parser')
+    content = soup.get_text(separator="\n", strip=True)
+    links = sorted({a.get('href') for a in soup.find_all('a', href=True) if a.get('href')})
+    return {'content': content, 'links': links}
+
+
+EXTRACTORS = {
+    "stream": extraction.extract_page,
+    "beautifulsoup": extract_page_soup,
+}
+
+
+def measure(extract, pages, iterations, max_bytes):
+    """
+    Extract every page iterations times and return timings, peak memory and output sizes.
+    """
+    durations = []
+    for _ in range(iterations):
+        for url, html in pages.items():
+            started = time.perf_counter()
+            extract(html, url, max_bytes)
+            durations.append(time.perf_counter() - started)
+
+    # Peak allocations of a single extraction of the largest page, measured separately
+    url, html = max(pages.items(), key=lambda item: len(item[1]))
+    tracemalloc.start()
+    result = extract(html, url, max_bytes)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    total_bytes = sum(len(html) for html in pages.values()) * iterations
+    total_time = sum(durations)
+    return {
+        "pages": len(durations),
+        "mean_ms": total_time / len(durations) * 1000,
+        "max_ms": max(durations) * 1000,
+        "mb_per_s": total_bytes / total_time / 1e6 if total_time else 0.0,
+        "peak_memory_mb": peak / 1e6,
+        "text_chars": len(result["content"]),
+        "links": len(result["links"]),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--page-repeat", type=int, default=20, help="Inflate recorded pages by repeating their body.")
+    parser.add_argument("--iterations", type=int, default=20, help="Extractions per page and extractor.")
+    parser.add_argument("--max-bytes", type=int, default=None, help="Byte cap for the streaming extractor.")
+    parser.add_argument("--extractor", choices=sorted(EXTRACTORS), action="append",
+                        help="Extractor to measure (repeatable, default: all).")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    pages = fake_proxy.load_pages(repeat=args.page_repeat)
+    report = {
+        name: measure(EXTRACTORS[name], pages, args.iterations, args.max_bytes)
+        for name in args.extractor or sorted(EXTRACTORS, reverse=True)
+    }
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return 0
+    page_kb = sum(len(html) for html in pages.values()) / len(pages) / 1024
+    print(f"{len(pages)} pages, {page_kb:.0f} KB on average, {args.iterations} iterations")
+    for name, stats in report.items():
+        print(f"{name:<14} mean={stats['mean_ms']:8.2f}ms max={stats['max_ms']:8.2f}ms "
+              f"{stats['mb_per_s']:6.1f} MB/s peak={stats['peak_memory_mb']:6.1f} MB "
+              f"text={stats['text_chars']} chars links={stats['links']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
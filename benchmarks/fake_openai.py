@@ -0,0 +1,396 @@
+"""
+A local stand-in for the parts of the OpenAI Assistants and Files API used by assistant.py.
+
+Runs go through queued -> in_progress -> requires_action (scrape_content tool calls) ->
+in_progress -> completed with configurable delays, both for polled runs and for streamed
+runs (server-sent events). Answers carry a file_path annotation and an image_file so the
+artifact download path is exercised as well. Completed runs report token usage that grows
+with the length of the thread, and chat completions return a canned summary.
+"""
+import itertools
+import json
+import re
+import struct
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+def _png(width=64, height=64):
+    """
+    Build a small grey RGB PNG used as the generated chart image.
+    """
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    rows = b"".join(b"\x00" + b"\x80\x80\x80" * width for _ in range(height))
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(rows)) + chunk(b"IEND", b"")
+
+
+PNG_BYTES = _png()
+CSV_BYTES = b"quarter,members\nQ1,1200\nQ2,1235\nQ3,1260\nQ4,1302\n"
+
+
+class FakeOpenAIConfig:
+    """
+    Delays (in seconds) and shape of the simulated runs.
+    """
+
+    def __init__(self, queue_delay=0.2, model_delay=0.5, answer_delay=0.5, token_delay=0.01,
+                 tool_calls=2, tool_urls=(), answer_tokens=40, artifacts=True):
+        self.queue_delay = queue_delay
+        self.model_delay = model_delay
+        self.answer_delay = answer_delay
+        self.token_delay = token_delay
+        self.tool_calls = tool_calls
+        self.tool_urls = list(tool_urls)
+        self.answer_tokens = answer_tokens
+        self.artifacts = artifacts
+
+
+class FakeOpenAIState:
+    """
+    In-memory threads, messages, runs and files shared by the request handlers.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.threads = {}
+        self.runs = {}
+        self.assistants = {}
+        self.vector_stores = {}
+        self.files = {"file-report": ("report.csv", CSV_BYTES), "file-chart": ("chart.png", PNG_BYTES)}
+
+    def new_id(self, prefix):
+        return f"{prefix}_{next(self.ids):08d}"
+
+    def make_run(self, thread_id, assistant_id):
+        run = {
+            "id": self.new_id("run"),
+            "object": "thread.run",
+            "created_at": int(time.time()),
+            "thread_id": thread_id,
+            "assistant_id": assistant_id,
+            "status": "queued",
+            "required_action": None,
+            "last_error": None,
+            "model": "gpt-4o-mini",
+            "instructions": "",
+            "tools": [],
+            "metadata": {},
+            "usage": None,
+            # Internal scheduling state, stripped before the run is returned
+            "_started": time.monotonic(),
+            "_phase": "before_tools" if self.config.tool_calls else "answer",
+        }
+        with self.lock:
+            self.runs[run["id"]] = run
+        return run
+
+    def tool_calls(self):
+        urls = self.config.tool_urls or ["https://example.org/"]
+        return [
+            {
+                "id": self.new_id("call"),
+                "type": "function",
+                "function": {"name": "scrape_content", "arguments": json.dumps({"url": urls[i % len(urls)]})},
+            }
+            for i in range(self.config.tool_calls)
+        ]
+
+    def answer_text(self):
+        words = [f"word{i}" for i in range(self.config.answer_tokens)]
+        return " ".join(words) + ("\n[Download report](sandbox:/mnt/data/report.csv)" if self.config.artifacts else "")
+
+    def usage(self, run):
+        """
+        Simulated token usage: the prompt grows with every message on the thread.
+        """
+        with self.lock:
+            thread_length = sum(
+                len(content["text"]["value"]) for message in self.threads.get(run["thread_id"], [])
+                for content in message["content"] if content["type"] == "text"
+            )
+        prompt_tokens = 1000 + thread_length // 4
+        completion_tokens = self.config.answer_tokens
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens}
+
+    def answer_message(self, run):
+        text = self.answer_text()
+        content = [{"type": "text", "text": {"value": text, "annotations": []}}]
+        if self.config.artifacts:
+            marker = "sandbox:/mnt/data/report.csv"
+            start = text.index(marker)
+            content[0]["text"]["annotations"].append({
+                "type": "file_path",
+                "text": marker,
+                "start_index": start,
+                "end_index": start + len(marker),
+                "file_path": {"file_id": "file-report"},
+            })
+            content.append({"type": "image_file", "image_file": {"file_id": "file-chart"}})
+        return self.message(run["thread_id"], "assistant", content, run)
+
+    def message(self, thread_id, role, content, run=None):
+        message = {
+            "id": self.new_id("msg"),
+            "object": "thread.message",
+            "created_at": int(time.time()),
+            "thread_id": thread_id,
+            "role": role,
+            "content": content,
+            "assistant_id": run["assistant_id"] if run else None,
+            "run_id": run["id"] if run else None,
+            "attachments": [],
+            "metadata": {},
+            "status": "completed",
+        }
+        with self.lock:
+            self.threads.setdefault(thread_id, []).append(message)
+        return message
+
+    def advance(self, run):
+        """
+        Move a polled run forward according to the time elapsed since its last transition.
+        """
+        config = self.config
+        elapsed = time.monotonic() - run["_started"]
+        if run["status"] == "queued" and elapsed >= config.queue_delay:
+            run["status"] = "in_progress"
+        if run["status"] == "in_progress":
+            if run["_phase"] == "before_tools" and elapsed >= config.queue_delay + config.model_delay:
+                run["status"] = "requires_action"
+                run["required_action"] = {
+                    "type": "submit_tool_outputs",
+                    "submit_tool_outputs": {"tool_calls": self.tool_calls()},
+                }
+            elif run["_phase"] == "answer" and elapsed >= config.answer_delay:
+                self.answer_message(run)
+                run["usage"] = self.usage(run)
+                run["status"] = "completed"
+        return run
+
+
+def public(run):
+    return {key: value for key, value in run.items() if not key.startswith("_")}
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    state = None  # Set by make_server
+
+    def log_message(self, format, *args):
+        pass
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        if self.headers.get("Content-Type", "").startswith("application/json") and raw:
+            return json.loads(raw)
+        return {}
+
+    def _json(self, payload, status=200):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _start_events(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+
+    def _event(self, name, payload):
+        data = payload if isinstance(payload, str) else json.dumps(payload)
+        self.wfile.write(f"event: {name}\ndata: {data}\n\n".encode("utf-8"))
+        self.wfile.flush()
+
+    def _stream_run(self, run, resume):
+        """
+        Emit the events of a streamed run until it requires action or completes.
+        """
+        state = self.state
+        config = state.config
+        self._start_events()
+        if not resume:
+            self._event("thread.run.created", public(run))
+            self._event("thread.run.queued", public(run))
+            time.sleep(config.queue_delay)
+        run["status"] = "in_progress"
+        run["required_action"] = None
+        self._event("thread.run.in_progress", public(run))
+
+        if run["_phase"] == "before_tools":
+            time.sleep(config.model_delay)
+            run["status"] = "requires_action"
+            run["required_action"] = {
+                "type": "submit_tool_outputs",
+                "submit_tool_outputs": {"tool_calls": state.tool_calls()},
+            }
+            self._event("thread.run.requires_action", public(run))
+        else:
+            time.sleep(config.answer_delay)
+            message = state.answer_message(run)
+            in_progress = dict(message, status="in_progress", content=[])
+            self._event("thread.message.created", in_progress)
+            self._event("thread.message.in_progress", in_progress)
+            words = message["content"][0]["text"]["value"].split(" ")
+            for i, word in enumerate(words):
+                value = word if i == 0 else f" {word}"
+                self._event("thread.message.delta", {
+                    "id": message["id"],
+                    "object": "thread.message.delta",
+                    "delta": {"content": [{"index": 0, "type": "text", "text": {"value": value}}]},
+                })
+                time.sleep(config.token_delay)
+            self._event("thread.message.completed", message)
+            run["usage"] = state.usage(run)
+            run["status"] = "completed"
+            self._event("thread.run.completed", public(run))
+        self._event("done", "[DONE]")
+        self.close_connection = True
+
+    def do_POST(self):
+        state = self.state
+        path = urlsplit(self.path).path
+        body = self._body()
+
+        if path.endswith("/threads"):
+            thread_id = state.new_id("thread")
+            with state.lock:
+                state.threads[thread_id] = []
+            for message in body.get("messages", []):
+                state.message(thread_id, message["role"], [
+                    {"type": "text", "text": {"value": message["content"], "annotations": []}}
+                ])
+            return self._json({"id": thread_id, "object": "thread", "created_at": int(time.time()), "metadata": {}})
+
+        match = re.search(r"/threads/([^/]+)/messages$", path)
+        if match:
+            return self._json(state.message(match.group(1), "user", [
+                {"type": "text", "text": {"value": body.get("content", ""), "annotations": []}}
+            ]))
+
+        match = re.search(r"/threads/([^/]+)/runs$", path)
+        if match:
+            run = state.make_run(match.group(1), body.get("assistant_id"))
+            if body.get("stream"):
+                return self._stream_run(run, resume=False)
+            return self._json(public(run))
+
+        match = re.search(r"/threads/([^/]+)/runs/([^/]+)/cancel$", path)
+        if match:
+            run = state.runs[match.group(2)]
+            if run["status"] in ("queued", "in_progress", "requires_action"):
+                run["status"] = "cancelled"
+                run["required_action"] = None
+            return self._json(public(run))
+
+        match = re.search(r"/threads/([^/]+)/runs/([^/]+)/submit_tool_outputs$", path)
+        if match:
+            run = state.runs[match.group(2)]
+            run["_phase"] = "answer"
+            run["_started"] = time.monotonic()
+            run["status"] = "in_progress"
+            run["required_action"] = None
+            if body.get("stream"):
+                return self._stream_run(run, resume=True)
+            return self._json(public(run))
+
+        if path.endswith("/chat/completions"):
+            summary = "Summary of the conversation so far."
+            return self._json({
+                "id": state.new_id("chatcmpl"),
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "gpt-4o-mini"),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": summary}}],
+                "usage": {"prompt_tokens": 100, "completion_tokens": 10, "total_tokens": 110},
+            })
+
+        if path.endswith("/files"):
+            # Multipart body already consumed; register an opaque file
+            file_id = state.new_id("file")
+            with state.lock:
+                state.files[file_id] = ("upload.bin", b"")
+            return self._json({"id": file_id, "object": "file", "bytes": 0, "created_at": int(time.time()),
+                               "filename": "upload.bin", "purpose": "assistants", "status": "processed"})
+
+        if path.endswith("/vector_stores"):
+            store_id = state.new_id("vs")
+            with state.lock:
+                state.vector_stores[store_id] = list(body.get("file_ids", []))
+            return self._json({"id": store_id, "object": "vector_store", "created_at": int(time.time()),
+                               "name": body.get("name"), "status": "completed", "file_counts": {}})
+
+        if path.endswith("/assistants"):
+            assistant_id = state.new_id("asst")
+            assistant = dict(body, id=assistant_id, object="assistant", created_at=int(time.time()))
+            with state.lock:
+                state.assistants[assistant_id] = assistant
+            return self._json(assistant)
+
+        self._json({"error": {"message": f"Unknown endpoint {path}"}}, status=404)
+
+    def do_GET(self):
+        state = self.state
+        parts = urlsplit(self.path)
+        path = parts.path
+
+        match = re.search(r"/threads/([^/]+)/runs/([^/]+)$", path)
+        if match:
+            run = state.runs.get(match.group(2))
+            if run is None:
+                return self._json({"error": {"message": "No such run"}}, status=404)
+            return self._json(public(state.advance(run)))
+
+        match = re.search(r"/threads/([^/]+)/messages$", path)
+        if match:
+            query = parse_qs(parts.query)
+            limit = int(query.get("limit", ["20"])[0])
+            with state.lock:
+                messages = list(state.threads.get(match.group(1), []))
+            if query.get("order", ["desc"])[0] == "desc":
+                messages.reverse()
+            messages = messages[:limit]
+            return self._json({
+                "object": "list",
+                "data": messages,
+                "first_id": messages[0]["id"] if messages else None,
+                "last_id": messages[-1]["id"] if messages else None,
+                "has_more": False,
+            })
+
+        match = re.search(r"/files/([^/]+)/content$", path)
+        if match:
+            name, data = state.files.get(match.group(1), ("missing", b""))
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+
+        match = re.search(r"/assistants/([^/]+)$", path)
+        if match and match.group(1) in state.assistants:
+            return self._json(state.assistants[match.group(1)])
+
+        self._json({"error": {"message": f"Unknown endpoint {path}"}}, status=404)
+
+
+def make_server(config, host="127.0.0.1", port=0):
+    """
+    Create (but do not start) the fake API server. Its base URL is http://host:port/v1.
+    """
+    handler = type("BoundFakeOpenAIHandler", (FakeOpenAIHandler,), {"state": FakeOpenAIState(config)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
@@ -0,0 +1,91 @@
+"""
+A local stand-in for the ScrapeOps proxy. Serves recorded HTML pages for the `url`
+query parameter, like PROXY_URL does for live pages, with a configurable latency.
+"""
+import json
+import os
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+PAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pages")
+
+
+def load_pages(pages_dir=PAGES_DIR, repeat=1):
+    """
+    Load the recorded pages listed in pages.json as a {url: html bytes} mapping.
+    repeat > 1 inflates each page body to simulate larger pages.
+    """
+    with open(os.path.join(pages_dir, "pages.json"), encoding="utf-8") as f:
+        index = json.load(f)
+    pages = {}
+    for url, file_name in index.items():
+        with open(os.path.join(pages_dir, file_name), encoding="utf-8") as f:
+            html = f.read()
+        if repeat > 1 and "<main" in html and "</main>" in html:
+            start = html.index("<main")
+            end = html.index("</main>") + len("</main>")
+            html = html[:start] + html[start:end] * repeat + html[end:]
+        pages[url] = html.encode("utf-8")
+    return pages
+
+
+class FakeProxyHandler(BaseHTTPRequestHandler):
+    pages = {}
+    delay = 0.0
+    jitter = 0.0
+    error_rate = 0.0
+    slow_rate = 0.0
+    slow_delay = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        query = parse_qs(urlsplit(self.path).query)
+        url = query.get("url", [""])[0]
+        time.sleep(max(0.0, self.delay + random.uniform(-self.jitter, self.jitter)))
+        # Simulated slow residential exits
+        if query.get("residential", ["true"])[0] == "true" and random.random() < self.slow_rate:
+            time.sleep(self.slow_delay)
+        body = self.pages.get(url) or self.pages.get(url.rstrip("/"))
+        try:
+            self._respond(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up on the request, e.g. the cancelled loser of a hedged fetch
+            pass
+
+    def _respond(self, body):
+        if random.random() < self.error_rate:
+            # Simulated rate limiting, retryable right away
+            self.send_response(429)
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if body is None:
+            body = b"<html><body>Not found</body></html>"
+            self.send_response(404)
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def make_server(pages, delay=0.0, jitter=0.0, error_rate=0.0, slow_rate=0.0, slow_delay=0.0,
+                host="127.0.0.1", port=0):
+    """
+    Create (but do not start) the fake proxy. Use http://host:port/ as PROXY_URL.
+    error_rate is the share of requests answered with 429 Too Many Requests, slow_rate the
+    share of residential requests delayed by another slow_delay seconds.
+    """
+    handler = type("BoundFakeProxyHandler", (FakeProxyHandler,), {
+        "pages": pages, "delay": delay, "jitter": jitter, "error_rate": error_rate,
+        "slow_rate": slow_rate, "slow_delay": slow_delay,
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
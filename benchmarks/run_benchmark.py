@@ -0,0 +1,235 @@
+"""
+Offline benchmark for get_agent_response and scrape_content.
+
+Starts a fake Assistants/Files API and a fake scraping proxy on localhost, points
+assistant.py at them and drives N concurrent simulated sessions. Reports end-to-end
+latency percentiles, throughput, tool and parse time and peak memory. No network access
+or API keys are needed.
+
+Usage (from the repository root):
+    python -m benchmarks.run_benchmark --sessions 20 --concurrency 8 --turns 2
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import contextvars
+import json
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+# Keep benchmark caches and metrics away from the real ones (must happen before importing assistant)
+os.environ.setdefault("QA_ASSISTANT_CACHE_DIR", tempfile.mkdtemp(prefix="qa-assistant-bench-"))
+os.environ.setdefault("QA_ASSISTANT_LOG_LEVEL", "WARNING")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import fake_openai, fake_proxy  # noqa: E402
+from metrics import percentile  # noqa: E402
+
+QUESTIONS = [
+    "Wie hoch sind die Mitgliederbeiträge?",
+    "Wann findet der nächste Kurs zur MWST-Revision statt?",
+    "What are the requirements for membership?",
+    "When is the next general assembly?",
+]
+
+
+def summarize(values):
+    return {
+        "mean": sum(values) / len(values) if values else 0.0,
+        "p50": percentile(values, 0.50),
+        "p95": percentile(values, 0.95),
+        "p99": percentile(values, 0.99),
+        "max": max(values) if values else 0.0,
+    }
+
+
+def start_server(server):
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return f"http://{server.server_address[0]}:{server.server_address[1]}"
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=10, help="Number of simulated sessions (threads).")
+    parser.add_argument("--concurrency", type=int, default=4, help="Sessions running at the same time.")
+    parser.add_argument("--turns", type=int, default=1, help="Questions asked per session.")
+    parser.add_argument("--mode", choices=["stream", "poll"], default="stream", help="Run streaming or polling.")
+    parser.add_argument("--tool-calls", type=int, default=2, help="scrape_content calls requested per run.")
+    parser.add_argument("--queue-delay", type=float, default=0.2, help="Seconds a run stays queued.")
+    parser.add_argument("--model-delay", type=float, default=0.5, help="Seconds until tool calls are requested.")
+    parser.add_argument("--answer-delay", type=float, default=0.5, help="Seconds from tool outputs to the answer.")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="Seconds between streamed text deltas.")
+    parser.add_argument("--proxy-delay", type=float, default=0.3, help="Latency of the fake proxy in seconds.")
+    parser.add_argument("--proxy-jitter", type=float, default=0.1, help="Random +/- jitter of the proxy latency.")
+    parser.add_argument("--proxy-error-rate", type=float, default=0.0,
+                        help="Share of proxy requests answered with 429 (retried by the app).")
+    parser.add_argument("--proxy-slow-rate", type=float, default=0.0,
+                        help="Share of residential proxy requests that are slow (hedged by the app).")
+    parser.add_argument("--proxy-slow-delay", type=float, default=5.0, help="Extra latency of slow requests.")
+    parser.add_argument("--hedge-delay", type=float, default=None,
+                        help="Seconds before hedging a scrape (default: the app's adaptive delay).")
+    parser.add_argument("--page-repeat", type=int, default=1, help="Inflate recorded pages by repeating their body.")
+    parser.add_argument("--no-artifacts", action="store_true", help="Answer without file annotations and images.")
+    parser.add_argument("--compact-after-turns", type=int, default=None,
+                        help="Compact session threads after this many turns (default: the app setting).")
+    parser.add_argument("--scrape-cache", action="store_true", help="Keep the scrape cache enabled.")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="Measure peak Python allocations with tracemalloc (slows down parsing noticeably).")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON.")
+    return parser.parse_args(argv)
+
+
+def run_benchmark(args):
+    pages = fake_proxy.load_pages(repeat=args.page_repeat)
+    config = fake_openai.FakeOpenAIConfig(
+        queue_delay=args.queue_delay,
+        model_delay=args.model_delay,
+        answer_delay=args.answer_delay,
+        token_delay=args.token_delay,
+        tool_calls=args.tool_calls,
+        tool_urls=list(pages),
+        artifacts=not args.no_artifacts,
+    )
+    api_base = start_server(fake_openai.make_server(config))
+    proxy_base = start_server(fake_proxy.make_server(
+        pages, delay=args.proxy_delay, jitter=args.proxy_jitter, error_rate=args.proxy_error_rate,
+        slow_rate=args.proxy_slow_rate, slow_delay=args.proxy_slow_delay,
+    ))
+
+    from openai import AsyncOpenAI, OpenAI
+
+    import assistant
+    import metrics
+    from cache import PersistentCache
+
+    client = OpenAI(base_url=f"{api_base}/v1", api_key="benchmark", max_retries=0)
+    async_client = AsyncOpenAI(base_url=f"{api_base}/v1", api_key="benchmark", max_retries=0)
+    session_context = contextvars.ContextVar("session_context", default=None)
+
+    # Point the app at the local stand-ins
+    assistant.get_client = lambda: client
+    assistant.get_async_client = lambda: async_client
+    assistant.get_proxy_api_key = lambda: "benchmark"
+    assistant.get_thread_context = session_context.get
+    assistant.PROXY_URL = f"{proxy_base}/"
+    assistant.STREAM_RUNS = args.mode == "stream"
+    if args.hedge_delay is not None:
+        assistant.hedge_delay = lambda: args.hedge_delay
+    if args.compact_after_turns is not None:
+        assistant.COMPACT_AFTER_TURNS = args.compact_after_turns
+    if not args.scrape_cache:
+        assistant.scrape_cache = PersistentCache(
+            os.path.join(os.environ["QA_ASSISTANT_CACHE_DIR"], "bench_scrape_cache.sqlite3"), ttl=0
+        )
+
+    results = []
+    results_lock = threading.Lock()
+
+    def run_session(session_index):
+        session_context.set(assistant.new_thread_context(client.beta.threads.create().id))
+        for turn in range(args.turns):
+            question = QUESTIONS[(session_index + turn) % len(QUESTIONS)]
+            run_info = {}
+            started = time.perf_counter()
+            with metrics.request_trace("benchmark", session=session_index, turn=turn) as trace:
+                response, downloads, images = asyncio.run(
+                    assistant.get_agent_response("asst_benchmark", question, None, run_info)
+                )
+            elapsed = time.perf_counter() - started
+            # Artifacts are filled in after the text, like in the app
+            assistant.run_async(assistant.fetch_artifacts(downloads + images))
+            artifact_time = time.perf_counter() - started - elapsed
+            spans = trace.spans
+            with results_lock:
+                results.append({
+                    "latency": elapsed,
+                    "answered": bool(run_info.get("answered")),
+                    "tool_time": sum(s["duration"] for s in spans if s["phase"] == "tool_call"),
+                    "proxy_time": sum(s["duration"] for s in spans if s["phase"] == "proxy_request"),
+                    "parse_time": sum(s["duration"] for s in spans if s["phase"] == "html_parse"),
+                    "artifacts": len(downloads) + len(images),
+                    "artifact_time": artifact_time,
+                    "prompt_tokens": run_info.get("usage", {}).get("prompt_tokens", 0),
+                    "error": None if run_info.get("answered") else response,
+                })
+
+    if args.trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for future in [executor.submit(run_session, i) for i in range(args.sessions)]:
+            future.result()
+    wall_time = time.perf_counter() - started
+    peak_traced = None
+    if args.trace_memory:
+        _, peak_traced = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    latencies = [r["latency"] for r in results]
+    errors = [r["error"] for r in results if r["error"]]
+    return {
+        "mode": args.mode,
+        "sessions": args.sessions,
+        "concurrency": args.concurrency,
+        "requests": len(results),
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "wall_time": wall_time,
+        "throughput_rps": len(results) / wall_time if wall_time else 0.0,
+        "latency": summarize(latencies),
+        "tool_time": summarize([r["tool_time"] for r in results]),
+        "proxy_time": summarize([r["proxy_time"] for r in results]),
+        "parse_time": summarize([r["parse_time"] for r in results]),
+        "artifact_time": summarize([r["artifact_time"] for r in results]),
+        "prompt_tokens": summarize([r["prompt_tokens"] for r in results]),
+        "coalesced_scrapes": metrics.COALESCED_TOTAL.value(call="scrape"),
+        "throttled_proxy_requests": metrics.THROTTLED_TOTAL.value(limiter="proxy_credits"),
+        "retried_proxy_requests": metrics.RETRIES_TOTAL.value(target="proxy"),
+        "hedged_scrapes": metrics.HEDGED_REQUESTS_TOTAL.value(outcome="started"),
+        "hedges_won": metrics.HEDGED_REQUESTS_TOTAL.value(outcome="won"),
+        "peak_traced_memory_mb": peak_traced / 1e6 if peak_traced is not None else None,
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def print_report(report):
+    print(f"mode={report['mode']} sessions={report['sessions']} concurrency={report['concurrency']}")
+    print(f"requests={report['requests']} errors={report['errors']} wall={report['wall_time']:.2f}s "
+          f"throughput={report['throughput_rps']:.2f} req/s")
+    for name in ("latency", "tool_time", "proxy_time", "parse_time", "artifact_time"):
+        stats = report[name]
+        print(f"{name:<13} mean={stats['mean'] * 1000:8.1f}ms p50={stats['p50'] * 1000:8.1f}ms "
+              f"p95={stats['p95'] * 1000:8.1f}ms p99={stats['p99'] * 1000:8.1f}ms")
+    tokens = report["prompt_tokens"]
+    print(f"{'prompt_tokens':<13} mean={tokens['mean']:8.0f}   p50={tokens['p50']:8.0f}   "
+          f"p95={tokens['p95']:8.0f}   max={tokens['max']:8.0f}")
+    print(f"coalesced scrapes={report['coalesced_scrapes']} throttled proxy requests="
+          f"{report['throttled_proxy_requests']} retried proxy requests={report['retried_proxy_requests']} "
+          f"hedged scrapes={report['hedged_scrapes']} hedges won={report['hedges_won']}")
+    memory = f"max RSS={report['max_rss_mb']:.1f} MB"
+    if report["peak_traced_memory_mb"] is not None:
+        memory += f" peak traced memory={report['peak_traced_memory_mb']:.1f} MB"
+    print(memory)
+    if report["first_error"]:
+        print(f"first error: {report['first_error']}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run_benchmark(args)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
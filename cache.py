@@ -0,0 +1,163 @@
+import contextlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger("qa_assistant.cache")
+
+# Default location for the on-disk caches, shared by every worker process
+CACHE_DIR = os.environ.get("QA_ASSISTANT_CACHE_DIR", ".cache")
+
+
+class PersistentCache:
+    """
+    A JSON value cache stored in SQLite with a time-to-live and size-bounded LRU eviction.
+    The database file is shared by all processes that open the same path, so entries
+    survive Streamlit restarts. Hit/miss counters are kept per process and in the database.
+    """
+
+    def __init__(self, path, ttl=3600, max_entries=1000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)")
+            conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _count(self, conn, name):
+        conn.execute(
+            "INSERT INTO counters (name, value) VALUES (?, 1)"
+            " ON CONFLICT(name) DO UPDATE SET value = value + 1",
+            (name,),
+        )
+
+    def get(self, key, max_age=None):
+        """
+        Return the cached value for key, or None if it is missing or expired.
+        max_age (seconds) can ask for fresher entries than the TTL; older entries are kept.
+        """
+        now = time.time()
+        try:
+            with self._lock, self._connect() as conn:
+                row = conn.execute("SELECT value, created_at FROM entries WHERE key = ?", (key,)).fetchone()
+                expired = row is not None and self.ttl is not None and now - row[1] > self.ttl
+                if row is None or expired or (max_age is not None and now - row[1] > max_age):
+                    if expired:
+                        conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                    self._count(conn, "misses")
+                    self.misses += 1
+                    return None
+                conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+                self._count(conn, "hits")
+                self.hits += 1
+                return json.loads(row[0])
+        except Exception as e:
+            logger.error(f"Error reading cache {self.path}: {str(e)}")
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        """
+        Store value under key and evict the least recently used entries beyond max_entries.
+        """
+        now = time.time()
+        try:
+            with self._lock, self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO entries (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(value), now, now),
+                )
+                if self.max_entries is not None:
+                    conn.execute(
+                        "DELETE FROM entries WHERE key IN ("
+                        " SELECT key FROM entries ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                        (self.max_entries,),
+                    )
+        except Exception as e:
+            logger.error(f"Error writing cache {self.path}: {str(e)}")
+
+    def delete(self, key):
+        """
+        Remove a single entry from the cache.
+        """
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def delete_prefix(self, prefix):
+        """
+        Remove every entry whose key starts with prefix and return how many were removed.
+        """
+        with self._lock, self._connect() as conn:
+            cursor = conn.execute("DELETE FROM entries WHERE substr(key, 1, ?) = ?", (len(prefix), prefix))
+            return cursor.rowcount
+
+    def items(self, prefix=""):
+        """
+        Return (key, value) pairs of the unexpired entries whose key starts with prefix.
+        Does not count as hits or refresh the LRU order.
+        """
+        min_created_at = time.time() - self.ttl if self.ttl is not None else float("-inf")
+        with self._lock, self._connect() as conn:
+            rows = conn.execute(
+                "SELECT key, value FROM entries WHERE substr(key, 1, ?) = ? AND created_at >= ?",
+                (len(prefix), prefix, min_created_at),
+            ).fetchall()
+        return [(key, json.loads(value)) for key, value in rows]
+
+    def clear(self):
+        """
+        Remove every entry from the cache.
+        """
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM entries")
+
+    def purge_expired(self):
+        """
+        Delete all entries older than the TTL and return how many were removed.
+        """
+        if self.ttl is None:
+            return 0
+        with self._lock, self._connect() as conn:
+            cursor = conn.execute("DELETE FROM entries WHERE created_at < ?", (time.time() - self.ttl,))
+            return cursor.rowcount
+
+    def stats(self):
+        """
+        Return hit/miss counters for this process and across all processes sharing the cache.
+        """
+        with self._lock, self._connect() as conn:
+            counters = dict(conn.execute("SELECT name, value FROM counters").fetchall())
+            size = conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "total_hits": counters.get("hits", 0),
+            "total_misses": counters.get("misses", 0),
+            "entries": size,
+        }
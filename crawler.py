@@ -0,0 +1,310 @@
+"""
+Background crawler that keeps a local search index of the organisation's website, so the
+assistant can answer web questions without scraping through the proxy during a run.
+
+Starting from the seed URLs it follows same-site links (found by the same extractor that
+scrape_content uses), stores the page text in SQLite and rebuilds the BM25 index of the
+pages when something changed. Known pages are revalidated with conditional requests
+(ETag / Last-Modified); pages whose text hash is unchanged are not reprocessed.
+
+    python crawler.py                 # crawl every CRAWL_INTERVAL seconds
+    python crawler.py --once          # crawl once, e.g. from cron
+"""
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+from urllib.robotparser import RobotFileParser
+
+import extraction
+import retrieval
+from cache import CACHE_DIR
+from metrics import get_logger
+
+logger = get_logger("qa_assistant.crawler")
+
+# Seed URLs, comma separated; links are followed on the hosts of the seeds only
+CRAWL_SEEDS = [
+    url.strip()
+    for url in os.environ.get("QA_ASSISTANT_CRAWL_SEEDS", "https://www.treuhandsuisse-zh.ch/").split(",")
+    if url.strip()
+]
+CRAWL_DIR = os.path.join(CACHE_DIR, "site_crawl")
+CRAWL_DB = os.path.join(CRAWL_DIR, "pages.sqlite3")
+CRAWL_INDEX_DIR = os.path.join(CRAWL_DIR, "index")
+CRAWL_INTERVAL = 6 * 3600  # Seconds between crawls
+CRAWL_MAX_PAGES = 500
+CRAWL_CONCURRENCY = 4
+CRAWL_TIMEOUT = 30  # seconds
+CRAWL_MAX_BYTES = 2 * 1024 * 1024  # Pages are only read up to this size
+CRAWL_USER_AGENT = "QA-Assistant-Crawler/1.0"
+
+
+class PageStore:
+    """
+    Crawled pages in SQLite: validators for conditional requests, the hash and text of the
+    extracted content and the outgoing links (so unchanged pages can still be followed).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS pages ("
+                " url TEXT PRIMARY KEY,"
+                " etag TEXT,"
+                " last_modified TEXT,"
+                " content_hash TEXT NOT NULL,"
+                " content TEXT NOT NULL,"
+                " links TEXT NOT NULL,"
+                " changed_at REAL NOT NULL,"
+                " checked_at REAL NOT NULL)"
+            )
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, url):
+        """
+        Return the stored page as a dict, or None if it was never crawled.
+        """
+        with self._lock, self._connect() as conn:
+            row = conn.execute(
+                "SELECT etag, last_modified, content_hash, links FROM pages WHERE url = ?", (url,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"etag": row[0], "last_modified": row[1], "content_hash": row[2], "links": json.loads(row[3])}
+
+    def put(self, url, etag, last_modified, content_hash, content, links):
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO pages"
+                " (url, etag, last_modified, content_hash, content, links, changed_at, checked_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (url, etag, last_modified, content_hash, content, json.dumps(links), now, now),
+            )
+
+    def touch(self, url, etag=None, last_modified=None):
+        """
+        Mark a page as checked and unchanged, keeping validators the server did not resend.
+        """
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "UPDATE pages SET checked_at = ?, etag = COALESCE(?, etag),"
+                " last_modified = COALESCE(?, last_modified) WHERE url = ?",
+                (time.time(), etag, last_modified, url),
+            )
+
+    def delete(self, url):
+        with self._lock, self._connect() as conn:
+            return conn.execute("DELETE FROM pages WHERE url = ?", (url,)).rowcount > 0
+
+    def delete_unchecked(self, since):
+        """
+        Drop pages that were not reached by the crawl started at since, returning how many.
+        """
+        with self._lock, self._connect() as conn:
+            return conn.execute("DELETE FROM pages WHERE checked_at < ?", (since,)).rowcount
+
+    def documents(self):
+        """
+        Return (url, text) pairs of all pages, for building the search index.
+        """
+        with self._lock, self._connect() as conn:
+            return conn.execute("SELECT url, content FROM pages ORDER BY url").fetchall()
+
+
+def same_site(url, hosts):
+    parts = urlsplit(url)
+    return parts.scheme in ("http", "https") and parts.hostname in hosts
+
+
+class SiteCrawler:
+    """
+    Crawls the sites of the seed URLs breadth-first with a bounded number of concurrent
+    requests, honoring robots.txt. One instance should run per host (e.g. a sidecar process
+    next to the app), the index it builds is read by every worker.
+    """
+
+    def __init__(self, seeds=None, store=None, index_dir=CRAWL_INDEX_DIR, max_pages=CRAWL_MAX_PAGES,
+                 concurrency=CRAWL_CONCURRENCY):
+        self.seeds = [extraction.normalize_url(url) for url in (seeds or CRAWL_SEEDS)]
+        self.hosts = {urlsplit(url).hostname for url in self.seeds}
+        self.store = store or PageStore(CRAWL_DB)
+        self.index_dir = index_dir
+        self.max_pages = max_pages
+        self.concurrency = concurrency
+        self._robots = {}
+        self._robots_lock = asyncio.Lock()
+
+    async def _allowed(self, client, url):
+        parts = urlsplit(url)
+        origin = f"{parts.scheme}://{parts.netloc}"
+        async with self._robots_lock:
+            robots = self._robots.get(origin)
+            if robots is None:
+                robots = self._robots[origin] = RobotFileParser()
+                try:
+                    response = await client.get(f"{origin}/robots.txt")
+                    robots.parse(response.text.splitlines() if response.status_code == 200 else [])
+                except Exception as e:
+                    logger.warning(f"Could not read robots.txt of {origin}: {str(e)}")
+                    robots.parse([])
+        return robots.can_fetch(CRAWL_USER_AGENT, url)
+
+    async def fetch(self, client, url):
+        """
+        Revalidate or fetch one page. Returns (status, links) where status is "new",
+        "changed", "unchanged", "removed" or "skipped"; raises for failed requests.
+        """
+        known = await asyncio.to_thread(self.store.get, url)
+        headers = {}
+        if known:
+            if known["etag"]:
+                headers["If-None-Match"] = known["etag"]
+            if known["last_modified"]:
+                headers["If-Modified-Since"] = known["last_modified"]
+
+        chunks = []
+        size = 0
+        async with client.stream("GET", url, headers=headers) as response:
+            etag = response.headers.get("etag")
+            last_modified = response.headers.get("last-modified")
+            if response.status_code == 304 and known:
+                await asyncio.to_thread(self.store.touch, url, etag, last_modified)
+                return "unchanged", known["links"]
+            if response.status_code in (404, 410):
+                removed = await asyncio.to_thread(self.store.delete, url)
+                return ("removed" if removed else "skipped"), []
+            # Other errors fail the page and keep its stored copy
+            response.raise_for_status()
+            if response.status_code != 200 or "html" not in response.headers.get("content-type", ""):
+                return "skipped", []
+            async for chunk in response.aiter_bytes():
+                chunks.append(chunk)
+                size += len(chunk)
+                if size >= CRAWL_MAX_BYTES:
+                    break
+
+        page = await asyncio.to_thread(extraction.extract_page, b"".join(chunks), str(response.url), CRAWL_MAX_BYTES)
+        content_hash = hashlib.sha256(page["content"].encode("utf-8")).hexdigest()
+        if known and known["content_hash"] == content_hash:
+            await asyncio.to_thread(self.store.touch, url, etag, last_modified)
+            return "unchanged", page["links"]
+        await asyncio.to_thread(
+            self.store.put, url, etag, last_modified, content_hash, page["content"], page["links"]
+        )
+        return ("changed" if known else "new"), page["links"]
+
+    async def crawl(self, client=None):
+        """
+        Crawl the sites once and rebuild the index if any page was added, changed or removed.
+        Returns the number of pages per status.
+        """
+        import httpx
+
+        started = time.time()
+        owns_client = client is None
+        if owns_client:
+            client = httpx.AsyncClient(
+                timeout=CRAWL_TIMEOUT, follow_redirects=True, headers={"User-Agent": CRAWL_USER_AGENT}
+            )
+        counts = {"new": 0, "changed": 0, "unchanged": 0, "removed": 0, "skipped": 0, "failed": 0}
+        seen = set(self.seeds)
+        queue = asyncio.Queue()
+        for url in self.seeds:
+            queue.put_nowait(url)
+
+        async def worker():
+            while True:
+                url = await queue.get()
+                try:
+                    if not await self._allowed(client, url):
+                        counts["skipped"] += 1
+                        continue
+                    status, links = await self.fetch(client, url)
+                    counts[status] += 1
+                    for link in links:
+                        link = extraction.normalize_url(link)
+                        if link not in seen and len(seen) < self.max_pages and same_site(link, self.hosts):
+                            seen.add(link)
+                            queue.put_nowait(link)
+                except Exception as e:
+                    counts["failed"] += 1
+                    logger.warning(f"Error crawling {url}: {str(e)}")
+                finally:
+                    queue.task_done()
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        try:
+            await queue.join()
+        finally:
+            for task in workers:
+                task.cancel()
+            if owns_client:
+                await client.aclose()
+
+        # Pages that were not reached any more are dropped, unless the crawl was incomplete
+        if not counts["failed"]:
+            counts["removed"] += await asyncio.to_thread(self.store.delete_unchecked, started)
+        if counts["new"] or counts["changed"] or counts["removed"] or not os.path.exists(self.index_dir):
+            documents = await asyncio.to_thread(self.store.documents)
+            await asyncio.to_thread(retrieval.build_index, self.index_dir, documents)
+        logger.info(f"Crawled {len(seen)} URLs in {time.time() - started:.1f}s: {counts}")
+        return counts
+
+    async def run_forever(self, interval=CRAWL_INTERVAL):
+        """
+        Crawl every interval seconds.
+        """
+        while True:
+            try:
+                await self.crawl()
+            except Exception as e:
+                logger.exception(f"Crawl failed: {str(e)}")
+            await asyncio.sleep(interval)
+
+
+def search(query, top_k=5):
+    """
+    Search the crawled pages. Returns an empty list if nothing was crawled yet.
+    """
+    return retrieval.search(CRAWL_INDEX_DIR, query, top_k=top_k)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("seeds", nargs="*", help="Seed URLs (default: QA_ASSISTANT_CRAWL_SEEDS).")
+    parser.add_argument("--once", action="store_true", help="Crawl once and exit.")
+    parser.add_argument("--interval", type=int, default=CRAWL_INTERVAL, help="Seconds between crawls.")
+    parser.add_argument("--max-pages", type=int, default=CRAWL_MAX_PAGES, help="Most URLs crawled per run.")
+    args = parser.parse_args(argv)
+
+    crawler = SiteCrawler(seeds=args.seeds or None, max_pages=args.max_pages)
+    if args.once:
+        counts = asyncio.run(crawler.crawl())
+        return 1 if counts["failed"] else 0
+    asyncio.run(crawler.run_forever(args.interval))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,147 @@
+import codecs
+import re
+from html.parser import HTMLParser
+from urllib.parse import parse_qsl, urldefrag, urlencode, urljoin, urlsplit, urlunsplit
+
+# Elements whose content is never part of the page text
+BOILERPLATE_TAGS = {"script", "style", "noscript", "template", "svg", "nav", "footer"}
+
+# Elements that start a new line of text
+BLOCK_TAGS = {
+    "address", "article", "aside", "blockquote", "br", "caption", "dd", "details", "div", "dl", "dt",
+    "fieldset", "figcaption", "figure", "form", "h1", "h2", "h3", "h4", "h5", "h6", "header", "hr",
+    "li", "main", "ol", "p", "pre", "section", "summary", "table", "td", "th", "title", "tr", "ul",
+}
+
+# Links that cannot be followed
+IGNORED_LINK_PREFIXES = ("#", "javascript:", "mailto:", "tel:", "data:")
+
+WHITESPACE_RE = re.compile(r"\s+")
+
+
+def _looks_like_host(text):
+    return "." in text and not any(char in text for char in ":@")
+
+
+def normalize_url(url):
+    """
+    Normalize an http(s) URL for use as a cache key: lowercase scheme and host, drop default
+    ports, fragments and trailing slashes, and sort the query parameters. URLs without a
+    scheme that start with a host name (e.g. "example.com/page") are taken as http. Other
+    schemes (e.g. "mailto:") and relative references are returned unchanged.
+    """
+    url = url.strip()
+    parts = urlsplit(url)
+    if parts.scheme and parts.scheme.lower() not in ("http", "https"):
+        return url
+    if not parts.scheme and not parts.netloc:
+        if not _looks_like_host(parts.path.split("/", 1)[0]):
+            return url
+        # "example.com/page" has no "//", so the host ends up in the path
+        parts = urlsplit(f"//{url}")
+    scheme = (parts.scheme or "http").lower()
+    netloc = parts.netloc.lower()
+    if (scheme, netloc.rsplit(":", 1)[-1]) in (("http", "80"), ("https", "443")):
+        netloc = netloc.rsplit(":", 1)[0]
+    path = parts.path.rstrip("/") or "/"
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, netloc, path, query, ""))
+
+
+class PageExtractor(HTMLParser):
+    """
+    Extracts the visible text and the links of an HTML page in a single pass, without
+    building a document tree. Feed it the response body chunk by chunk (bytes, or str
+    counted in characters) and call close() for the result; input beyond max_bytes is ignored.
+
+    Text inside BOILERPLATE_TAGS (navigation, footers, scripts and styles) is dropped and
+    each block element becomes one line. Links are collected from the whole page, navigation
+    included, resolved against base_url (or the page's <base href>) and deduplicated.
+    """
+
+    def __init__(self, base_url=None, max_bytes=None, encoding="utf-8"):
+        super().__init__(convert_charrefs=True)
+        self.base_url = base_url
+        self.max_bytes = max_bytes
+        self.bytes_read = 0
+        self.truncated = False
+        self._decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        self._lines = []
+        self._line = []
+        self._links = set()
+        self._skipped = []  # Open boilerplate elements
+
+    def feed(self, data):
+        """
+        Parse the next chunk of the page. Returns False once max_bytes have been read.
+        """
+        if self.truncated:
+            return False
+        if self.max_bytes is not None and self.bytes_read + len(data) >= self.max_bytes:
+            data = data[:self.max_bytes - self.bytes_read]
+            self.truncated = True
+        self.bytes_read += len(data)
+        super().feed(self._decoder.decode(data) if isinstance(data, bytes) else data)
+        return not self.truncated
+
+    def close(self):
+        """
+        Finish parsing and return {'content': text, 'links': sorted links}.
+        """
+        if self.truncated:
+            # Drop a multibyte character cut by max_bytes instead of decoding it as U+FFFD
+            self._decoder.reset()
+        else:
+            super().feed(self._decoder.decode(b"", final=True))
+        super().close()
+        self._end_line()
+        return {
+            'content': "\n".join(self._lines),
+            'links': sorted(self._links),
+        }
+
+    def _end_line(self):
+        if self._line:
+            line = WHITESPACE_RE.sub(" ", "".join(self._line)).strip()
+            if line:
+                self._lines.append(line)
+            self._line = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in BOILERPLATE_TAGS:
+            self._skipped.append(tag)
+        elif tag == "a" or tag == "base":
+            href = dict(attrs).get("href")
+            if href:
+                href = href.strip()
+                if tag == "base":
+                    self.base_url = urljoin(self.base_url, href) if self.base_url else href
+                elif not href.lower().startswith(IGNORED_LINK_PREFIXES):
+                    self._links.add(urldefrag(urljoin(self.base_url, href) if self.base_url else href)[0])
+        if tag in BLOCK_TAGS:
+            self._end_line()
+
+    def handle_startendtag(self, tag, attrs):
+        if tag not in BOILERPLATE_TAGS:
+            self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        if tag in BOILERPLATE_TAGS and tag in self._skipped:
+            # Also closes boilerplate elements opened inside it and left unclosed
+            while self._skipped.pop() != tag:
+                pass
+        if tag in BLOCK_TAGS:
+            self._end_line()
+
+    def handle_data(self, data):
+        if not self._skipped:
+            self._line.append(data)
+
+
+def extract_page(html, base_url=None, max_bytes=None):
+    """
+    Extract the text content and the deduplicated links of an HTML page (bytes or str).
+    """
+    extractor = PageExtractor(base_url=base_url, max_bytes=max_bytes)
+    extractor.feed(html)
+    return extractor.close()
@@ -0,0 +1,467 @@
+import atexit
+import bisect
+import contextlib
+import contextvars
+import json
+import logging
+import math
+import os
+import queue
+import threading
+import time
+import uuid
+
+from cache import CACHE_DIR
+
+# Where traces (JSONL) and the Prometheus text files are written. Every process writes its
+# own metrics-<pid>.prom with a pid label, e.g. for node_exporter's textfile collector.
+METRICS_DIR = os.environ.get("QA_ASSISTANT_METRICS_DIR", os.path.join(CACHE_DIR, "metrics"))
+EXPORT_INTERVAL = 10  # Seconds between rewrites of the Prometheus file of a process
+EXPORT_QUEUE_SIZE = 10000  # Finished traces waiting to be written; further ones are dropped
+LOG_LEVEL = os.environ.get("QA_ASSISTANT_LOG_LEVEL", "INFO")
+
+# Histogram buckets in seconds, from local lookups up to the run timeout
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Trace of the request being served, shared with tool worker threads through copied contexts
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+class JsonLogFormatter(logging.Formatter):
+    """
+    Format log records as one JSON object per line, tagged with the current request ID.
+    Extra structured fields can be passed as logger.info(..., extra={"fields": {...}}).
+    """
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        trace = current_trace.get()
+        if trace is not None:
+            entry["request_id"] = trace.request_id
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def get_logger(name="qa_assistant"):
+    """
+    Return a logger writing structured JSON lines at QA_ASSISTANT_LOG_LEVEL.
+    """
+    root = logging.getLogger("qa_assistant")
+    if not root.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(JsonLogFormatter())
+        root.addHandler(handler)
+        root.setLevel(LOG_LEVEL.upper())
+        root.propagate = False
+    return logging.getLogger(name)
+
+
+logger = get_logger("qa_assistant.metrics")
+
+
+def _label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _escape_label_value(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(label_key, extra=()):
+    pairs = list(label_key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape_label_value(value)}"' for key, value in pairs) + "}"
+
+
+class Counter:
+    """
+    A monotonically increasing counter with optional labels.
+    """
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(_label_key(labels), 0)
+
+    def render(self, labels=()):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    """
+    A cumulative histogram with fixed buckets and optional labels.
+    """
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series["counts"][index] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self, labels=()):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        labels = list(labels)
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series["counts"]):
+                    cumulative += count
+                    le = [("le", repr(float(bound)))]
+                    lines.append(f"{self.name}_bucket{_format_labels(key, labels + le)} {cumulative}")
+                lines.append(f"{self.name}_bucket{_format_labels(key, labels + [('le', '+Inf')])} {series['count']}")
+                lines.append(f"{self.name}_sum{_format_labels(key, labels)} {series['sum']}")
+                lines.append(f"{self.name}_count{_format_labels(key, labels)} {series['count']}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Holds the process metrics and renders them in the Prometheus text exposition format.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, documentation):
+        return self._register(Counter(name, documentation))
+
+    def histogram(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, buckets))
+
+    def render(self, labels=()):
+        """
+        Render every metric; labels are (name, value) pairs added to all series.
+        """
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render(labels))
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+PHASE_SECONDS = registry.histogram(
+    "qa_assistant_phase_seconds", "Duration of the phases of the request pipeline in seconds."
+)
+REQUEST_SECONDS = registry.histogram(
+    "qa_assistant_request_seconds", "End-to-end duration of requests in seconds."
+)
+REQUESTS_TOTAL = registry.counter(
+    "qa_assistant_requests_total", "Requests served, by request name and outcome."
+)
+TOOL_CALLS_TOTAL = registry.counter(
+    "qa_assistant_tool_calls_total", "Tool calls executed, by tool and outcome."
+)
+TOKENS_TOTAL = registry.counter(
+    "qa_assistant_tokens_total", "Tokens used by runs, by kind (prompt or completion)."
+)
+COALESCED_TOTAL = registry.counter(
+    "qa_assistant_coalesced_calls_total", "Calls that joined an identical call in flight, by call."
+)
+THROTTLED_TOTAL = registry.counter(
+    "qa_assistant_throttled_calls_total", "Calls delayed by a rate limiter, by limiter."
+)
+RETRIES_TOTAL = registry.counter(
+    "qa_assistant_retries_total", "Requests retried after a rate limit or transient error, by target."
+)
+HEDGED_REQUESTS_TOTAL = registry.counter(
+    "qa_assistant_hedged_requests_total", "Hedged scrape attempts, by outcome (started or won)."
+)
+BREAKER_REJECTIONS_TOTAL = registry.counter(
+    "qa_assistant_circuit_breaker_rejections_total", "Calls rejected by an open circuit breaker, by breaker."
+)
+TRACES_DROPPED_TOTAL = registry.counter(
+    "qa_assistant_traces_dropped_total", "Request traces dropped because the export queue was full."
+)
+
+
+def percentile(values, fraction, default=0.0):
+    """
+    Nearest-rank percentile of a list of numbers (fraction between 0 and 1), or default
+    if there are none.
+    """
+    if not values:
+        return default
+    ordered = sorted(values)
+    # Rounded first so float noise (0.07 * 100 = 7.000000000000001) does not skip a rank
+    rank = math.ceil(round(fraction * len(ordered), 9))
+    return ordered[max(0, min(len(ordered) - 1, rank - 1))]
+
+
+class RequestTrace:
+    """
+    The spans recorded while serving one request, written as one JSON line when it finishes.
+    """
+
+    def __init__(self, name, **attributes):
+        self.request_id = uuid.uuid4().hex
+        self.name = name
+        self.attributes = dict(attributes)
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add_span(self, phase, start, duration, **attributes):
+        with self._lock:
+            self.spans.append({
+                "phase": phase,
+                "offset": round(start - self.started, 6),
+                "duration": round(duration, 6),
+                **attributes,
+            })
+
+    def to_dict(self, duration):
+        return {
+            "request_id": self.request_id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration": round(duration, 6),
+            "attributes": self.attributes,
+            "spans": self.spans,
+        }
+
+
+def record_phase(phase, duration, start=None, labels=None, **attributes):
+    """
+    Record a finished phase in the phase histogram and in the current trace.
+    """
+    labels = labels or {}
+    PHASE_SECONDS.observe(duration, phase=phase, **labels)
+    trace = current_trace.get()
+    if trace is not None:
+        if start is None:
+            start = time.perf_counter() - duration
+        trace.add_span(phase, start, duration, **labels, **attributes)
+
+
+@contextlib.contextmanager
+def span(phase, labels=None, **attributes):
+    """
+    Time the enclosed block as a pipeline phase. labels become Prometheus labels,
+    other attributes are only added to the trace.
+    """
+    start = time.perf_counter()
+    try:
+        yield attributes
+    finally:
+        record_phase(phase, time.perf_counter() - start, start=start, labels=labels, **attributes)
+
+
+@contextlib.contextmanager
+def request_trace(name, **attributes):
+    """
+    Trace a request. Nested calls join the trace that is already active.
+    The outcome can be set by the caller via trace.attributes["outcome"].
+    """
+    existing = current_trace.get()
+    if existing is not None:
+        yield existing
+        return
+
+    trace = RequestTrace(name, **attributes)
+    token = current_trace.set(trace)
+    try:
+        yield trace
+    except BaseException:
+        trace.attributes["outcome"] = "exception"
+        raise
+    finally:
+        current_trace.reset(token)
+        duration = time.perf_counter() - trace.started
+        outcome = trace.attributes.setdefault("outcome", "ok")
+        REQUEST_SECONDS.observe(duration, name=name)
+        REQUESTS_TOTAL.inc(name=name, outcome=outcome)
+        export(trace, duration)
+
+
+class RunStatusTimer:
+    """
+    Attributes the time a run spends queued or in progress to the queue_wait and
+    model_in_progress phases, based on the statuses observed while polling or streaming.
+    """
+
+    PHASES = {"queued": "queue_wait", "in_progress": "model_in_progress"}
+
+    def __init__(self):
+        self.status = None
+        self.since = None
+
+    def observe(self, status):
+        if status == self.status:
+            return
+        now = time.perf_counter()
+        self.close(now)
+        self.status = status
+        self.since = now
+
+    def close(self, now=None):
+        if self.status in self.PHASES:
+            now = now if now is not None else time.perf_counter()
+            record_phase(self.PHASES[self.status], now - self.since, start=self.since)
+        self.status = None
+        self.since = None
+
+
+def prometheus_file(directory=METRICS_DIR, pid=None):
+    """
+    Return the Prometheus text file of a process (default: the current one).
+    """
+    return os.path.join(directory, f"metrics-{pid if pid is not None else os.getpid()}.prom")
+
+
+def remove_stale_prometheus_files(directory=METRICS_DIR):
+    """
+    Delete the Prometheus files of processes that are no longer running.
+    """
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return
+    for name in names:
+        pid = name[len("metrics-"):-len(".prom")] if name.startswith("metrics-") and name.endswith(".prom") else ""
+        if not pid.isdigit():
+            continue
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join(directory, name))
+        except PermissionError:
+            pass  # Running as another user
+
+
+class MetricsExporter:
+    """
+    Writes finished traces to traces.jsonl and the process metrics to its Prometheus file from
+    a background thread, so requests (and the service's event loop) never wait for the disk.
+    Traces are appended in batches; the Prometheus file is rewritten every interval seconds
+    and when the process exits.
+    """
+
+    def __init__(self, directory=METRICS_DIR, interval=EXPORT_INTERVAL, max_queued=EXPORT_QUEUE_SIZE):
+        self.directory = directory
+        self.trace_file = os.path.join(directory, "traces.jsonl")
+        self.interval = interval
+        self._queue = queue.Queue(max_queued)
+        self._pid = None
+        self._write_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+
+    def submit(self, trace, duration):
+        """
+        Queue a finished trace for writing. Never blocks; traces are dropped when the queue is full.
+        """
+        self._start()
+        try:
+            self._queue.put_nowait(trace.to_dict(duration))
+        except queue.Full:
+            TRACES_DROPPED_TOTAL.inc()
+
+    def _start(self):
+        # The writer thread does not survive a fork, so a new process starts its own
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                remove_stale_prometheus_files(self.directory)
+            except Exception:
+                logger.exception("Error preparing the metrics directory")
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name="metrics-exporter", daemon=True).start()
+            atexit.register(self._flush_at_exit)
+
+    def _run(self):
+        next_render = time.monotonic() + self.interval
+        while True:
+            try:
+                entries = [self._queue.get(timeout=max(0.0, next_render - time.monotonic()))]
+            except queue.Empty:
+                entries = []
+            render = time.monotonic() >= next_render
+            if render:
+                next_render = time.monotonic() + self.interval
+            self._write(entries, render)
+
+    def flush(self):
+        """
+        Write the queued traces and the Prometheus file now.
+        """
+        self._write([], render=True)
+
+    def _flush_at_exit(self):
+        if self._pid == os.getpid():
+            self.flush()
+
+    def _write(self, entries, render):
+        with self._write_lock:
+            while True:
+                try:
+                    entries.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                if entries:
+                    lines = "".join(json.dumps(entry, ensure_ascii=False, default=str) + "\n" for entry in entries)
+                    with open(self.trace_file, "a", encoding="utf-8") as f:
+                        f.write(lines)
+                if render:
+                    path = prometheus_file(self.directory)
+                    tmp_path = f"{path}.tmp"
+                    with open(tmp_path, "w", encoding="utf-8") as f:
+                        f.write(registry.render(labels=[("pid", str(os.getpid()))]))
+                    os.replace(tmp_path, path)
+            except Exception:
+                logger.exception("Error exporting metrics")
+
+
+exporter = MetricsExporter()
+
+
+def export(trace, duration):
+    """
+    Hand the trace to the background exporter.
+    """
+    exporter.submit(trace, duration)
@@ -0,0 +1,251 @@
+import asyncio
+import email.utils
+import functools
+import random
+import threading
+import time
+
+import metrics
+from metrics import get_logger
+
+logger = get_logger("qa_assistant.ratelimit")
+
+# Responses worth retrying: timeouts, rate limits and transient server errors
+RETRY_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+RETRY_BASE_DELAY = 0.5  # seconds, doubled per attempt
+RETRY_MAX_DELAY = 20  # Longest backoff between attempts in seconds
+RETRY_MAX_RETRY_AFTER = 60  # Give up instead of waiting longer than this for Retry-After
+
+# OpenAI requests that make the model generate and therefore spend tokens
+TOKEN_CONSUMING_PATHS = ("/runs", "/submit_tool_outputs", "/chat/completions")
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket refilled at rate tokens per second up to capacity.
+    Callers reserve tokens up front and wait for the returned delay, so the bucket can be
+    shared by threads and event loops alike. Usage only known afterwards (e.g. the tokens
+    of a run) is charged with debit() and delays later callers.
+    """
+
+    def __init__(self, name, rate, capacity=None):
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate * 60
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount=1):
+        """
+        Take amount tokens and return the seconds to wait until they are covered.
+        """
+        with self._lock:
+            self._refill()
+            self.tokens -= amount
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if delay:
+            metrics.THROTTLED_TOTAL.inc(limiter=self.name)
+        return delay
+
+    def debit(self, amount):
+        """
+        Charge tokens that were already spent.
+        """
+        with self._lock:
+            self._refill()
+            self.tokens -= amount
+
+    async def acquire(self, amount=1):
+        delay = self.reserve(amount)
+        if delay:
+            await asyncio.sleep(delay)
+        return delay
+
+    def acquire_sync(self, amount=1):
+        delay = self.reserve(amount)
+        if delay:
+            time.sleep(delay)
+        return delay
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one in-flight call on the current
+    event loop; every caller gets its result or exception. A caller that is cancelled
+    does not cancel the shared call.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+
+    async def do(self, key, fn):
+        """
+        Await fn() once for all concurrent callers of key.
+        """
+        task = self._calls.get(key)
+        if task is not None:
+            metrics.COALESCED_TOTAL.inc(call=self.name)
+            logger.debug(f"Joined in-flight {self.name} call for {key}")
+        else:
+            task = self._calls[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda done: self._forget(key, done))
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()  # Retrieved here in case every caller was cancelled
+
+
+def parse_retry_after(headers):
+    """
+    Return the delay requested by Retry-After (or OpenAI's retry-after-ms) in seconds, or None.
+    """
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_delay(attempt, retry_after=None):
+    """
+    Return the seconds to wait before retry number attempt (starting at 0): the server's
+    Retry-After if given, otherwise exponential backoff with full jitter. Returns None if
+    the server asks for a longer wait than RETRY_MAX_RETRY_AFTER.
+    """
+    if retry_after is not None:
+        return retry_after if retry_after <= RETRY_MAX_RETRY_AFTER else None
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
+
+def should_retry(response):
+    # OpenAI says explicitly whether a request can be retried
+    should = response.headers.get("x-should-retry")
+    if should in ("true", "false"):
+        return should == "true"
+    return response.status_code in RETRY_STATUS_CODES
+
+
+def consumes_tokens(request):
+    return request.method == "POST" and request.url.path.endswith(TOKEN_CONSUMING_PATHS)
+
+
+@functools.cache
+def transport_classes():
+    """
+    Define the rate limited httpx transports on first use, so importing this module does not
+    import httpx (see the deferred imports in assistant.py). They are available as
+    ratelimit.RateLimitedTransport and ratelimit.SyncRateLimitedTransport.
+    """
+    import httpx
+
+    class RateLimitedTransport(httpx.AsyncBaseTransport):
+        """
+        Wraps the transport of the AsyncOpenAI client: waits for the shared request (and, for
+        generating requests, token) budget and retries rate-limited or failed requests with
+        jittered exponential backoff honoring Retry-After. The client's own retries should be
+        disabled (max_retries=0).
+        """
+
+        def __init__(self, transport, requests, tokens=None, max_retries=4, target="openai"):
+            self.transport = transport
+            self.requests = requests
+            self.tokens = tokens
+            self.max_retries = max_retries
+            self.target = target
+
+        async def handle_async_request(self, request):
+            for attempt in range(self.max_retries + 1):
+                await self.requests.acquire()
+                if self.tokens is not None and consumes_tokens(request):
+                    await self.tokens.acquire(0)
+                try:
+                    response = await self.transport.handle_async_request(request)
+                except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                    # Nothing was sent, so the request is safe to repeat
+                    delay = retry_delay(attempt) if attempt < self.max_retries else None
+                    if delay is None:
+                        raise
+                    logger.warning(f"{self.target} connection failed ({e}), retrying in {delay:.1f}s")
+                else:
+                    delay = None
+                    if attempt < self.max_retries and should_retry(response):
+                        delay = retry_delay(attempt, parse_retry_after(response.headers))
+                    if delay is None:
+                        return response
+                    await response.aclose()
+                    logger.warning(f"{self.target} returned {response.status_code}, retrying in {delay:.1f}s")
+                metrics.RETRIES_TOTAL.inc(target=self.target)
+                await asyncio.sleep(delay)
+
+        async def aclose(self):
+            await self.transport.aclose()
+
+    class SyncRateLimitedTransport(httpx.BaseTransport):
+        """
+        The same as RateLimitedTransport for the synchronous OpenAI client.
+        """
+
+        def __init__(self, transport, requests, tokens=None, max_retries=4, target="openai"):
+            self.transport = transport
+            self.requests = requests
+            self.tokens = tokens
+            self.max_retries = max_retries
+            self.target = target
+
+        def handle_request(self, request):
+            for attempt in range(self.max_retries + 1):
+                self.requests.acquire_sync()
+                if self.tokens is not None and consumes_tokens(request):
+                    self.tokens.acquire_sync(0)
+                try:
+                    response = self.transport.handle_request(request)
+                except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                    delay = retry_delay(attempt) if attempt < self.max_retries else None
+                    if delay is None:
+                        raise
+                    logger.warning(f"{self.target} connection failed ({e}), retrying in {delay:.1f}s")
+                else:
+                    delay = None
+                    if attempt < self.max_retries and should_retry(response):
+                        delay = retry_delay(attempt, parse_retry_after(response.headers))
+                    if delay is None:
+                        return response
+                    response.close()
+                    logger.warning(f"{self.target} returned {response.status_code}, retrying in {delay:.1f}s")
+                metrics.RETRIES_TOTAL.inc(target=self.target)
+                time.sleep(delay)
+
+        def close(self):
+            self.transport.close()
+
+    return RateLimitedTransport, SyncRateLimitedTransport
+
+
+def __getattr__(name):
+    if name == "RateLimitedTransport":
+        return transport_classes()[0]
+    if name == "SyncRateLimitedTransport":
+        return transport_classes()[1]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
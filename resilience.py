@@ -0,0 +1,172 @@
+import asyncio
+import collections
+import threading
+import time
+
+import metrics
+from metrics import get_logger
+
+logger = get_logger("qa_assistant.resilience")
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of making a call while its circuit breaker is open.
+    """
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive failures and rejects calls for reset_timeout
+    seconds. Then it lets one trial call through (half-open): a success closes it again,
+    a failure reopens it. A trial that never reports back (e.g. a cancelled call) is
+    replaced by a new one after another reset_timeout.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_started = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        """
+        Return whether a call may go ahead; rejected calls are counted.
+        """
+        with self._lock:
+            state = self._state()
+            if state == "closed":
+                return True
+            now = time.monotonic()
+            if state == "half_open" and (
+                self._trial_started is None or now - self._trial_started >= self.reset_timeout
+            ):
+                self._trial_started = now
+                return True
+        metrics.BREAKER_REJECTIONS_TOTAL.inc(breaker=self.name)
+        return False
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                logger.info(f"Circuit breaker {self.name} closed")
+            self.failures = 0
+            self.opened_at = None
+            self._trial_started = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_started is not None or (self.opened_at is None and self.failures >= self.failure_threshold):
+                logger.warning(f"Circuit breaker {self.name} opened after {self.failures} failures")
+                self.opened_at = time.monotonic()
+            self._trial_started = None
+
+
+class CircuitBreakers:
+    """
+    A registry of circuit breakers created on first use, e.g. one per host and one per route.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        with self._lock:
+            breaker = self._breakers.get(name)
+            if breaker is None:
+                breaker = self._breakers[name] = CircuitBreaker(name, self.failure_threshold, self.reset_timeout)
+            return breaker
+
+
+class LatencyTracker:
+    """
+    Keeps the latencies of the last window calls to estimate percentiles.
+    """
+
+    def __init__(self, window=200):
+        self._samples = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def percentile(self, fraction):
+        """
+        Nearest-rank percentile of the recorded latencies, or None without samples.
+        """
+        with self._lock:
+            samples = list(self._samples)
+        return metrics.percentile(samples, fraction, default=None)
+
+
+async def hedged(attempts, delay, accept=lambda result: True):
+    """
+    Run (name, coroutine function) attempts, starting the next one when the running ones
+    have not finished after delay seconds or have all failed. Returns (name, result) of the
+    first accepted result and cancels the others. If no result is accepted, the last
+    result is returned, or the last exception raised if every attempt raised.
+    """
+    remaining = list(attempts)
+    pending = {}
+    last_result = None
+    last_error = None
+
+    def start():
+        name, fn = remaining.pop(0)
+        pending[asyncio.ensure_future(fn())] = name
+        return name
+
+    start()
+    try:
+        while pending:
+            done, _ = await asyncio.wait(
+                pending, timeout=delay if remaining else None, return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                name = start()
+                metrics.HEDGED_REQUESTS_TOTAL.inc(outcome="started")
+                logger.info(f"No response after {delay:.2f}s, hedging with {name}")
+                continue
+            for task in done:
+                name = pending.pop(task)
+                try:
+                    result = task.result()
+                except Exception as e:
+                    last_error = e
+                    continue
+                if accept(result):
+                    if name != attempts[0][0]:
+                        metrics.HEDGED_REQUESTS_TOTAL.inc(outcome="won")
+                    return name, result
+                last_result = (name, result)
+            if not pending and remaining:
+                start()
+    finally:
+        for task in pending:
+            task.cancel()
+    if last_result is not None:
+        return last_result
+    raise last_error
@@ -0,0 +1,392 @@
+import array
+import heapq
+import io
+import json
+import logging
+import math
+import mmap
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import unicodedata
+
+logger = logging.getLogger("qa_assistant.retrieval")
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Chunking settings
+CHUNK_MAX_CHARS = 800
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+UMLAUTS = str.maketrans({"ä": "ae", "ö": "oe", "ü": "ue", "ß": "ss"})
+STOPWORDS = {
+    # English
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "how", "in", "is", "it",
+    "of", "on", "or", "that", "the", "this", "to", "was", "what", "when", "where", "which",
+    "who", "with",
+    # German
+    "aber", "als", "am", "an", "auch", "auf", "aus", "bei", "das", "dass", "dem", "den", "der",
+    "des", "die", "ein", "eine", "einem", "einen", "einer", "es", "fuer", "im", "ist", "mit",
+    "nach", "nicht", "oder", "sich", "sie", "sind", "und", "von", "was", "wie", "wo", "zu", "zum",
+    "zur",
+}
+COMPOUND_MIN_LENGTH = 8
+COMPOUND_MIN_PART = 4
+TEXT_EXTENSIONS = (".txt", ".md", ".csv", ".json", ".html", ".htm", ".xml")
+
+
+def normalize_token(token):
+    """
+    Lowercase a token, transliterate German umlauts and strip remaining accents.
+    """
+    token = token.casefold().translate(UMLAUTS)
+    token = unicodedata.normalize("NFKD", token)
+    return "".join(ch for ch in token if not unicodedata.combining(ch))
+
+
+def split_compound(token, vocabulary):
+    """
+    Split a (German) compound into a head and a tail, preferring splits where both parts
+    occur in the vocabulary and otherwise accepting a known head (the tail may only ever
+    occur inside compounds). Handles the linking "s" (e.g. "ausbildungskurs" -> "ausbildung", "kurs").
+    Returns an empty list if no split is found.
+    """
+    if len(token) < COMPOUND_MIN_LENGTH:
+        return []
+    fallback = []
+    for i in range(COMPOUND_MIN_PART, len(token) - COMPOUND_MIN_PART + 1):
+        head, tail = token[:i], token[i:]
+        if head not in vocabulary and head.endswith("s") and head[:-1] in vocabulary:
+            head = head[:-1]
+        if head not in vocabulary:
+            continue
+        if tail in vocabulary:
+            return [head, tail]
+        fallback = [head, tail]
+    return fallback
+
+
+def tokenize(text, vocabulary=None, stopwords=STOPWORDS):
+    """
+    Turn text into normalized index terms. When a vocabulary is given, compounds
+    are additionally decomposed into their parts.
+    """
+    terms = []
+    for match in TOKEN_RE.finditer(text):
+        token = normalize_token(match.group())
+        if token in stopwords or len(token) < 2:
+            continue
+        terms.append(token)
+        if vocabulary is not None:
+            terms.extend(split_compound(token, vocabulary))
+    return terms
+
+
+def chunk_text(text, max_chars=CHUNK_MAX_CHARS):
+    """
+    Split text into chunks of whole paragraphs of at most max_chars characters.
+    Paragraphs longer than max_chars are cut at whitespace.
+    """
+    paragraphs = [p.strip() for p in re.split(r"\n\s*\n", text) if p.strip()]
+    chunks = []
+    current = ""
+    for paragraph in paragraphs:
+        while len(paragraph) > max_chars:
+            cut = paragraph.rfind(" ", 0, max_chars)
+            if cut <= 0:
+                cut = max_chars
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(paragraph[:cut].strip())
+            paragraph = paragraph[cut:].strip()
+        if current and len(current) + len(paragraph) + 2 > max_chars:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def extract_text(name, data):
+    """
+    Extract plain text from an uploaded document. Returns None for unsupported formats.
+    """
+    lower_name = name.lower()
+    if lower_name.endswith(".pdf"):
+        try:
+            from pypdf import PdfReader  # Imported here, it takes longer to load than the app
+        except ImportError:  # PDF extraction is optional
+            logger.warning(f"Skipping '{name}': install pypdf to index PDF files.")
+            return None
+        reader = PdfReader(io.BytesIO(data))
+        return "\n\n".join(page.extract_text() or "" for page in reader.pages)
+    if lower_name.endswith(TEXT_EXTENSIONS):
+        return data.decode("utf-8", errors="replace")
+    logger.warning(f"Skipping '{name}': unsupported format for the local index.")
+    return None
+
+
+class BM25Index:
+    """
+    A compact inverted index with BM25 scoring. Postings are stored as (chunk, term frequency)
+    pairs of uint32 in postings.bin and memory-mapped when the index is opened; the
+    dictionary, chunk texts and lengths live in meta.json.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            self.version = index_version(f.fileno())
+            meta = json.load(f)
+        self.k1 = meta["k1"]
+        self.b = meta["b"]
+        self.chunks = meta["chunks"]
+        self.doc_lengths = meta["doc_lengths"]
+        self.avgdl = meta["avgdl"] or 1.0
+        self.terms = meta["terms"]
+        self.vocabulary = set(self.terms)
+        self._file = open(os.path.join(path, "postings.bin"), "rb")
+        if os.fstat(self._file.fileno()).st_size:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._postings = memoryview(self._mmap).cast("I")
+        else:
+            self._mmap = None
+            self._postings = memoryview(array.array("I"))
+
+    @classmethod
+    def build(cls, documents, path, k1=BM25_K1, b=BM25_B, max_chars=CHUNK_MAX_CHARS):
+        """
+        Build an index from (source name, text) pairs, write it to path and open it.
+        """
+        chunks = []
+        for source, text in documents:
+            for chunk in chunk_text(text, max_chars):
+                chunks.append({"source": source, "text": chunk})
+
+        # First pass: plain tokens form the vocabulary used to split compounds
+        plain_tokens = [tokenize(chunk["text"]) for chunk in chunks]
+        vocabulary = {token for tokens in plain_tokens for token in tokens if len(token) >= COMPOUND_MIN_PART}
+
+        postings = {}
+        doc_lengths = []
+        for chunk_id, tokens in enumerate(plain_tokens):
+            terms = []
+            for token in tokens:
+                terms.append(token)
+                terms.extend(split_compound(token, vocabulary))
+            doc_lengths.append(len(terms))
+            frequencies = {}
+            for term in terms:
+                frequencies[term] = frequencies.get(term, 0) + 1
+            for term, tf in frequencies.items():
+                postings.setdefault(term, []).append((chunk_id, tf))
+
+        data = array.array("I")
+        terms = {}
+        for term in sorted(postings):
+            entries = postings[term]
+            terms[term] = [len(data) // 2, len(entries)]
+            for chunk_id, tf in entries:
+                data.append(chunk_id)
+                data.append(tf)
+
+        meta = {
+            "k1": k1,
+            "b": b,
+            "avgdl": sum(doc_lengths) / len(doc_lengths) if doc_lengths else 0.0,
+            "doc_lengths": doc_lengths,
+            "chunks": chunks,
+            "terms": terms,
+        }
+
+        parent = os.path.dirname(os.path.abspath(path))
+        os.makedirs(parent, exist_ok=True)
+        tmp_path = tempfile.mkdtemp(prefix=f".{os.path.basename(path)}.", suffix=".tmp", dir=parent)
+        try:
+            with open(os.path.join(tmp_path, "postings.bin"), "wb") as f:
+                data.tofile(f)
+            with open(os.path.join(tmp_path, "meta.json"), "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False)
+            # Open copies keep their memory-mapped postings after the files are removed
+            shutil.rmtree(path, ignore_errors=True)
+            os.rename(tmp_path, path)
+        except BaseException:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+        logger.info(f"Built local document index with {len(chunks)} chunks and {len(terms)} terms at {path}")
+        return cls(path)
+
+    def close(self):
+        self._postings.release()
+        if self._mmap is not None:
+            self._mmap.close()
+        self._file.close()
+
+    def search(self, query, top_k=5):
+        """
+        Return the top_k chunks for query as dicts with score, source and text.
+        """
+        n = len(self.chunks)
+        scores = {}
+        for term in set(tokenize(query, self.vocabulary)):
+            entry = self.terms.get(term)
+            if entry is None:
+                continue
+            offset, df = entry
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            postings = self._postings[offset * 2:(offset + df) * 2]
+            for i in range(0, len(postings), 2):
+                chunk_id, tf = postings[i], postings[i + 1]
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[chunk_id] / self.avgdl)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        best = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+        return [
+            {"score": round(score, 4), "source": self.chunks[chunk_id]["source"], "text": self.chunks[chunk_id]["text"]}
+            for chunk_id, score in best
+        ]
+
+
+_open_indexes = {}
+_open_indexes_lock = threading.Lock()
+_searches = {}  # In-flight searches per open index, guarded by _open_indexes_lock
+
+
+def index_version(meta_file):
+    """
+    Identify a build of an index by the inode and modification time of its meta.json.
+    """
+    stat = os.stat(meta_file)
+    return stat.st_ino, stat.st_mtime_ns
+
+
+def _replace_open_index(path, index):
+    """
+    Make index the open copy of path (the lock must be held). The previous copy is closed
+    right away, or by the last search still using it.
+    """
+    old = _open_indexes.get(path)
+    _open_indexes[path] = index
+    if old is not None and old is not index and not _searches.get(old):
+        old.close()
+
+
+def _open_index(path):
+    """
+    Return the open copy of the index at path, (re)opening it if it changed on disk
+    (the lock must be held).
+    """
+    index = _open_indexes.get(path)
+    try:
+        version = index_version(os.path.join(path, "meta.json"))
+    except FileNotFoundError:
+        return index
+    if index is None or index.version != version:
+        index = BM25Index(path)
+        _replace_open_index(path, index)
+    return index
+
+
+def open_index(path):
+    """
+    Open (and cache per process) the index stored at path. Returns None if it does not exist.
+    An index rebuilt by another process is reopened on the next call. Call it when the app
+    starts to load the index before the first query; queries go through search(), which
+    keeps the copy it uses open until it is done.
+    """
+    with _open_indexes_lock:
+        return _open_index(path)
+
+
+def build_index(path, documents):
+    """
+    Build the index at path from (source name, text) pairs, replacing any open copy.
+    Searches keep using the old copy until the new one is in place; its memory map is
+    closed once the last of them finishes.
+    """
+    index = BM25Index.build(documents, path)
+    with _open_indexes_lock:
+        _replace_open_index(path, index)
+    return index
+
+
+def search(path, query, top_k=5):
+    """
+    Query the index stored at path. Returns an empty list if there is no index.
+    """
+    with _open_indexes_lock:
+        index = _open_index(path)
+        if index is None:
+            return []
+        _searches[index] = _searches.get(index, 0) + 1
+    try:
+        return index.search(query, top_k=top_k)
+    finally:
+        with _open_indexes_lock:
+            _searches[index] -= 1
+            if not _searches[index]:
+                del _searches[index]
+                if _open_indexes.get(path) is not index:
+                    index.close()
+
+
+def score_passages(query, passages, k1=BM25_K1, b=BM25_B):
+    """
+    Score a small set of passages against query with BM25 computed in memory, for
+    ranking text that is not worth indexing on disk (e.g. a scraped page).
+    Returns one score per passage, in passage order.
+    """
+    plain_tokens = [tokenize(passage) for passage in passages]
+    vocabulary = {token for tokens in plain_tokens for token in tokens if len(token) >= COMPOUND_MIN_PART}
+    frequencies = []
+    document_frequencies = {}
+    for tokens in plain_tokens:
+        counts = {}
+        for token in tokens:
+            for term in [token] + split_compound(token, vocabulary):
+                counts[term] = counts.get(term, 0) + 1
+        frequencies.append(counts)
+        for term in counts:
+            document_frequencies[term] = document_frequencies.get(term, 0) + 1
+
+    n = len(passages)
+    doc_lengths = [sum(counts.values()) for counts in frequencies]
+    avgdl = sum(doc_lengths) / n if n else 0.0
+    scores = [0.0] * n
+    for term in set(tokenize(query, vocabulary)):
+        df = document_frequencies.get(term)
+        if not df:
+            continue
+        idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+        for i, counts in enumerate(frequencies):
+            tf = counts.get(term)
+            if tf:
+                norm = k1 * (1 - b + b * doc_lengths[i] / avgdl)
+                scores[i] += idf * tf * (k1 + 1) / (tf + norm)
+    return scores
+
+
+if __name__ == "__main__":
+    # Usage:
+    #   python retrieval.py build <index dir> <file> [<file> ...]
+    #   python retrieval.py query <index dir> <question> [top_k]
+    if len(sys.argv) >= 4 and sys.argv[1] == "build":
+        documents = []
+        for file_path in sys.argv[3:]:
+            with open(file_path, "rb") as f:
+                text = extract_text(os.path.basename(file_path), f.read())
+            if text:
+                documents.append((os.path.basename(file_path), text))
+        build_index(sys.argv[2], documents)
+    elif len(sys.argv) >= 4 and sys.argv[1] == "query":
+        top_k = int(sys.argv[4]) if len(sys.argv) > 4 else 5
+        for hit in search(sys.argv[2], sys.argv[3], top_k):
+            print(f"[{hit['score']}] {hit['source']}\n{hit['text']}\n")
+    else:
+        print("Usage: python retrieval.py build <index dir> <files...> | query <index dir> <question> [top_k]")
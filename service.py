@@ -0,0 +1,374 @@
+"""
+Headless HTTP/JSON chat service around the assistant, for multi-user serving behind a load balancer.
+
+    uvicorn service:app --host 0.0.0.0 --port 8000 --workers 4
+
+Endpoints:
+    POST /assistants                            multipart form: files (repeated), language
+    POST /chat                                  JSON: assistant_id, message, language, session_id, stream
+    GET  /sessions/{session_id}                  token totals of the session
+    GET  /sessions/{session_id}/files/{file_id} download an artifact produced in the session
+    GET  /healthz
+    GET  /metrics                               Prometheus text format
+
+Chats run on the same async core as the Streamlit app (assistant.call_agent), with the same
+instructions, tools and tool dispatch. With "stream": true the answer is sent as server-sent
+events: "text" (answer so far), "tool_calls" and finally "done" (or "error").
+"""
+import asyncio
+import contextlib
+import functools
+import hashlib
+import hmac
+import json
+import mimetypes
+import os
+import re
+import time
+import uuid
+import weakref
+from urllib.parse import quote
+
+from starlette.applications import Starlette
+from starlette.datastructures import UploadFile
+from starlette.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+
+import assistant
+import metrics
+from cache import CACHE_DIR
+from metrics import get_logger
+from sessions import InMemorySessionStore, SQLiteSessionStore
+
+logger = get_logger("qa_assistant.service")
+
+# "sqlite" shares sessions between the workers of a host, "memory" is for a single worker
+SESSION_STORE = os.environ.get("QA_ASSISTANT_SESSION_STORE", "sqlite")
+SESSION_DB = os.path.join(CACHE_DIR, "sessions.sqlite3")
+SESSION_TTL = 7 * 24 * 3600  # seconds
+# Runs of a session hold a lease in the session store, renewed while the run lasts, so the
+# lease of a crashed worker frees the session after at most SESSION_LEASE_TTL
+SESSION_LEASE_TTL = 30  # seconds
+# Longest wait for a busy session before answering 409; the turn in progress ends by then
+SESSION_LEASE_WAIT = assistant.RUN_TIMEOUT
+SESSION_LEASE_POLL_INTERVAL = 0.1  # First wait between attempts in seconds, doubled up to the max
+SESSION_LEASE_MAX_POLL_INTERVAL = 5  # seconds
+
+# If set, requests must send "Authorization: Bearer <token>"
+SERVICE_TOKEN = os.environ.get("QA_ASSISTANT_SERVICE_TOKEN")
+
+INSTRUCTIONS = {
+    "English": assistant.english_instructions,
+    "German": assistant.german_instructions,
+}
+
+SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,128}$")
+
+# Runs of one session are serialized, a thread can only have one active run
+_session_locks = weakref.WeakValueDictionary()
+
+
+class SessionBusyError(Exception):
+    """
+    Raised when a session stays busy with another request for longer than SESSION_LEASE_WAIT.
+    """
+
+# Strong references to fire-and-forget tasks
+_background_tasks = set()
+
+
+def make_session_store(kind=SESSION_STORE):
+    if kind == "memory":
+        return InMemorySessionStore()
+    if kind == "sqlite":
+        return SQLiteSessionStore(SESSION_DB, ttl=SESSION_TTL)
+    raise ValueError(f"Unknown session store: {kind}")
+
+
+async def renew_lease(store, session_id, owner):
+    while True:
+        await asyncio.sleep(SESSION_LEASE_TTL / 3)
+        if not await asyncio.to_thread(store.acquire_lease, session_id, owner, SESSION_LEASE_TTL):
+            logger.warning(f"Lost the lease of session {session_id}")
+
+
+@contextlib.asynccontextmanager
+async def session_lock(store, session_id):
+    """
+    Serialize the turns of a session: a lock within the process and a lease in the session
+    store, so workers sharing the store do not start runs on the same thread concurrently.
+    """
+    lock = _session_locks.get(session_id)
+    if lock is None:
+        lock = _session_locks[session_id] = asyncio.Lock()
+    busy = SessionBusyError(f"Session {session_id} is busy with another request.")
+    deadline = time.monotonic() + SESSION_LEASE_WAIT
+    try:
+        await asyncio.wait_for(lock.acquire(), SESSION_LEASE_WAIT)
+    except asyncio.TimeoutError:
+        raise busy from None
+    try:
+        owner = uuid.uuid4().hex
+        interval = SESSION_LEASE_POLL_INTERVAL
+        while not await asyncio.to_thread(store.acquire_lease, session_id, owner, SESSION_LEASE_TTL):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise busy
+            await asyncio.sleep(min(interval, remaining))
+            interval = min(interval * 2, SESSION_LEASE_MAX_POLL_INTERVAL)
+        renewal = asyncio.ensure_future(renew_lease(store, session_id, owner))
+        try:
+            yield
+        finally:
+            renewal.cancel()
+            await asyncio.to_thread(store.release_lease, session_id, owner)
+    finally:
+        lock.release()
+
+
+def prefetch_artifacts(artifacts):
+    """
+    Start downloading artifacts into the artifact store without delaying the answer.
+    """
+    task = asyncio.ensure_future(assistant.on_core_loop(assistant.fetch_artifacts(artifacts)))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+def error_response(message, status_code):
+    return JSONResponse({"error": message}, status_code=status_code)
+
+
+def protected(handler):
+    """
+    Reject requests without the service token when QA_ASSISTANT_SERVICE_TOKEN is set.
+    """
+    @functools.wraps(handler)
+    async def wrapper(request):
+        if SERVICE_TOKEN and not hmac.compare_digest(
+            request.headers.get("authorization", ""), f"Bearer {SERVICE_TOKEN}"
+        ):
+            return error_response("Unauthorized", 401)
+        return await handler(request)
+    return wrapper
+
+
+def format_event(name, payload):
+    return f"event: {name}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+def session_usage(context):
+    if context is None:
+        return None
+    return {key: context[key] for key in ("prompt_tokens", "completion_tokens", "total_tokens", "turns", "compactions")}
+
+
+async def answer(store, session_id, assistant_id, language, message, on_event=None):
+    """
+    Answer a chat message by running the assistant on the session thread, or from the
+    answer cache for the first message of a session, and return the JSON result.
+    The session's thread is created by its first run.
+    """
+    with metrics.request_trace("service_chat", assistant_id=assistant_id, language=language) as trace:
+        run_info = {}
+        async with session_lock(store, session_id):
+            context = await asyncio.to_thread(store.get_context, session_id)
+            first_turn = assistant.is_first_turn(context)
+            context = context if context is not None else assistant.new_thread_context(None)
+            entry = None
+            if first_turn:
+                entry = await asyncio.to_thread(assistant.lookup_cached_answer, assistant_id, language, message)
+            if entry is not None:
+                logger.info(f"Answer cache hit for: {message}")
+                trace.attributes["outcome"] = "cache_hit"
+                response, artifacts, answered = entry["response"], entry["artifacts"], True
+                assistant.record_cached_turn(context, message, response)
+                await asyncio.to_thread(store.set_context, session_id, context)
+            else:
+                try:
+                    response, _, _ = await assistant.call_agent(context, assistant_id, message, run_info, on_event)
+                finally:
+                    # Keep the token totals and a compacted thread even if the run failed
+                    await asyncio.to_thread(store.set_context, session_id, context)
+                artifacts = run_info.get("artifacts", [])
+                answered = bool(run_info.get("answered"))
+                trace.attributes["outcome"] = "answered" if answered else "error"
+                if answered and first_turn and not run_info.get("incomplete"):
+                    await asyncio.to_thread(
+                        assistant.cache_answer, assistant_id, language, message, response, artifacts
+                    )
+
+        if artifacts:
+            await asyncio.to_thread(store.add_artifacts, session_id, artifacts)
+            prefetch_artifacts(artifacts)
+        return {
+            "session_id": session_id,
+            "answered": answered,
+            "incomplete": bool(run_info.get("incomplete")),
+            "response": response,
+            "artifacts": [
+                dict(artifact, url=f"/sessions/{session_id}/files/{artifact['file_id']}") for artifact in artifacts
+            ],
+            "usage": run_info.get("usage"),
+            "session_usage": session_usage(context),
+            "request_id": trace.request_id,
+        }
+
+
+async def stream_answer(store, session_id, assistant_id, language, message):
+    """
+    Yield the progress of answer() as server-sent events.
+    """
+    events = asyncio.Queue()
+
+    async def produce():
+        try:
+            return await answer(store, session_id, assistant_id, language, message, events.put_nowait)
+        finally:
+            events.put_nowait(None)
+
+    task = asyncio.ensure_future(produce())
+    try:
+        while (event := await events.get()) is not None:
+            yield format_event(event["type"], event)
+        yield format_event("done", await task)
+    except Exception as e:
+        logger.exception(f"Error streaming chat for session {session_id}: {str(e)}")
+        yield format_event("error", {"session_id": session_id, "error": str(e)})
+    finally:
+        # If the client disconnected, this cancels the run (see assistant.run_agent_on_thread)
+        task.cancel()
+
+
+@protected
+async def create_assistant(request):
+    form = await request.form()
+    language = form.get("language", "English")
+    if language not in INSTRUCTIONS:
+        return error_response(f"language must be one of {sorted(INSTRUCTIONS)}", 400)
+    documents = [
+        (upload.filename, await upload.read())
+        for upload in form.getlist("files")
+        if isinstance(upload, UploadFile)
+    ]
+    if not documents:
+        return error_response("Upload at least one file as 'files'.", 400)
+
+    file_ids = await asyncio.to_thread(assistant.upload_documents, documents)
+    if len(file_ids) != len({hashlib.sha256(data).hexdigest() for _, data in documents}):
+        return error_response("Uploading the files failed.", 502)
+    assistant_id = await asyncio.to_thread(assistant.create_assistant, file_ids, INSTRUCTIONS[language])
+    if not assistant_id:
+        return error_response("Creating the assistant failed.", 502)
+    await asyncio.to_thread(assistant.build_document_index, assistant_id, documents)
+    return JSONResponse({"assistant_id": assistant_id, "file_ids": file_ids}, status_code=201)
+
+
+@protected
+async def clear_cached_answers(request):
+    assistant_id = request.path_params["assistant_id"]
+    removed = await asyncio.to_thread(assistant.invalidate_answer_cache, assistant_id)
+    return JSONResponse({"assistant_id": assistant_id, "removed": removed})
+
+
+@protected
+async def chat(request):
+    try:
+        payload = await request.json()
+    except ValueError:
+        return error_response("Request body must be JSON.", 400)
+    if not isinstance(payload, dict):
+        return error_response("Request body must be a JSON object.", 400)
+
+    assistant_id = payload.get("assistant_id")
+    message = payload.get("message")
+    language = payload.get("language", "English")
+    session_id = payload.get("session_id") or uuid.uuid4().hex
+    if not isinstance(assistant_id, str) or not assistant_id:
+        return error_response("assistant_id is required.", 400)
+    if not isinstance(message, str) or not message.strip():
+        return error_response("message is required.", 400)
+    if language not in INSTRUCTIONS:
+        return error_response(f"language must be one of {sorted(INSTRUCTIONS)}", 400)
+    if not isinstance(session_id, str) or not SESSION_ID_PATTERN.match(session_id):
+        return error_response("session_id may only contain letters, digits, '_' and '-'.", 400)
+
+    store = request.app.state.session_store
+    if payload.get("stream"):
+        return StreamingResponse(
+            stream_answer(store, session_id, assistant_id, language, message),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+    try:
+        result = await answer(store, session_id, assistant_id, language, message)
+    except SessionBusyError as e:
+        return error_response(str(e), 409)
+    return JSONResponse(result, status_code=200 if result["answered"] else 502)
+
+
+@protected
+async def get_session(request):
+    session_id = request.path_params["session_id"]
+    context = await asyncio.to_thread(request.app.state.session_store.get_context, session_id)
+    if context is None:
+        return error_response("Unknown session.", 404)
+    return JSONResponse({"session_id": session_id, "session_usage": session_usage(context)})
+
+
+@protected
+async def download_artifact(request):
+    session_id = request.path_params["session_id"]
+    file_id = request.path_params["file_id"]
+    artifact = await asyncio.to_thread(request.app.state.session_store.get_artifact, session_id, file_id)
+    if artifact is None:
+        return error_response("Unknown artifact.", 404)
+    try:
+        digest = await assistant.on_core_loop(assistant.fetch_artifact(file_id))
+        path = await asyncio.to_thread(assistant.artifact_store.path, digest)
+    except Exception as e:
+        logger.error(f"Error downloading artifact {file_id}: {str(e)}")
+        return error_response("Downloading the artifact failed.", 502)
+    if path is None:
+        return error_response("Downloading the artifact failed.", 502)
+    media_type = mimetypes.guess_type(artifact["name"])[0] or "application/octet-stream"
+    return FileResponse(
+        path,
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename*=UTF-8''{quote(artifact['name'])}"},
+    )
+
+
+async def healthz(request):
+    return JSONResponse({"status": "ok"})
+
+
+async def prometheus_metrics(request):
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    # Load the local search indexes before the first request instead of during it
+    await asyncio.to_thread(assistant.open_local_indexes)
+    yield
+
+
+def create_app(session_store=None):
+    """
+    Create the ASGI app. session_store defaults to the store selected by QA_ASSISTANT_SESSION_STORE.
+    """
+    app = Starlette(lifespan=lifespan, routes=[
+        Route("/assistants", create_assistant, methods=["POST"]),
+        Route("/assistants/{assistant_id}/answers", clear_cached_answers, methods=["DELETE"]),
+        Route("/chat", chat, methods=["POST"]),
+        Route("/sessions/{session_id}", get_session, methods=["GET"]),
+        Route("/sessions/{session_id}/files/{file_id}", download_artifact, methods=["GET"]),
+        Route("/healthz", healthz, methods=["GET"]),
+        Route("/metrics", prometheus_metrics, methods=["GET"]),
+    ])
+    app.state.session_store = session_store if session_store is not None else make_session_store()
+    return app
+
+
+app = create_app()
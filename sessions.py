@@ -0,0 +1,168 @@
+import abc
+import collections
+import contextlib
+import sqlite3
+import threading
+import time
+
+from cache import PersistentCache
+
+
+class SessionStore(abc.ABC):
+    """
+    Maps chat sessions to their thread context (OpenAI thread ID and token totals, see
+    assistant.new_thread_context) and to the artifacts produced in them.
+    Implementations must be safe to use from several threads.
+    """
+
+    @abc.abstractmethod
+    def get_context(self, session_id):
+        """
+        Return the thread context of the session, or None for a new session.
+        """
+
+    @abc.abstractmethod
+    def set_context(self, session_id, context):
+        """
+        Store the thread context of the session after a turn, replacing the previous one.
+        """
+
+    @abc.abstractmethod
+    def add_artifacts(self, session_id, artifacts):
+        """
+        Remember artifact references ({kind, name, file_id}) so they can be downloaded later.
+        """
+
+    @abc.abstractmethod
+    def get_artifact(self, session_id, file_id):
+        """
+        Return the artifact reference of file_id if it was produced in the session, else None.
+        """
+
+    @abc.abstractmethod
+    def acquire_lease(self, session_id, owner, ttl):
+        """
+        Take or renew the lease of the session for owner for ttl seconds. Returns False
+        while another owner holds an unexpired lease. Leases serialize the runs of a session
+        across every worker sharing the store.
+        """
+
+    @abc.abstractmethod
+    def release_lease(self, session_id, owner):
+        """
+        Give up the lease of the session if owner still holds it.
+        """
+
+
+class InMemorySessionStore(SessionStore):
+    """
+    Keeps sessions in process memory, evicting the least recently used beyond max_sessions.
+    Sessions are lost on restart and not shared between workers.
+    """
+
+    def __init__(self, max_sessions=10000):
+        self.max_sessions = max_sessions
+        self._sessions = collections.OrderedDict()
+        self._leases = {}
+        self._lock = threading.Lock()
+
+    def _session(self, session_id):
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = self._sessions[session_id] = {"context": None, "artifacts": {}}
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def get_context(self, session_id):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            return dict(session["context"]) if session and session["context"] else None
+
+    def set_context(self, session_id, context):
+        with self._lock:
+            self._session(session_id)["context"] = dict(context)
+
+    def add_artifacts(self, session_id, artifacts):
+        with self._lock:
+            session = self._session(session_id)
+            for artifact in artifacts:
+                session["artifacts"][artifact["file_id"]] = dict(artifact)
+
+    def get_artifact(self, session_id, file_id):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            return session["artifacts"].get(file_id) if session else None
+
+    def acquire_lease(self, session_id, owner, ttl):
+        now = time.time()
+        with self._lock:
+            lease = self._leases.get(session_id)
+            if lease is not None and lease[0] != owner and lease[1] > now:
+                return False
+            self._leases[session_id] = (owner, now + ttl)
+            return True
+
+    def release_lease(self, session_id, owner):
+        with self._lock:
+            lease = self._leases.get(session_id)
+            if lease is not None and lease[0] == owner:
+                del self._leases[session_id]
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Keeps sessions in a SQLite database, shared by all worker processes on the host.
+    Sessions expire ttl seconds after their last turn (None keeps them forever).
+    """
+
+    def __init__(self, path, ttl=None):
+        self._cache = PersistentCache(path, ttl=ttl, max_entries=None)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS leases ("
+                " session_id TEXT PRIMARY KEY,"
+                " owner TEXT NOT NULL,"
+                " locked_until REAL NOT NULL)"
+            )
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self._cache.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get_context(self, session_id):
+        return self._cache.get(f"context|{session_id}")
+
+    def set_context(self, session_id, context):
+        self._cache.set(f"context|{session_id}", context)
+
+    def add_artifacts(self, session_id, artifacts):
+        for artifact in artifacts:
+            self._cache.set(f"artifact|{session_id}|{artifact['file_id']}", artifact)
+
+    def get_artifact(self, session_id, file_id):
+        return self._cache.get(f"artifact|{session_id}|{file_id}")
+
+    def acquire_lease(self, session_id, owner, ttl):
+        now = time.time()
+        # Taken only if the session is free, its lease expired or owner already holds it
+        with self._connect() as conn:
+            # Leases of crashed workers are never released, so expired ones are removed here
+            conn.execute("DELETE FROM leases WHERE locked_until < ?", (now,))
+            cursor = conn.execute(
+                "INSERT INTO leases (session_id, owner, locked_until) VALUES (?, ?, ?)"
+                " ON CONFLICT(session_id) DO UPDATE SET owner = excluded.owner, locked_until = excluded.locked_until"
+                " WHERE leases.owner = excluded.owner",
+                (session_id, owner, now + ttl),
+            )
+            return cursor.rowcount > 0
+
+    def release_lease(self, session_id, owner):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM leases WHERE session_id = ? AND owner = ?", (session_id, owner))
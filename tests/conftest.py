@@ -0,0 +1,5 @@
+import os
+import tempfile
+
+# Keep the caches of imported modules out of the working directory
+os.environ.setdefault("QA_ASSISTANT_CACHE_DIR", tempfile.mkdtemp(prefix="qa-assistant-tests-"))
@@ -0,0 +1,115 @@
+import asyncio
+import types
+
+import pytest
+
+import assistant
+
+
+class FakeThreads:
+    """
+    Threads of the async client as used by compact_thread.
+    """
+
+    def __init__(self):
+        self.threads = {}
+        self.messages = types.SimpleNamespace(list=self.list_messages)
+
+    async def create(self, messages=()):
+        thread_id = f"thread_{len(self.threads)}"
+        self.threads[thread_id] = [(message["role"], message["content"]) for message in messages]
+        return types.SimpleNamespace(id=thread_id)
+
+    async def list_messages(self, thread_id, order="asc"):
+        for role, text in self.threads[thread_id]:
+            content = types.SimpleNamespace(type="text", text=types.SimpleNamespace(value=text))
+            yield types.SimpleNamespace(role=role, content=[content])
+
+
+@pytest.fixture
+def client(monkeypatch):
+    async def summarize(**kwargs):
+        message = types.SimpleNamespace(content="Summary.")
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)], usage=None)
+
+    client = types.SimpleNamespace(
+        beta=types.SimpleNamespace(threads=FakeThreads()),
+        chat=types.SimpleNamespace(completions=types.SimpleNamespace(create=summarize)),
+    )
+    monkeypatch.setattr(assistant, "get_async_client", lambda: client)
+    return client
+
+
+@pytest.mark.parametrize("keep_turns", [0, 4, 20])
+def test_runs_never_lose_the_summary_to_truncation(client, monkeypatch, keep_turns):
+    monkeypatch.setattr(assistant, "COMPACT_KEEP_TURNS", keep_turns)
+    window = assistant.truncation_window()
+    threads = client.beta.threads.threads
+    context = assistant.new_thread_context(asyncio.run(client.beta.threads.create()).id)
+    for turn in range(50):
+        if assistant.needs_compaction(context):
+            asyncio.run(assistant.compact_thread(context))
+        thread = threads[context["thread_id"]]
+        thread.append(("user", f"question {turn}"))
+        # Every message of the thread, the summary first, is inside the truncation window
+        assert len(thread) <= window
+        if context["compactions"]:
+            assert thread[0] == ("assistant", "Summary of the earlier conversation:\nSummary.")
+        thread.append(("assistant", f"answer {turn}"))
+        context["turns"] += 1
+    assert context["compactions"]
+
+
+def test_turn_trigger_without_truncation_window(monkeypatch):
+    monkeypatch.setattr(assistant, "RUN_TRUNCATION_STRATEGY", {"type": "auto"})
+    monkeypatch.setattr(assistant, "COMPACT_AFTER_TURNS", 30)
+    context = assistant.new_thread_context("thread")
+    context["turns"] = 29
+    assert not assistant.needs_compaction(context)
+    context["turns"] = 30
+    assert assistant.needs_compaction(context)
+
+
+class FakeFiles:
+    """
+    Files API of the sync client as used by upload_documents.
+    """
+
+    def __init__(self):
+        self.files = {}
+        self.created = []
+
+    def create(self, file, purpose):
+        file_id = f"file_{len(self.created)}"
+        self.created.append(file[0])
+        self.files[file_id] = file[1]
+        return types.SimpleNamespace(id=file_id)
+
+    def retrieve(self, file_id):
+        import httpx
+        import openai
+
+        if file_id not in self.files:
+            request = httpx.Request("GET", f"https://api.openai.com/v1/files/{file_id}")
+            raise openai.NotFoundError("No such file", response=httpx.Response(404, request=request), body=None)
+        return types.SimpleNamespace(id=file_id)
+
+
+def test_upload_registry_hits_are_checked(monkeypatch, tmp_path):
+    files = FakeFiles()
+    monkeypatch.setattr(assistant, "get_client", lambda: types.SimpleNamespace(files=files))
+    monkeypatch.setattr(assistant, "upload_registry", assistant.PersistentCache(
+        str(tmp_path / "upload_registry.sqlite3"), ttl=None, max_entries=None,
+    ))
+    documents = [("a.txt", b"a"), ("b.txt", b"b")]
+
+    first = assistant.upload_documents(documents)
+    assert assistant.upload_documents(documents) == first
+    assert sorted(files.created) == ["a.txt", "b.txt"]
+
+    # A file deleted on OpenAI's side is uploaded again and registered under its new ID
+    del files.files[first[0]]
+    second = assistant.upload_documents(documents)
+    assert sorted(files.created) == ["a.txt", "a.txt", "b.txt"]
+    assert second[1] == first[1] and second[0] not in first
+    assert assistant.upload_documents(documents) == second
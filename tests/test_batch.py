@@ -0,0 +1,45 @@
+import json
+
+import batch
+
+
+def write_lines(path, lines):
+    path.write_text("".join(line + "\n" for line in lines), encoding="utf-8")
+
+
+def test_read_questions_applies_defaults_and_skips_invalid_lines(tmp_path):
+    path = tmp_path / "questions.jsonl"
+    write_lines(path, [
+        json.dumps({"question": "Wie hoch ist der Beitrag?", "language": "German", "id": "fees"}),
+        "not json",
+        json.dumps({"question": "  "}),
+        "",
+        json.dumps({"question": "When is the assembly?", "assistant_id": "asst_other"}),
+    ])
+    assert batch.read_questions(str(path), default_assistant_id="asst_default") == [
+        {"id": "fees", "question": "Wie hoch ist der Beitrag?", "language": "German", "assistant_id": "asst_default"},
+        {"id": "line-5", "question": "When is the assembly?", "language": "English", "assistant_id": "asst_other"},
+    ]
+
+
+def test_read_questions_requires_an_assistant(tmp_path):
+    path = tmp_path / "questions.jsonl"
+    write_lines(path, [json.dumps({"question": "Wie hoch ist der Beitrag?"})])
+    assert batch.read_questions(str(path)) == []
+
+
+def test_read_answered_keeps_the_last_record_of_an_id(tmp_path):
+    path = tmp_path / "answers.jsonl"
+    write_lines(path, [
+        json.dumps({"id": "a", "answered": True}),
+        json.dumps({"id": "b", "answered": True}),
+        json.dumps({"id": "b", "answered": False}),
+        json.dumps({"id": "c", "answered": False}),
+        json.dumps({"id": "c", "answered": True}),
+        '{"id": "d", "answ',  # Cut off by an interruption
+    ])
+    assert batch.read_answered(str(path)) == {"a", "c"}
+
+
+def test_read_answered_without_output_file(tmp_path):
+    assert batch.read_answered(str(tmp_path / "missing.jsonl")) == set()
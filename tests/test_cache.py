@@ -0,0 +1,66 @@
+import types
+
+import pytest
+
+import cache
+from cache import PersistentCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache, "time", types.SimpleNamespace(time=lambda: now[0]))
+    return now
+
+
+def test_get_returns_stored_value(tmp_path):
+    store = PersistentCache(str(tmp_path / "cache.sqlite3"))
+    store.set("key", {"content": "text", "links": ["a"]})
+    assert store.get("key") == {"content": "text", "links": ["a"]}
+    assert store.get("missing") is None
+    assert (store.hits, store.misses) == (1, 1)
+
+
+def test_entries_expire_after_ttl(tmp_path, clock):
+    store = PersistentCache(str(tmp_path / "cache.sqlite3"), ttl=60)
+    store.set("key", "value")
+    clock[0] += 60
+    assert store.get("key") == "value"
+    clock[0] += 1
+    assert store.get("key") is None
+    assert store.stats()["entries"] == 0
+
+
+def test_least_recently_used_entry_is_evicted(tmp_path, clock):
+    store = PersistentCache(str(tmp_path / "cache.sqlite3"), max_entries=2)
+    store.set("a", 1)
+    clock[0] += 1
+    store.set("b", 2)
+    clock[0] += 1
+    assert store.get("a") == 1  # Now more recently used than b
+    clock[0] += 1
+    store.set("c", 3)
+    assert store.get("b") is None
+    assert store.get("a") == 1
+    assert store.get("c") == 3
+
+
+def test_purge_expired(tmp_path, clock):
+    store = PersistentCache(str(tmp_path / "cache.sqlite3"), ttl=60)
+    store.set("old", 1)
+    clock[0] += 30
+    store.set("new", 2)
+    clock[0] += 31
+    assert store.purge_expired() == 1
+    assert store.get("new") == 2
+
+
+def test_counters_are_shared_between_instances(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    first, second = PersistentCache(path), PersistentCache(path)
+    first.set("key", "value")
+    assert second.get("key") == "value"
+    first.get("missing")
+    stats = second.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 0)
+    assert (stats["total_hits"], stats["total_misses"]) == (1, 1)
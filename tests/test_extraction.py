@@ -0,0 +1,99 @@
+import pytest
+
+from extraction import PageExtractor, extract_page, normalize_url
+
+PAGE = """<html><head><title>Kurse</title><style>p { color: red }</style></head>
+<body>
+<nav><a href="/">Start</a><a href="/kurse">Kurse</a></nav>
+<main>
+<h1>Weiterbildung</h1>
+<p>Der nächste Kurs zur <b>MWST-Revision</b> findet im März statt.</p>
+<p><a href="anmeldung#formular">Anmeldung</a> <a href="mailto:info@example.com">E-Mail</a></p>
+<script>var tracking = true;</script>
+</main>
+<footer>Impressum</footer>
+</body></html>"""
+
+
+def test_extracts_block_text_without_boilerplate():
+    result = extract_page(PAGE, base_url="https://example.com/kurse/")
+    assert result["content"].splitlines() == [
+        "Kurse",
+        "Weiterbildung",
+        "Der nächste Kurs zur MWST-Revision findet im März statt.",
+        "Anmeldung E-Mail",
+    ]
+
+
+def test_collects_resolved_deduplicated_links():
+    result = extract_page(PAGE, base_url="https://example.com/kurse/")
+    assert result["links"] == [
+        "https://example.com/",
+        "https://example.com/kurse",
+        "https://example.com/kurse/anmeldung",
+    ]
+
+
+def test_base_href_overrides_base_url():
+    result = extract_page('<base href="https://other.org/docs/"><a href="page">x</a>', base_url="https://example.com/")
+    assert result["links"] == ["https://other.org/docs/page"]
+
+
+def test_input_beyond_max_bytes_is_ignored():
+    extractor = PageExtractor(max_bytes=31)
+    assert extractor.feed(b"<p>first paragraph</p>") is True
+    assert extractor.feed(b"<p>second paragraph</p>") is False
+    assert extractor.feed(b"<p>third</p>") is False
+    assert extractor.truncated
+    assert extractor.bytes_read == 31
+    assert extractor.close()["content"] == "first paragraph\nsecond"
+
+
+def test_page_ending_at_max_bytes_is_truncated():
+    extractor = PageExtractor(max_bytes=10)
+    assert extractor.feed(b"<p>text</p>"[:10]) is False
+    assert extractor.truncated
+
+
+def test_character_cut_by_max_bytes_is_dropped():
+    data = "<p>Gebühr</p>".encode()
+    result = extract_page(data, max_bytes=data.index("ü".encode()) + 1)
+    assert result["content"] == "Geb"
+
+
+def test_chunks_split_inside_a_character_are_decoded():
+    data = "<p>Gebühr für Übungen</p>".encode()
+    extractor = PageExtractor()
+    for i in range(len(data)):
+        extractor.feed(data[i:i + 1])
+    assert extractor.close()["content"] == "Gebühr für Übungen"
+
+
+@pytest.mark.parametrize("url, expected", [
+    ("HTTPS://Example.COM:443/Kurse/?b=2&a=1#top", "https://example.com/Kurse?a=1&b=2"),
+    ("http://example.com:80", "http://example.com/"),
+    ("http://example.com:8080/page/", "http://example.com:8080/page"),
+    ("  https://example.com/a?x=  ", "https://example.com/a?x="),
+    ("Example.com/Kurse/", "http://example.com/Kurse"),
+    ("//Example.com/a/", "http://example.com/a"),
+])
+def test_normalize_url(url, expected):
+    assert normalize_url(url) == expected
+
+
+def test_normalize_url_is_idempotent():
+    url = normalize_url("https://example.com/kurse/?z=1&a=2")
+    assert normalize_url(url) == url
+
+
+@pytest.mark.parametrize("url", [
+    "mailto:info@example.com",
+    "tel:+41441234567",
+    "ftp://example.com/file.txt",
+    "/relative/page",
+    "relative/page",
+    "user@example.com",
+    "",
+])
+def test_normalize_url_keeps_other_schemes_and_relative_references(url):
+    assert normalize_url(url) == url
@@ -0,0 +1,70 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+import metrics
+from metrics import percentile
+
+
+def test_percentile_uses_the_nearest_rank():
+    values = list(range(1, 101))
+    assert percentile(values, 0.5) == 50
+    assert percentile(values, 0.95) == 95
+    assert percentile(values, 0.99) == 99
+    assert percentile(values, 0.07) == 7
+    assert percentile(values, 1.0) == 100
+
+
+@pytest.mark.parametrize("fraction, expected", [(0.0, 1), (0.25, 1), (0.5, 2), (0.75, 3), (1.0, 4)])
+def test_percentile_of_few_values(fraction, expected):
+    assert percentile([4, 2, 3, 1], fraction) == expected
+
+
+def test_percentile_without_values():
+    assert percentile([], 0.5) == 0.0
+    assert percentile([], 0.5, default=None) is None
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_exporter_writes_traces_and_prometheus_file_in_the_background(tmp_path):
+    exporter = metrics.MetricsExporter(directory=str(tmp_path), interval=0.05)
+    for i in range(3):
+        exporter.submit(metrics.RequestTrace("test", index=i), 0.1)
+    trace_file = tmp_path / "traces.jsonl"
+    wait_for(lambda: trace_file.exists() and len(trace_file.read_text().splitlines()) == 3)
+    assert [json.loads(line)["attributes"]["index"] for line in trace_file.read_text().splitlines()] == [0, 1, 2]
+    prom_file = tmp_path / f"metrics-{os.getpid()}.prom"
+    wait_for(prom_file.exists)
+    assert f'pid="{os.getpid()}"' in prom_file.read_text()
+
+
+def test_exporter_drops_traces_when_the_queue_is_full(tmp_path):
+    exporter = metrics.MetricsExporter(directory=str(tmp_path), max_queued=1)
+    exporter._pid = os.getpid()  # No writer thread, so the queue fills up
+    dropped = metrics.TRACES_DROPPED_TOTAL.value()
+    exporter.submit(metrics.RequestTrace("test"), 0.1)
+    exporter.submit(metrics.RequestTrace("test"), 0.1)
+    assert metrics.TRACES_DROPPED_TOTAL.value() == dropped + 1
+    exporter.flush()
+    assert len((tmp_path / "traces.jsonl").read_text().splitlines()) == 1
+
+
+def test_stale_prometheus_files_are_removed(tmp_path):
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    stale = tmp_path / f"metrics-{process.pid}.prom"
+    live = tmp_path / f"metrics-{os.getpid()}.prom"
+    stale.write_text("")
+    live.write_text("")
+    metrics.remove_stale_prometheus_files(str(tmp_path))
+    assert not stale.exists() and live.exists()
@@ -0,0 +1,150 @@
+import asyncio
+import os
+import subprocess
+import sys
+
+import httpx
+import pytest
+
+import ratelimit
+from ratelimit import SingleFlight, TokenBucket
+
+
+def test_token_bucket_delays_once_capacity_is_spent():
+    bucket = TokenBucket("test", rate=10, capacity=2)
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.01)
+    assert bucket.reserve() == pytest.approx(0.2, abs=0.01)
+
+
+def test_token_bucket_debit_delays_later_callers():
+    bucket = TokenBucket("test", rate=100, capacity=100)
+    bucket.debit(150)
+    assert bucket.reserve() == pytest.approx(0.51, abs=0.01)
+
+
+def test_token_bucket_refills_up_to_capacity(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(ratelimit.time, "monotonic", lambda: now[0])
+    bucket = TokenBucket("test", rate=1, capacity=5)
+    bucket.reserve(5)
+    now[0] += 100
+    assert bucket.reserve(5) == 0.0
+    assert bucket.reserve(1) == 1.0
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "page"
+
+    async def main():
+        flight = SingleFlight("test")
+        results = await asyncio.gather(*(flight.do("url", fetch) for _ in range(5)))
+        # A call after the first one finished runs again
+        return results, await flight.do("url", fetch)
+
+    results, later = asyncio.run(main())
+    assert results == ["page"] * 5
+    assert later == "page"
+    assert len(calls) == 2
+
+
+def test_single_flight_shares_exceptions():
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("proxy error")
+
+    async def main():
+        flight = SingleFlight("test")
+        return await asyncio.gather(flight.do("url", fail), flight.do("url", fail), return_exceptions=True)
+
+    first, second = asyncio.run(main())
+    assert isinstance(first, ValueError) and first is second
+
+
+def test_single_flight_survives_a_cancelled_caller():
+    async def fetch():
+        await asyncio.sleep(0.02)
+        return "page"
+
+    async def main():
+        flight = SingleFlight("test")
+        first = asyncio.ensure_future(flight.do("url", fetch))
+        second = asyncio.ensure_future(flight.do("url", fetch))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second, first.cancelled()
+
+    assert asyncio.run(main()) == ("page", True)
+
+
+@pytest.mark.parametrize("headers, expected", [
+    ({"retry-after-ms": "1500"}, 1.5),
+    ({"retry-after": "3"}, 3.0),
+    ({"retry-after": "soon"}, None),
+    ({}, None),
+])
+def test_parse_retry_after(headers, expected):
+    assert ratelimit.parse_retry_after(headers) == expected
+
+
+def test_retry_delay_honors_retry_after_up_to_the_limit():
+    assert ratelimit.retry_delay(0, retry_after=2) == 2
+    assert ratelimit.retry_delay(0, retry_after=ratelimit.RETRY_MAX_RETRY_AFTER + 1) is None
+    assert 0 <= ratelimit.retry_delay(10) <= ratelimit.RETRY_MAX_DELAY
+
+
+def responses(*statuses):
+    """
+    Return an httpx mock handler answering with statuses in turn and the requests it saw.
+    """
+    seen = []
+
+    def handler(request):
+        seen.append(request)
+        return httpx.Response(statuses[len(seen) - 1], headers={"retry-after-ms": "1"})
+
+    return handler, seen
+
+
+def test_transports_are_httpx_transports():
+    assert issubclass(ratelimit.RateLimitedTransport, httpx.AsyncBaseTransport)
+    assert issubclass(ratelimit.SyncRateLimitedTransport, httpx.BaseTransport)
+
+
+def test_sync_transport_retries_rate_limited_requests():
+    handler, seen = responses(429, 503, 200)
+    transport = ratelimit.SyncRateLimitedTransport(
+        httpx.MockTransport(handler), TokenBucket("requests", rate=1000), max_retries=4
+    )
+    with httpx.Client(transport=transport) as client:
+        assert client.post("https://api.example.com/v1/threads/t/runs").status_code == 200
+    assert len(seen) == 3
+
+
+def test_async_transport_gives_up_after_max_retries():
+    handler, seen = responses(429, 429, 429)
+
+    async def main():
+        transport = ratelimit.RateLimitedTransport(
+            httpx.MockTransport(handler), TokenBucket("requests", rate=1000), max_retries=2
+        )
+        async with httpx.AsyncClient(transport=transport) as client:
+            return await client.get("https://api.example.com/v1/threads/t/messages")
+
+    assert asyncio.run(main()).status_code == 429
+    assert len(seen) == 3
+
+
+def test_import_does_not_load_httpx():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run(
+        [sys.executable, "-c", "import sys, ratelimit; print('httpx' in sys.modules)"],
+        cwd=root, capture_output=True, text=True, check=True,
+    )
+    assert result.stdout.strip() == "False"
@@ -0,0 +1,106 @@
+import asyncio
+
+import pytest
+
+import resilience
+from resilience import CircuitBreaker, LatencyTracker, hedged
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(resilience.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == "closed" and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+
+def test_breaker_lets_one_trial_through_when_half_open(clock):
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    clock[0] += 30
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow()
+
+
+def test_failed_trial_reopens_the_breaker(clock):
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    clock[0] += 30
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    clock[0] += 29
+    assert not breaker.allow()
+
+
+def test_lost_trial_is_replaced_after_reset_timeout(clock):
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    clock[0] += 30
+    assert breaker.allow()
+    clock[0] += 29
+    assert not breaker.allow()
+    clock[0] += 1
+    assert breaker.allow()
+
+
+def test_latency_tracker_percentile_over_window():
+    tracker = LatencyTracker(window=10)
+    assert tracker.percentile(0.95) is None
+    for seconds in range(1, 21):
+        tracker.observe(seconds)
+    assert len(tracker) == 10
+    assert tracker.percentile(0.5) == 15
+    assert tracker.percentile(0.95) == 20
+
+
+def test_hedged_returns_the_first_accepted_result():
+    async def slow():
+        await asyncio.sleep(1)
+        return "slow"
+
+    async def fast():
+        return "fast"
+
+    assert asyncio.run(hedged([("primary", slow), ("hedge", fast)], delay=0.01)) == ("hedge", "fast")
+
+
+def test_hedged_starts_the_next_attempt_when_one_fails():
+    async def fail():
+        raise ConnectionError("reset")
+
+    async def succeed():
+        return "page"
+
+    assert asyncio.run(hedged([("primary", fail), ("fallback", succeed)], delay=10)) == ("fallback", "page")
+
+
+def test_hedged_raises_the_last_error_if_every_attempt_fails():
+    async def fail():
+        raise ConnectionError("reset")
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(hedged([("primary", fail), ("fallback", fail)], delay=10))
+
+
+def test_hedged_returns_the_last_rejected_result():
+    async def blocked():
+        return 403
+
+    result = asyncio.run(hedged([("primary", blocked), ("fallback", blocked)], delay=10, accept=lambda r: r == 200))
+    assert result == ("fallback", 403)
@@ -0,0 +1,86 @@
+import os
+import subprocess
+import sys
+
+import retrieval
+
+DOCUMENTS = [
+    ("beitraege.txt", "Mitgliederbeiträge\n\nDer Jahresbeitrag für Einzelmitglieder beträgt 120 Franken."),
+    ("kurse.txt", "Kurse\n\nDer nächste Kurs zur MWST-Revision findet im März statt."),
+    ("membership.md", "Membership\n\nRequirements for membership: a registered office in Switzerland."),
+]
+
+
+def test_tokenize_normalizes_and_drops_stopwords():
+    assert retrieval.tokenize("Die Gebühren für Übungen") == ["gebuehren", "uebungen"]
+
+
+def test_tokenize_splits_known_compounds():
+    vocabulary = {"ausbildung", "kurs"}
+    assert retrieval.tokenize("Ausbildungskurs", vocabulary) == ["ausbildungskurs", "ausbildung", "kurs"]
+
+
+def test_chunk_text_keeps_chunks_under_the_limit():
+    text = "\n\n".join(["word " * 30] * 10)
+    chunks = retrieval.chunk_text(text, max_chars=200)
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 200 for chunk in chunks)
+
+
+def test_search_ranks_the_matching_document_first(tmp_path):
+    path = str(tmp_path / "index")
+    retrieval.build_index(path, DOCUMENTS)
+    hits = retrieval.search(path, "Wie hoch ist der Jahresbeitrag?")
+    assert hits[0]["source"] == "beitraege.txt"
+    assert "120 Franken" in hits[0]["text"]
+    assert retrieval.search(path, "membership requirements", top_k=1)[0]["source"] == "membership.md"
+
+
+def test_search_without_matches_or_index(tmp_path):
+    path = str(tmp_path / "index")
+    assert retrieval.search(path, "Jahresbeitrag") == []
+    retrieval.build_index(path, DOCUMENTS)
+    assert retrieval.search(path, "xylophon") == []
+
+
+def test_rebuild_replaces_the_open_index(tmp_path):
+    path = str(tmp_path / "index")
+    retrieval.build_index(path, DOCUMENTS)
+    assert retrieval.search(path, "Jahresbeitrag")
+    retrieval.build_index(path, [("neu.txt", "Die Generalversammlung findet im Juni statt.")])
+    assert retrieval.search(path, "Jahresbeitrag") == []
+    assert retrieval.search(path, "Generalversammlung")[0]["source"] == "neu.txt"
+
+
+
+def test_replaced_index_is_closed(tmp_path):
+    path = str(tmp_path / "index")
+    old = retrieval.build_index(path, DOCUMENTS)
+    assert retrieval.open_index(path) is old
+    new = retrieval.build_index(path, DOCUMENTS)
+    assert retrieval.open_index(path) is new
+    assert old._mmap.closed and not new._mmap.closed
+
+
+def test_replaced_index_stays_open_during_a_search(tmp_path, monkeypatch):
+    path = str(tmp_path / "index")
+    old = retrieval.build_index(path, DOCUMENTS)
+    search = old.search
+
+    def search_during_rebuild(query, top_k=5):
+        retrieval.build_index(path, [("neu.txt", "Die Generalversammlung findet im Juni statt.")])
+        assert not old._mmap.closed
+        return search(query, top_k)
+
+    monkeypatch.setattr(old, "search", search_during_rebuild)
+    assert retrieval.search(path, "Jahresbeitrag")
+    assert old._mmap.closed
+    assert retrieval.search(path, "Generalversammlung")[0]["source"] == "neu.txt"
+
+def test_import_does_not_load_pypdf():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run(
+        [sys.executable, "-c", "import sys, retrieval; print('pypdf' in sys.modules)"],
+        cwd=root, capture_output=True, text=True, check=True,
+    )
+    assert result.stdout.strip() == "False"
@@ -0,0 +1,77 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+import service
+from sessions import InMemorySessionStore, SQLiteSessionStore
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return InMemorySessionStore()
+    return SQLiteSessionStore(str(tmp_path / "sessions.sqlite3"))
+
+
+def test_context_and_artifacts_round_trip(store):
+    assert store.get_context("s1") is None
+    store.set_context("s1", {"thread_id": "thread_1", "turns": 1})
+    store.add_artifacts("s1", [{"kind": "download", "name": "report.csv", "file_id": "file-1"}])
+    assert store.get_context("s1") == {"thread_id": "thread_1", "turns": 1}
+    assert store.get_artifact("s1", "file-1")["name"] == "report.csv"
+    assert store.get_artifact("s2", "file-1") is None
+
+
+def test_lease_is_exclusive_until_released_or_expired(store):
+    assert store.acquire_lease("s1", "a", ttl=60)
+    assert store.acquire_lease("s1", "a", ttl=60)  # Renewed by its owner
+    assert not store.acquire_lease("s1", "b", ttl=60)
+    assert store.acquire_lease("s2", "b", ttl=60)
+    store.release_lease("s1", "b")  # Not the owner
+    assert not store.acquire_lease("s1", "b", ttl=60)
+    store.release_lease("s1", "a")
+    assert store.acquire_lease("s1", "b", ttl=-1)
+    assert store.acquire_lease("s1", "c", ttl=60)  # b's lease expired
+
+
+def test_sqlite_leases_are_shared_and_expired_ones_removed(tmp_path):
+    path = str(tmp_path / "sessions.sqlite3")
+    first, second = SQLiteSessionStore(path), SQLiteSessionStore(path)
+    assert first.acquire_lease("crashed", "a", ttl=-1)
+    assert first.acquire_lease("s1", "a", ttl=60)
+    assert not second.acquire_lease("s1", "b", ttl=60)
+    with sqlite3.connect(path) as conn:
+        sessions = {row[0] for row in conn.execute("SELECT session_id FROM leases")}
+    assert sessions == {"s1"}
+
+
+def test_busy_session_raises_after_the_wait(monkeypatch):
+    monkeypatch.setattr(service, "SESSION_LEASE_WAIT", 0.3)
+    store = InMemorySessionStore()
+    store.acquire_lease("s1", "other worker", ttl=60)
+
+    async def main():
+        async with service.session_lock(store, "s1"):
+            pass
+
+    with pytest.raises(service.SessionBusyError):
+        asyncio.run(main())
+
+
+def test_turns_of_a_session_run_one_at_a_time():
+    store = InMemorySessionStore()
+    active = []
+
+    async def turn(index):
+        async with service.session_lock(store, "s1"):
+            active.append(index)
+            assert len(active) == 1
+            await asyncio.sleep(0.01)
+            active.remove(index)
+
+    async def main():
+        await asyncio.gather(*(turn(i) for i in range(5)))
+
+    asyncio.run(main())
+    assert store.acquire_lease("s1", "next", ttl=60)